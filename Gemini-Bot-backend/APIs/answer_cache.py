@@ -0,0 +1,331 @@
+import asyncio
+import hashlib
+import re
+import sys
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+import numpy as np
+from decouple import config
+
+WHITESPACE_RE = re.compile(r"\s+")
+# Tokens holding a digit (dates, amounts, part numbers); a semantic match must agree on all of them
+NUMERIC_TOKEN_RE = re.compile(r"\w*\d[\w.,/-]*")
+_ENTRY_OVERHEAD = 200
+
+_answer_cache = None
+_answer_cache_lock = threading.Lock()
+
+
+def normalize_question(question):
+    """
+    Case- and whitespace-insensitive form of a question, ignoring trailing punctuation
+    """
+    return WHITESPACE_RE.sub(" ", (question or "").lower()).strip().rstrip("?!. ")
+
+
+def _value_bytes(value):
+    if isinstance(value, dict):
+        return sum(sys.getsizeof(v) for v in value.values()) + sys.getsizeof(value)
+    return sys.getsizeof(value)
+
+
+class _Call:
+    # A concurrent Future, so waiters can block on it from threads or await it from any event loop
+    def __init__(self):
+        self.future = Future()
+
+
+class _Entry:
+    __slots__ = ("value", "group", "numbers", "vector", "expires", "nbytes")
+
+    def __init__(self, value, group, numbers, vector, expires, nbytes):
+        self.value = value
+        self.group = group
+        self.numbers = numbers
+        self.vector = vector
+        self.expires = expires
+        self.nbytes = nbytes
+
+
+class AnswerCache:
+    """
+    Per-process cache of generated answers with an exact and a semantic tier.
+
+    Entries are keyed by (scope, normalized question, model, prompt version), where
+    the scope names what the answer was generated from (a document hash, a system
+    prompt). When the question's embedding is given, a miss on the exact key can
+    still return the answer to an earlier question in the same scope, model and
+    prompt version whose embedding has at least ``semantic_threshold`` cosine
+    similarity. Entries expire after ``ttl`` seconds and the least recently used
+    are evicted beyond ``max_bytes``.
+
+    ``get_or_compute`` runs concurrent misses for the same key once: the first
+    caller generates the answer and the others wait for its result.
+    ``aget_or_compute`` does the same for coroutines and shares the calls in
+    flight with it.
+    ``get_exact`` and ``get_similar`` look the two tiers up separately, so a
+    caller can skip embedding the question when the exact tier already answers.
+    """
+
+    def __init__(self, max_bytes, ttl=3600, semantic_threshold=0.95):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.semantic_threshold = semantic_threshold
+        self._entries = OrderedDict()
+        self._groups = {}
+        self._bytes = 0
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.exact_hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    @staticmethod
+    def key(scope, question, model, prompt_version):
+        parts = (str(scope), normalize_question(question), str(model), str(prompt_version))
+        return hashlib.sha256("\x1f".join(parts).encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def _group(scope, model, prompt_version):
+        return str(scope), str(model), str(prompt_version)
+
+    def get(self, scope, question, model, prompt_version, vector=None):
+        """
+        Return the cached answer, or None on a miss
+        """
+        key = self.key(scope, question, model, prompt_version)
+        with self._lock:
+            value = self._lookup(key, self._group(scope, model, prompt_version), question, vector)
+            if value is None:
+                self.misses += 1
+            return value
+
+    def get_exact(self, scope, question, model, prompt_version):
+        """
+        Return the answer cached under the exact key, or None; a None is not counted as a miss
+        since ``get_similar`` is expected to follow
+        """
+        key = self.key(scope, question, model, prompt_version)
+        with self._lock:
+            return self._exact(key)
+
+    def get_similar(self, scope, question, model, prompt_version, vector):
+        """
+        Return the answer to a near-identical question from the semantic tier, or None on a miss
+        """
+        with self._lock:
+            value = self._similar(self._group(scope, model, prompt_version), question, vector)
+            if value is None:
+                self.misses += 1
+            return value
+
+    def put(self, scope, question, model, prompt_version, value, vector=None):
+        key = self.key(scope, question, model, prompt_version)
+        group = self._group(scope, model, prompt_version)
+        if vector is not None:
+            vector = np.asarray(vector, dtype=np.float32)
+            vector = vector / max(float(np.linalg.norm(vector)), 1e-12)
+        nbytes = _value_bytes(value) + _ENTRY_OVERHEAD + (vector.nbytes if vector is not None else 0)
+        entry = _Entry(value, group, frozenset(NUMERIC_TOKEN_RE.findall((question or "").lower())), vector,
+                       time.monotonic() + self.ttl, nbytes)
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            if nbytes > self.max_bytes:
+                return
+            self._entries[key] = entry
+            self._groups.setdefault(group, set()).add(key)
+            self._bytes += nbytes
+            while self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+
+    def _join(self, scope, question, model, prompt_version, vector, prepare):
+        """
+        Look the question up, or join the call computing its answer. Returns
+        (value, call, leader): the cached value and no call on a hit, otherwise the
+        call in flight for the key and whether this caller has to compute it.
+        """
+        key = self.key(scope, question, model, prompt_version)
+        with self._lock:
+            if prepare is None:
+                value = self._lookup(key, self._group(scope, model, prompt_version), question, vector)
+            else:
+                value = self._exact(key)
+            if value is not None:
+                return value, None, False
+            call = self._calls.get(key)
+            if call is not None:
+                self.coalesced += 1
+                return None, call, False
+            if prepare is None:
+                self.misses += 1
+            call = self._calls[key] = _Call()
+            return None, call, True
+
+    def _finish(self, scope, question, model, prompt_version, call, value=None, vector=None, error=None):
+        try:
+            if error is None and value is not None:
+                self.put(scope, question, model, prompt_version, value, vector=vector)
+        finally:
+            with self._lock:
+                self._calls.pop(self.key(scope, question, model, prompt_version), None)
+            if error is None:
+                call.future.set_result(value)
+            else:
+                call.future.set_exception(error)
+
+    def get_or_compute(self, scope, question, model, prompt_version, compute, vector=None, prepare=None):
+        """
+        Return the cached answer or ``compute()`` it, sharing one call between
+        concurrent requests for the same key.
+
+        With ``prepare``, only the exact tier is checked up front. On a miss the
+        first caller runs ``prepare()`` for a (state, vector) pair, e.g. the
+        retrieved chunks and the question embedding retrieval computed, checks the
+        semantic tier with that vector and otherwise calls ``compute(state)``.
+        """
+        value, call, leader = self._join(scope, question, model, prompt_version, vector, prepare)
+        if call is None:
+            return value
+        if not leader:
+            return call.future.result()
+
+        try:
+            if prepare is None:
+                value = compute()
+            else:
+                state, vector = prepare()
+                value = self.get_similar(scope, question, model, prompt_version, vector)
+                if value is None:
+                    value = compute(state)
+        except BaseException as e:
+            self._finish(scope, question, model, prompt_version, call, error=e)
+            raise
+        self._finish(scope, question, model, prompt_version, call, value, vector)
+        return value
+
+    async def aget_or_compute(self, scope, question, model, prompt_version, compute, prepare):
+        """
+        ``get_or_compute`` with ``prepare()`` and ``compute(state)`` coroutine
+        functions; waiting for another caller's answer does not block the event loop
+        """
+        value, call, leader = self._join(scope, question, model, prompt_version, None, prepare)
+        if call is None:
+            return value
+        if not leader:
+            return await asyncio.wrap_future(call.future)
+
+        vector = None
+        try:
+            state, vector = await prepare()
+            value = self.get_similar(scope, question, model, prompt_version, vector)
+            if value is None:
+                value = await compute(state)
+        except BaseException as e:
+            # Also a cancelled request, whose waiters would otherwise wait forever
+            self._finish(scope, question, model, prompt_version, call, error=e)
+            raise
+        self._finish(scope, question, model, prompt_version, call, value, vector)
+        return value
+
+    def _lookup(self, key, group, question, vector):
+        value = self._exact(key)
+        if value is None:
+            value = self._similar(group, question, vector)
+        return value
+
+    def _exact(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry.expires > time.monotonic():
+            self._entries.move_to_end(key)
+            self.exact_hits += 1
+            return entry.value
+        self._remove(key)
+        return None
+
+    def _similar(self, group, question, vector):
+        now = time.monotonic()
+        if vector is None or self.semantic_threshold <= 0 or not self._groups.get(group):
+            return None
+        numbers = frozenset(NUMERIC_TOKEN_RE.findall((question or "").lower()))
+        candidates = []
+        for candidate_key in list(self._groups[group]):
+            candidate = self._entries[candidate_key]
+            if candidate.expires <= now:
+                self._remove(candidate_key)
+            elif candidate.vector is not None and candidate.numbers == numbers:
+                candidates.append(candidate_key)
+        if not candidates:
+            return None
+
+        query = np.asarray(vector, dtype=np.float32)
+        query = query / max(float(np.linalg.norm(query)), 1e-12)
+        similarities = np.stack([self._entries[k].vector for k in candidates]) @ query
+        best = int(np.argmax(similarities))
+        if similarities[best] < self.semantic_threshold:
+            return None
+        self._entries.move_to_end(candidates[best])
+        self.semantic_hits += 1
+        return self._entries[candidates[best]].value
+
+    def _remove(self, key):
+        entry = self._entries.pop(key)
+        self._bytes -= entry.nbytes
+        keys = self._groups.get(entry.group)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._groups[entry.group]
+
+    def invalidate_scope(self, scope):
+        with self._lock:
+            for key in [k for k, e in self._entries.items() if e.group[0] == str(scope)]:
+                self._remove(key)
+
+    def invalidate_prefix(self, prefix):
+        """
+        Drop every entry whose scope starts with ``prefix``
+        """
+        with self._lock:
+            for key in [k for k, e in self._entries.items() if e.group[0].startswith(prefix)]:
+                self._remove(key)
+
+    def stats(self):
+        with self._lock:
+            hits = self.exact_hits + self.semantic_hits
+            lookups = hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "exact_hits": self.exact_hits,
+                "semantic_hits": self.semantic_hits,
+                "misses": self.misses,
+                "coalesced": self.coalesced,
+                "hit_rate": hits / lookups if lookups else 0.0,
+            }
+
+    def __len__(self):
+        return len(self._entries)
+
+
+def get_answer_cache():
+    """
+    The process-wide answer cache, or None when ANSWER_CACHE_ENABLED is off
+    """
+    global _answer_cache
+    if not config("ANSWER_CACHE_ENABLED", default=True, cast=bool):
+        return None
+    with _answer_cache_lock:
+        if _answer_cache is None:
+            _answer_cache = AnswerCache(
+                config("ANSWER_CACHE_MAX_MB", default=64, cast=int) * 1024 * 1024,
+                ttl=config("ANSWER_CACHE_TTL_SECONDS", default=3600, cast=int),
+                semantic_threshold=config("ANSWER_CACHE_SEMANTIC_THRESHOLD", default=0.95, cast=float),
+            )
+        return _answer_cache
@@ -0,0 +1,46 @@
+import asyncio
+import functools
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from decouple import config
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    """
+    Bounded thread pool for the blocking steps of async views (PDF parsing,
+    image decoding, FAISS, the ORM), so they never stall the event loop
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=config("ASYNC_BLOCKING_WORKERS", default=8, cast=int),
+                thread_name_prefix="blocking",
+            )
+        return _executor
+
+
+async def run_blocking(func, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_executor(), functools.partial(func, *args, **kwargs))
+
+
+def request_data(request):
+    """
+    The request's JSON body or form fields and uploaded files, like DRF's ``request.data``
+    """
+    if request.content_type == "application/json":
+        return json.loads(request.body or b"{}")
+    data = request.POST.dict()
+    data.update(request.FILES.dict())
+    return data
+
+
+async def aiter_values(values):
+    for value in values:
+        yield value
@@ -0,0 +1,71 @@
+import json
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from decouple import config
+from django.db import close_old_connections
+
+
+def parse_items(data, name):
+    """
+    The list sent as ``name``: a JSON array, repeated form fields, or a JSON-encoded string
+    """
+    if hasattr(data, "getlist"):
+        items = data.getlist(name)
+    else:
+        items = data.get(name)
+    if isinstance(items, str):
+        items = [items]
+    if not isinstance(items, list):
+        return []
+    if len(items) == 1 and isinstance(items[0], str) and items[0].lstrip().startswith("["):
+        items = json.loads(items[0])
+    return [str(item) for item in items if str(item).strip()]
+
+
+def check_items(items, name):
+    """
+    Error message for a batch that is empty or too large, else None
+    """
+    max_items = config("BATCH_MAX_ITEMS", default=100, cast=int)
+    if not items:
+        return f"No {name} given"
+    if len(items) > max_items:
+        return f"Too many {name}: {len(items)} (at most {max_items})"
+    return None
+
+
+def _run_item(func, item):
+    # Batch threads are not request threads, so nothing else closes the
+    # database connections they open (recording queries, loading documents)
+    close_old_connections()
+    try:
+        return func(item)
+    finally:
+        close_old_connections()
+
+
+def run_batch(items, func, concurrency, key="item"):
+    """
+    Run ``func`` on every item, at most ``concurrency`` at a time, and yield a
+    result dict per item (``index``, the item under ``key`` and ``generated_text``
+    or ``error``) in completion order. Items not started yet are cancelled when the caller stops early.
+    """
+    executor = ThreadPoolExecutor(max_workers=max(1, min(concurrency, len(items))), thread_name_prefix="batch")
+    try:
+        futures = {executor.submit(_run_item, func, item): index for index, item in enumerate(items)}
+        for future in as_completed(futures):
+            index = futures[future]
+            result = {"index": index, key: items[index]}
+            error = future.exception()
+            if error is None:
+                result["generated_text"] = future.result()
+            else:
+                print(f"Batch item {index} failed: {error}")
+                result["error"] = str(error)
+            yield result
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def ordered(results):
+    return sorted(results, key=lambda result: result["index"])
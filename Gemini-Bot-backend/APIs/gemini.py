@@ -0,0 +1,26 @@
+import google.generativeai as genai
+from decouple import config
+
+
+def get_api_base_url():
+    """
+    Alternative Gemini API endpoint (a proxy, or the benchmark fake server), empty for the real API
+    """
+    return config("GEMINI_API_BASE_URL", default="")
+
+
+def configure_genai(api_key):
+    base_url = get_api_base_url()
+    if base_url:
+        # gRPC cannot reach a plain HTTP endpoint
+        genai.configure(api_key=api_key, transport="rest", client_options={"api_endpoint": base_url})
+    else:
+        genai.configure(api_key=api_key)
+
+
+def langchain_client_options():
+    """
+    Extra keyword arguments for the LangChain Gemini chat and embedding models
+    """
+    base_url = get_api_base_url()
+    return {"base_url": base_url} if base_url else {}
@@ -0,0 +1,411 @@
+import atexit
+import json
+import os
+import threading
+import time
+import uuid
+import weakref
+from bisect import bisect_left
+from contextlib import contextmanager
+
+from decouple import config
+from django.utils.deprecation import MiddlewareMixin
+
+REQUEST_SECONDS = "gemini_bot_request_seconds"
+STAGE_SECONDS = "gemini_bot_stage_seconds"
+UPSTREAM_CALLS = "gemini_bot_upstream_calls_total"
+UPSTREAM_RETRIES = "gemini_bot_upstream_retries_total"
+TOKENS = "gemini_bot_tokens_total"
+CONTEXT_TOKENS = "gemini_bot_context_tokens_total"
+IMAGE_BYTES = "gemini_bot_image_bytes_total"
+
+HISTOGRAM = "histogram"
+COUNTER = "counter"
+METRICS = {
+    REQUEST_SECONDS: (HISTOGRAM, "Time until a view returned its response, by view and status."),
+    STAGE_SECONDS: (HISTOGRAM, "Time spent in one stage of answering a request, by endpoint and stage."),
+    UPSTREAM_CALLS: (COUNTER, "Calls to the Gemini API, by API, model and outcome."),
+    UPSTREAM_RETRIES: (COUNTER, "Gemini API calls retried after a retryable error."),
+    TOKENS: (COUNTER, "Prompt and output tokens, as reported by the API or estimated when it does not say."),
+    CONTEXT_TOKENS: (COUNTER, "Estimated tokens of retrieved context sent to the model and left out by packing."),
+    IMAGE_BYTES: (COUNTER, "Bytes of uploaded images before and after they were downscaled and re-encoded."),
+}
+# Seconds; LLM answers take seconds, index builds of large PDFs minutes
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+_metrics = None
+_metrics_lock = threading.Lock()
+
+
+def _labels(labels):
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+class Metrics:
+    """
+    Counters and histograms aggregated without locks on the hot path.
+
+    Every thread writes to its own shard (a dict of counters and one of
+    histogram lists), so an update is a couple of dict and list operations on
+    data no other thread writes. ``snapshot`` copies and sums the shards; the
+    shards of finished threads are folded into one so short-lived request
+    threads do not pile up.
+
+    With ``directory`` set, each process dumps its snapshot to its own file
+    there every ``flush_interval`` seconds and on exit, and ``collect`` adds the
+    files of the other processes, so every gunicorn worker serves the totals of
+    all of them. Files of exited workers are kept so counters never go back;
+    clear the directory when the service is redeployed.
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS, directory=None, flush_interval=5.0):
+        self.buckets = tuple(buckets)
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self._reset()
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+            atexit.register(self.flush)
+        if hasattr(os, "register_at_fork"):
+            # A forked worker starts from zero instead of counting its parent's values again
+            os.register_at_fork(after_in_child=self._reset)
+
+    def _reset(self):
+        self._local = threading.local()
+        self._shards = []
+        self._shards_lock = threading.Lock()
+        self._retired = ({}, {})
+        self._fold_at = 64
+        self._file = None
+        self._flusher = None
+
+    def _shard(self):
+        shard = getattr(self._local, "shard", None)
+        if shard is None:
+            shard = self._local.shard = ({}, {})
+            with self._shards_lock:
+                self._shards.append((weakref.ref(threading.current_thread()), shard))
+                if len(self._shards) >= self._fold_at:
+                    self._fold_locked()
+                    self._fold_at = max(64, len(self._shards) * 2)
+            self._ensure_flusher()
+        return shard
+
+    def _fold_locked(self):
+        alive = []
+        for ref, shard in self._shards:
+            thread = ref()
+            if thread is not None and thread.is_alive():
+                alive.append((ref, shard))
+            else:
+                _merge_into(self._retired, shard)
+        self._shards = alive
+
+    def inc(self, name, value=1, **labels):
+        counters = self._shard()[0]
+        key = (name, _labels(labels))
+        counters[key] = counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        histograms = self._shard()[1]
+        key = (name, _labels(labels))
+        values = histograms.get(key)
+        if values is None:
+            # Bucket counts (the last one is +Inf), then sum and count
+            values = histograms[key] = [0] * (len(self.buckets) + 3)
+        values[bisect_left(self.buckets, value)] += 1
+        values[-2] += value
+        values[-1] += 1
+
+    def snapshot(self):
+        """
+        This process's totals as ({(name, labels): value}, {(name, labels): [buckets..., sum, count]})
+        """
+        total = ({}, {})
+        with self._shards_lock:
+            self._fold_locked()
+            _merge_into(total, self._retired)
+            shards = [shard for _, shard in self._shards]
+        for shard in shards:
+            # dict() and list() copies are atomic in CPython, the owning thread may keep writing
+            _merge_into(total, (dict(shard[0]), {key: list(values) for key, values in dict(shard[1]).items()}))
+        return total
+
+    def _path(self):
+        if self._file is None:
+            self._file = os.path.join(self.directory, f"{os.getpid()}-{uuid.uuid4().hex[:8]}.json")
+        return self._file
+
+    def flush(self):
+        """
+        Write this process's snapshot to its file in ``directory``
+        """
+        if not self.directory:
+            return
+        counters, histograms = self.snapshot()
+        payload = {
+            "buckets": self.buckets,
+            "counters": [[name, labels, value] for (name, labels), value in counters.items()],
+            "histograms": [[name, labels, values] for (name, labels), values in histograms.items()],
+        }
+        path = self._path()
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(payload, f)
+        os.replace(tmp_path, path)
+
+    def _ensure_flusher(self):
+        if not self.directory or self._flusher is not None:
+            return
+        with self._shards_lock:
+            if self._flusher is not None:
+                return
+            self._flusher = threading.Thread(target=self._flush_loop, name="metrics-flush", daemon=True)
+        self._flusher.start()
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Could not write metrics: {e}")
+
+    def collect(self):
+        """
+        Totals of this process plus, in multiprocess mode, the last dumps of every other process
+        """
+        total = self.snapshot()
+        if not self.directory:
+            return total
+        own = self._path()
+        for filename in os.listdir(self.directory):
+            path = os.path.join(self.directory, filename)
+            if not filename.endswith(".json") or path == own:
+                continue
+            try:
+                with open(path) as f:
+                    payload = json.load(f)
+            except (OSError, ValueError):
+                continue
+            if tuple(payload.get("buckets", ())) != self.buckets:
+                continue
+            _merge_into(total, (
+                {(name, tuple(map(tuple, labels))): value for name, labels, value in payload["counters"]},
+                {(name, tuple(map(tuple, labels))): values for name, labels, values in payload["histograms"]},
+            ))
+        return total
+
+    def render(self):
+        """
+        Prometheus text exposition format of ``collect()``
+        """
+        counters, histograms = self.collect()
+        lines = []
+        for name, (kind, help_text) in METRICS.items():
+            series = counters if kind == COUNTER else histograms
+            keys = sorted(key for key in series if key[0] == name)
+            if not keys:
+                continue
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for key in keys:
+                labels = key[1]
+                if kind == COUNTER:
+                    lines.append(f"{name}{_format_labels(labels)} {_format_value(series[key])}")
+                    continue
+                values = series[key]
+                cumulative = 0
+                for bound, count in zip(self.buckets + ("+Inf",), values):
+                    cumulative += count
+                    le = bound if bound == "+Inf" else _format_value(bound)
+                    lines.append(f"{name}_bucket{_format_labels(labels + (('le', le),))} {cumulative}")
+                lines.append(f"{name}_sum{_format_labels(labels)} {_format_value(values[-2])}")
+                lines.append(f"{name}_count{_format_labels(labels)} {values[-1]}")
+        return "\n".join(lines) + "\n"
+
+
+def _merge_into(total, shard):
+    counters, histograms = total
+    for key, value in shard[0].items():
+        counters[key] = counters.get(key, 0) + value
+    for key, values in shard[1].items():
+        existing = histograms.get(key)
+        if existing is None:
+            histograms[key] = list(values)
+        else:
+            for i, value in enumerate(values):
+                existing[i] += value
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    escaped = (value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"') for _, value in labels)
+    return "{" + ",".join(f'{key}="{value}"' for (key, _), value in zip(labels, escaped)) + "}"
+
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def get_metrics():
+    """
+    The process-wide metrics, or None when METRICS_ENABLED is off
+    """
+    global _metrics
+    if not config("METRICS_ENABLED", default=True, cast=bool):
+        return None
+    with _metrics_lock:
+        if _metrics is None:
+            _metrics = Metrics(
+                directory=config("METRICS_DIR", default="") or None,
+                flush_interval=config("METRICS_FLUSH_SECONDS", default=5.0, cast=float),
+            )
+        return _metrics
+
+
+def observe_stage(endpoint, stage, seconds):
+    metrics = get_metrics()
+    if metrics is None:
+        return
+    metrics.observe(STAGE_SECONDS, seconds, endpoint=endpoint, stage=stage)
+    if config("METRICS_LOG_SPANS", default=False, cast=bool):
+        print(json.dumps({"span": stage, "endpoint": endpoint, "ms": round(seconds * 1000, 1)}))
+
+
+@contextmanager
+def span(endpoint, stage):
+    """
+    Time the block as ``stage`` of ``endpoint`` (chat, image or pdf), failed or not
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(endpoint, stage, time.perf_counter() - started)
+
+
+@contextmanager
+def upstream_call(api, model):
+    """
+    Count a Gemini API call by outcome
+    """
+    try:
+        yield
+    except Exception:
+        count_upstream(api, model, "error")
+        raise
+    count_upstream(api, model, "ok")
+
+
+def count_upstream(api, model, status):
+    metrics = get_metrics()
+    if metrics is not None:
+        metrics.inc(UPSTREAM_CALLS, api=api, model=model, status=status)
+
+
+def count_retry(api):
+    metrics = get_metrics()
+    if metrics is not None:
+        metrics.inc(UPSTREAM_RETRIES, api=api)
+
+
+def count_tokens(endpoint, prompt_tokens=0, output_tokens=0):
+    metrics = get_metrics()
+    if metrics is None:
+        return
+    if prompt_tokens:
+        metrics.inc(TOKENS, prompt_tokens, endpoint=endpoint, kind="prompt")
+    if output_tokens:
+        metrics.inc(TOKENS, output_tokens, endpoint=endpoint, kind="output")
+
+
+def count_context(endpoint, sent_tokens, saved_tokens):
+    """
+    Count the context tokens a packed prompt kept and the ones packing left out
+    """
+    metrics = get_metrics()
+    if metrics is None:
+        return
+    metrics.inc(CONTEXT_TOKENS, sent_tokens, endpoint=endpoint, kind="sent")
+    metrics.inc(CONTEXT_TOKENS, saved_tokens, endpoint=endpoint, kind="saved")
+    if config("METRICS_LOG_SPANS", default=False, cast=bool):
+        print(json.dumps({"context": endpoint, "sent_tokens": sent_tokens, "saved_tokens": saved_tokens}))
+
+
+def count_image(source_bytes, prepared_bytes):
+    """
+    Count the bytes of an uploaded image and of the blobs prepared from it for the vision model
+    """
+    metrics = get_metrics()
+    if metrics is None:
+        return
+    metrics.inc(IMAGE_BYTES, source_bytes, kind="source")
+    metrics.inc(IMAGE_BYTES, prepared_bytes, kind="prepared")
+
+
+def count_usage(endpoint, usage):
+    """
+    Count tokens from a google-generativeai ``usage_metadata``; returns False when there is none
+    """
+    prompt_tokens = getattr(usage, "prompt_token_count", 0) or 0
+    output_tokens = getattr(usage, "candidates_token_count", 0) or 0
+    if not prompt_tokens and not output_tokens:
+        return False
+    count_tokens(endpoint, prompt_tokens, output_tokens)
+    return True
+
+
+class MetricsMiddleware(MiddlewareMixin):
+    """
+    Time every request until its view returns, by URL name, method and status
+    """
+
+    def process_request(self, request):
+        request._metrics_started = time.perf_counter()
+
+    def process_response(self, request, response):
+        started = getattr(request, "_metrics_started", None)
+        metrics = get_metrics()
+        if started is not None and metrics is not None:
+            match = getattr(request, "resolver_match", None)
+            view = match.url_name if match is not None and match.url_name else "unmatched"
+            metrics.observe(REQUEST_SECONDS, time.perf_counter() - started, view=view, method=request.method,
+                            status=response.status_code)
+        return response
+
+
+def timed_chunks(chunks, endpoint, stage="generate", started=None):
+    """
+    Pass a stream of chunks through, timing its first chunk (``first_token``)
+    and the whole of it (``stage``) from ``started`` or from the first ``next``
+    """
+    if started is None:
+        started = time.perf_counter()
+    first = True
+    try:
+        for chunk in chunks:
+            if first:
+                observe_stage(endpoint, "first_token", time.perf_counter() - started)
+                first = False
+            yield chunk
+    finally:
+        observe_stage(endpoint, stage, time.perf_counter() - started)
+
+
+async def atimed_chunks(chunks, endpoint, stage="generate", started=None):
+    """
+    ``timed_chunks`` for async iterators
+    """
+    if started is None:
+        started = time.perf_counter()
+    first = True
+    try:
+        async for chunk in chunks:
+            if first:
+                observe_stage(endpoint, "first_token", time.perf_counter() - started)
+                first = False
+            yield chunk
+    finally:
+        observe_stage(endpoint, stage, time.perf_counter() - started)
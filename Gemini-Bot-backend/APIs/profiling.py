@@ -0,0 +1,256 @@
+import hmac
+import os
+import random
+import sys
+import sysconfig
+import threading
+import time
+from datetime import datetime
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from decouple import config
+from django.conf import settings
+from django.http import Http404
+from django.urls import resolve
+
+_rotate_lock = threading.Lock()
+
+
+class StackSampler(threading.Thread):
+    """
+    Statistical profiler for one thread: every ``interval`` seconds it reads
+    that thread's current stack from ``sys._current_frames()`` and counts it
+    as a folded stack ("outer;...;inner"). The profiled thread runs untouched,
+    so the cost is one stack walk per sample on this thread, not a hook on
+    every call like cProfile.
+    """
+
+    def __init__(self, thread_id, interval=0.005, max_seconds=300.0):
+        super().__init__(name="profile-sampler", daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.max_seconds = max_seconds
+        self.stacks = {}
+        self.samples = 0
+        # Frame labels by code object, so a sample costs dict lookups rather than string formatting
+        self._labels = {}
+        self._done = threading.Event()
+
+    def run(self):
+        deadline = time.monotonic() + self.max_seconds
+        while not self._done.wait(self.interval) and time.monotonic() < deadline:
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                label = self._labels.get(code)
+                if label is None:
+                    label = self._labels[code] = f"{code.co_name} ({_short_path(code.co_filename)}:{code.co_firstlineno})"
+                stack.append(label)
+                frame = frame.f_back
+            key = ";".join(reversed(stack))
+            self.stacks[key] = self.stacks.get(key, 0) + 1
+            self.samples += 1
+
+    def stop(self):
+        self._done.set()
+        self.join()
+        return self.stacks
+
+
+def _short_path(path):
+    """
+    Paths relative to the project, site-packages or the standard library, so frames read the same on every machine
+    """
+    roots = (str(settings.BASE_DIR),) + tuple(p for p in sys.path if p.endswith("-packages"))
+    for root in roots + (sysconfig.get_paths()["stdlib"],):
+        if path.startswith(root):
+            return path[len(root):].lstrip(os.sep)
+    return path
+
+
+def _size_tag(size):
+    """
+    Request body size rounded up to a power of two, e.g. 0B, 512B, 64KiB, 8MiB
+    """
+    if size <= 0:
+        return "0B"
+    bound = 1 << (size - 1).bit_length()
+    for unit in ("B", "KiB", "MiB"):
+        if bound < 1024:
+            return f"{bound}{unit}"
+        bound //= 1024
+    return f"{bound}GiB"
+
+
+def write_profile(directory, stacks, view, method, size, elapsed, max_files):
+    """
+    Write folded stacks to ``directory`` (FlameGraph's flamegraph.pl and speedscope read them as is) and delete the
+    oldest profiles beyond ``max_files``
+    """
+    os.makedirs(directory, exist_ok=True)
+    timestamp = datetime.now().strftime("%Y%m%d-%H%M%S-%f")
+    name = f"{timestamp}-{view}-{method}-{_size_tag(size)}-{round(elapsed * 1000)}ms-{os.getpid()}.folded"
+    path = os.path.join(directory, name)
+    with open(path + ".tmp", "w") as f:
+        for stack, count in sorted(stacks.items()):
+            f.write(f"{stack} {count}\n")
+    os.replace(path + ".tmp", path)
+    with _rotate_lock:
+        # Names start with the timestamp, so sorting them sorts by age
+        profiles = sorted(filename for filename in os.listdir(directory) if filename.endswith(".folded"))
+        for filename in profiles[:max(0, len(profiles) - max_files)]:
+            try:
+                os.remove(os.path.join(directory, filename))
+            except OSError:
+                pass
+    return path
+
+
+class ProfilingMiddleware:
+    """
+    Profile a sample of requests (PROFILE_SAMPLE_RATE) and every request whose
+    PROFILE_HEADER carries PROFILE_TOKEN, writing one folded-stack file per
+    request to PROFILE_DIR tagged with the view, method, body size and time.
+
+    Requests that are not picked cost one random number and a header lookup.
+    The sampler watches the thread the view runs on (under ASGI, the request's
+    thread for sync views and the event loop for async ones, whose profile then
+    also holds the other coroutines running meanwhile) and follows whichever
+    thread consumes a streamed response, so answer generation is included.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.sample_rate = config("PROFILE_SAMPLE_RATE", default=0.0, cast=float)
+        self.token = config("PROFILE_TOKEN", default="")
+        self.header = "HTTP_" + config("PROFILE_HEADER", default="X-Profile-Token").upper().replace("-", "_")
+        self.directory = config("PROFILE_DIR", default="") or str(settings.BASE_DIR / "profiles")
+        self.interval = config("PROFILE_INTERVAL_MS", default=5.0, cast=float) / 1000
+        self.max_seconds = config("PROFILE_MAX_SECONDS", default=300.0, cast=float)
+        self.max_files = config("PROFILE_MAX_FILES", default=500, cast=int)
+        # Bounds the sampler threads when a burst of requests is picked at once
+        self._slots = threading.BoundedSemaphore(config("PROFILE_MAX_CONCURRENT", default=4, cast=int))
+        self.enabled = self.sample_rate > 0 or bool(self.token)
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def _wanted(self, request):
+        if self.sample_rate > 0 and random.random() < self.sample_rate:
+            return True
+        if self.token:
+            value = request.META.get(self.header)
+            return value is not None and hmac.compare_digest(value.encode(), self.token.encode())
+        return False
+
+    def _pick(self, request):
+        """
+        Whether to profile this request; takes a slot that ``_finish`` gives back
+        """
+        return self.enabled and self._wanted(request) and self._slots.acquire(blocking=False)
+
+    def _sample(self, thread_id):
+        sampler = StackSampler(thread_id, self.interval, self.max_seconds)
+        sampler.started = time.perf_counter()
+        sampler.start()
+        return sampler
+
+    async def _view_thread(self, request):
+        """
+        The thread the view of this request will run on under ASGI: Django runs sync views in the request's
+        thread-sensitive thread, which a call to ``sync_to_async`` reaches as well
+        """
+        try:
+            match = resolve(request.path_info, getattr(request, "urlconf", None))
+        except Http404:
+            return threading.get_ident()
+        if iscoroutinefunction(match.func):
+            return threading.get_ident()
+        return await sync_to_async(threading.get_ident)()
+
+    def _finish(self, sampler, request):
+        try:
+            stacks = sampler.stop()
+            elapsed = time.perf_counter() - sampler.started
+            match = getattr(request, "resolver_match", None)
+            view = match.url_name if match is not None and match.url_name else "unmatched"
+            size = int(request.META.get("CONTENT_LENGTH") or 0)
+            if stacks:
+                write_profile(self.directory, stacks, view, request.method, size, elapsed, self.max_files)
+        except Exception as e:
+            print(f"Could not write profile: {e}")
+        finally:
+            self._slots.release()
+
+    def _follow(self, sampler, request, response):
+        """
+        Keep sampling while a streamed response is consumed, on whichever thread consumes it
+        """
+        if response.is_async:
+            content = response.streaming_content
+
+            async def follow():
+                try:
+                    sampler.thread_id = threading.get_ident()
+                    async for chunk in content:
+                        yield chunk
+                finally:
+                    self._finish(sampler, request)
+        else:
+            content = iter(response.streaming_content)
+
+            def follow():
+                try:
+                    while True:
+                        sampler.thread_id = threading.get_ident()
+                        try:
+                            chunk = next(content)
+                        except StopIteration:
+                            return
+                        yield chunk
+                finally:
+                    self._finish(sampler, request)
+
+        response.streaming_content = follow()
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not self._pick(request):
+            return self.get_response(request)
+        sampler = self._sample(threading.get_ident())
+        try:
+            response = self.get_response(request)
+        except BaseException:
+            self._finish(sampler, request)
+            raise
+        if response.streaming:
+            self._follow(sampler, request, response)
+        else:
+            self._finish(sampler, request)
+        return response
+
+    async def __acall__(self, request):
+        if not self._pick(request):
+            return await self.get_response(request)
+        try:
+            thread_id = await self._view_thread(request)
+        except BaseException:
+            self._slots.release()
+            raise
+        sampler = self._sample(thread_id)
+        try:
+            response = await self.get_response(request)
+        except BaseException:
+            self._finish(sampler, request)
+            raise
+        if response.streaming:
+            self._follow(sampler, request, response)
+        else:
+            self._finish(sampler, request)
+        return response
@@ -1,6 +1,6 @@
 """
 Django settings for APIs project.
-No database is used (SQLite dummy config).
+SQLite holds document metadata and the PDF ingestion job queue.
 """
 
 from pathlib import Path
@@ -54,6 +54,9 @@ MIDDLEWARE = [
     "django.contrib.auth.middleware.AuthenticationMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
+    "APIs.metrics.MetricsMiddleware",
+    # Off unless PROFILE_SAMPLE_RATE or PROFILE_TOKEN is set; last, so the view's own work dominates the profiles
+    "APIs.profiling.ProfilingMiddleware",
 ]
 
 # --------------------------------------------------
@@ -78,14 +81,22 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = "APIs.wsgi.application"
+# The */async/ endpoints only avoid holding a thread per request when served
+# over ASGI, e.g. `uvicorn APIs.asgi:application`
+ASGI_APPLICATION = "APIs.asgi.application"
 
 # --------------------------------------------------
-# DATABASE (Dummy – required by Django)
+# DATABASE (SQLite – PDF metadata and ingestion queue)
 # --------------------------------------------------
 DATABASES = {
     "default": {
         "ENGINE": "django.db.backends.sqlite3",
-        "NAME": BASE_DIR / "db.sqlite3",
+        "NAME": os.getenv("DATABASE_PATH", BASE_DIR / "db.sqlite3"),
+        "OPTIONS": {
+            # WAL lets web workers read while ingestion workers write
+            "init_command": "PRAGMA journal_mode=WAL;",
+            "timeout": 20,
+        },
     }
 }
 
@@ -0,0 +1,108 @@
+import json
+import traceback
+
+from django.http import StreamingHttpResponse
+
+TRUE_VALUES = ("1", "true", "yes", "on")
+
+
+def wants_stream(request, data=None):
+    """
+    Whether the client asked for a streamed response (``stream=true`` in the body or query string)
+    """
+    if data is None:
+        data = request.data
+    value = data.get('stream', request.GET.get('stream', ''))
+    return str(value).lower() in TRUE_VALUES
+
+
+def _event(data, event=None):
+    payload = f"data: {json.dumps(data)}\n\n"
+    if event:
+        return f"event: {event}\n{payload}"
+    return payload
+
+
+def _events(chunks, on_complete, extra):
+    parts = []
+    try:
+        for text in chunks:
+            if text:
+                parts.append(text)
+                yield _event({"text": text})
+        generated_text = "".join(parts)
+        if on_complete is not None:
+            on_complete(generated_text)
+        yield _event({"generated_text": generated_text, **(extra or {})}, event="done")
+    except Exception as e:
+        print(f"Error while streaming: {e}")
+        traceback.print_exc()
+        yield _event({"generated_text": f"An error occurred: {str(e)}"}, event="error")
+
+
+async def _aevents(chunks, on_complete, extra):
+    parts = []
+    try:
+        async for text in chunks:
+            if text:
+                parts.append(text)
+                yield _event({"text": text})
+        generated_text = "".join(parts)
+        if on_complete is not None:
+            on_complete(generated_text)
+        yield _event({"generated_text": generated_text, **(extra or {})}, event="done")
+    except Exception as e:
+        print(f"Error while streaming: {e}")
+        traceback.print_exc()
+        yield _event({"generated_text": f"An error occurred: {str(e)}"}, event="error")
+
+
+def _stream_response(events):
+    response = StreamingHttpResponse(events, content_type="text/event-stream")
+    response["Cache-Control"] = "no-cache"
+    # Keep reverse proxies from buffering the stream
+    response["X-Accel-Buffering"] = "no"
+    return response
+
+
+def sse_response(chunks, on_complete=None, extra=None):
+    """
+    Stream text chunks to the client as server-sent events.
+
+    Every chunk is sent as a ``data: {"text": ...}`` event as soon as it is
+    produced. Once ``chunks`` is exhausted, ``on_complete`` gets the full text
+    and a final ``done`` event carries it as ``generated_text`` (plus ``extra``),
+    the same shape as the non-streamed responses. A failure mid-stream ends with
+    an ``error`` event. ``on_complete`` is not called when the client goes away
+    before the end.
+    """
+    return _stream_response(_events(chunks, on_complete, extra))
+
+
+def async_sse_response(chunks, on_complete=None, extra=None):
+    """
+    ``sse_response`` for async views: ``chunks`` is an async iterator, served without a thread under ASGI
+    """
+    return _stream_response(_aevents(chunks, on_complete, extra))
+
+
+def _batch_events(results, extra):
+    count = errors = 0
+    try:
+        for result in results:
+            count += 1
+            errors += "error" in result
+            yield _event(result, event="result")
+        yield _event({"count": count, "errors": errors, **(extra or {})}, event="done")
+    except Exception as e:
+        print(f"Error while streaming: {e}")
+        traceback.print_exc()
+        yield _event({"generated_text": f"An error occurred: {str(e)}"}, event="error")
+
+
+def batch_sse_response(results, extra=None):
+    """
+    Stream batch results as ``result`` events, in the order they complete,
+    followed by a ``done`` event with the number of results and of errors
+    """
+    return _stream_response(_batch_events(results, extra))
@@ -0,0 +1,364 @@
+import asyncio
+import json
+import os
+import tempfile
+import threading
+import time
+from unittest import mock
+
+from django.http import HttpResponse, QueryDict, StreamingHttpResponse
+from django.test import RequestFactory, SimpleTestCase
+from django.urls import resolve
+
+from APIs.batch import check_items, ordered, parse_items, run_batch
+from APIs.profiling import ProfilingMiddleware, StackSampler, _size_tag, write_profile
+from APIs.metrics import REQUEST_SECONDS, STAGE_SECONDS, TOKENS, Metrics, get_metrics
+from APIs.streaming import async_sse_response, batch_sse_response, sse_response, wants_stream
+
+
+class MetricsTests(SimpleTestCase):
+    def multiprocess(self, directory):
+        metrics = Metrics(buckets=(1, 2), directory=directory)
+        # Keeps the exit hook and the flush thread away from the deleted directory
+        self.addCleanup(setattr, metrics, "directory", None)
+        return metrics
+
+    def test_threads_write_their_own_shards(self):
+        metrics = Metrics(buckets=(1, 2))
+
+        def work():
+            for _ in range(1000):
+                metrics.inc(TOKENS, 2, endpoint="chat", kind="prompt")
+                metrics.observe(STAGE_SECONDS, 1.5, endpoint="chat", stage="generate")
+
+        threads = [threading.Thread(target=work) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        counters, histograms = metrics.snapshot()
+        self.assertEqual(counters[(TOKENS, (("endpoint", "chat"), ("kind", "prompt")))], 8000)
+        self.assertEqual(histograms[(STAGE_SECONDS, (("endpoint", "chat"), ("stage", "generate")))],
+                         [0, 4000, 0, 6000.0, 4000])
+        # The shards of the finished threads were folded away
+        self.assertEqual(metrics._shards, [])
+        self.assertEqual(metrics.snapshot(), (counters, histograms))
+
+    def test_histogram_buckets_include_their_upper_bound(self):
+        metrics = Metrics(buckets=(1, 2))
+        for value in (0.5, 1, 1.5, 2, 3):
+            metrics.observe(STAGE_SECONDS, value, stage="s")
+        self.assertEqual(metrics.snapshot()[1][(STAGE_SECONDS, (("stage", "s"),))], [2, 2, 1, 8.0, 5])
+
+    def test_render(self):
+        metrics = Metrics(buckets=(1, 2))
+        metrics.inc(TOKENS, 3, endpoint='say "hi"', kind="output")
+        metrics.observe(STAGE_SECONDS, 1.5, endpoint="pdf", stage="search")
+        lines = metrics.render().splitlines()
+        self.assertIn(f'{TOKENS}{{endpoint="say \\"hi\\"",kind="output"}} 3', lines)
+        self.assertIn(f"# TYPE {STAGE_SECONDS} histogram", lines)
+        self.assertIn(f'{STAGE_SECONDS}_bucket{{endpoint="pdf",stage="search",le="1"}} 0', lines)
+        self.assertIn(f'{STAGE_SECONDS}_bucket{{endpoint="pdf",stage="search",le="2"}} 1', lines)
+        self.assertIn(f'{STAGE_SECONDS}_bucket{{endpoint="pdf",stage="search",le="+Inf"}} 1', lines)
+        self.assertIn(f'{STAGE_SECONDS}_sum{{endpoint="pdf",stage="search"}} 1.5', lines)
+        self.assertIn(f'{STAGE_SECONDS}_count{{endpoint="pdf",stage="search"}} 1', lines)
+
+    def test_processes_merge_each_others_dumps(self):
+        with tempfile.TemporaryDirectory() as directory:
+            first, second = self.multiprocess(directory), self.multiprocess(directory)
+            first.inc(TOKENS, 2, kind="prompt")
+            first.observe(STAGE_SECONDS, 0.5, stage="s")
+            second.inc(TOKENS, 3, kind="prompt")
+            first.flush()
+            second.flush()
+            counters, histograms = second.collect()
+            self.assertEqual(counters[(TOKENS, (("kind", "prompt"),))], 5)
+            self.assertEqual(histograms[(STAGE_SECONDS, (("stage", "s"),))], [1, 0, 0, 0.5, 1])
+            # Its own dump is not counted again on top of its live values
+            second.inc(TOKENS, 1, kind="prompt")
+            self.assertEqual(second.collect()[0][(TOKENS, (("kind", "prompt"),))], 6)
+
+    def test_unreadable_and_foreign_dumps_are_skipped(self):
+        with tempfile.TemporaryDirectory() as directory:
+            with open(os.path.join(directory, "1-broken.json"), "w") as f:
+                f.write("{not json")
+            with open(os.path.join(directory, "2-other.json"), "w") as f:
+                json.dump({"buckets": [5], "counters": [[TOKENS, [["kind", "prompt"]], 7]], "histograms": []}, f)
+            metrics = self.multiprocess(directory)
+            metrics.inc(TOKENS, 1, kind="prompt")
+            self.assertEqual(metrics.collect()[0], {(TOKENS, (("kind", "prompt"),)): 1})
+
+
+class MetricsMiddlewareTests(SimpleTestCase):
+    def test_requests_are_timed_by_view_method_and_status(self):
+        key = (REQUEST_SECONDS, (("method", "GET"), ("status", "200"), ("view", "metrics")))
+
+        def count():
+            return get_metrics().snapshot()[1].get(key, [0])[-1]
+
+        before = count()
+        response = self.client.get("/metrics")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(count(), before + 1)
+        self.client.get("/no-such-page/")
+        self.assertIn((REQUEST_SECONDS, (("method", "GET"), ("status", "404"), ("view", "unmatched"))),
+                      get_metrics().snapshot()[1])
+
+
+def parse_events(body):
+    """
+    (event name, data) pairs of a server-sent event stream
+    """
+    events = []
+    for block in body.decode().split("\n\n"):
+        if not block:
+            continue
+        event = None
+        for line in block.split("\n"):
+            if line.startswith("event: "):
+                event = line[len("event: "):]
+            elif line.startswith("data: "):
+                events.append((event, json.loads(line[len("data: "):])))
+    return events
+
+
+def sync_body(response):
+    return b"".join(response.streaming_content)
+
+
+def async_body(response):
+    async def collect():
+        return b"".join([chunk async for chunk in response.streaming_content])
+    return asyncio.run(collect())
+
+
+async def agen(items, fail=None):
+    for item in items:
+        yield item
+    if fail is not None:
+        raise fail
+
+
+def failing(items, error):
+    yield from items
+    raise error
+
+
+class StreamingTests(SimpleTestCase):
+    def test_wants_stream(self):
+        factory = RequestFactory()
+        self.assertTrue(wants_stream(factory.get("/"), {"stream": True}))
+        self.assertTrue(wants_stream(factory.get("/", {"stream": "yes"}), {}))
+        self.assertFalse(wants_stream(factory.get("/", {"stream": "1"}), {"stream": "false"}))
+        self.assertFalse(wants_stream(factory.get("/"), {}))
+
+    def test_chunks_then_done_with_the_full_text_and_extra(self):
+        completed = []
+        response = sse_response(iter(["Hel", "", "lo"]), on_complete=completed.append, extra={"cached": False})
+        self.assertEqual(response["Content-Type"], "text/event-stream")
+        self.assertEqual(response["Cache-Control"], "no-cache")
+        self.assertEqual(response["X-Accel-Buffering"], "no")
+        body = sync_body(response)
+        self.assertTrue(body.startswith(b'data: {"text": "Hel"}\n\n'))
+        self.assertEqual(parse_events(body), [
+            (None, {"text": "Hel"}),
+            (None, {"text": "lo"}),
+            ("done", {"generated_text": "Hello", "cached": False}),
+        ])
+        self.assertEqual(completed, ["Hello"])
+
+    def test_failures_end_with_an_error_event_and_skip_on_complete(self):
+        completed = []
+        events = parse_events(sync_body(sse_response(failing(["a"], ValueError("boom")), completed.append)))
+        self.assertEqual(events, [(None, {"text": "a"}), ("error", {"generated_text": "An error occurred: boom"})])
+        self.assertEqual(completed, [])
+
+    def test_abandoned_streams_skip_on_complete(self):
+        completed = []
+        response = sse_response(iter(["a", "b"]), completed.append)
+        next(iter(response.streaming_content))
+        # What the server does when the client disconnects
+        response.close()
+        self.assertEqual(completed, [])
+
+    def test_async_streams_send_the_same_events(self):
+        completed = []
+        body = async_body(async_sse_response(agen(["Hel", "lo"]), completed.append, extra={"n": 1}))
+        self.assertEqual(parse_events(body), [
+            (None, {"text": "Hel"}),
+            (None, {"text": "lo"}),
+            ("done", {"generated_text": "Hello", "n": 1}),
+        ])
+        self.assertEqual(completed, ["Hello"])
+        events = parse_events(async_body(async_sse_response(agen(["a"], fail=ValueError("boom")))))
+        self.assertEqual(events[-1], ("error", {"generated_text": "An error occurred: boom"}))
+
+    def test_batch_results_are_counted(self):
+        results = [{"index": 1, "generated_text": "b"}, {"index": 0, "error": "failed"}]
+        self.assertEqual(parse_events(sync_body(batch_sse_response(iter(results), extra={"model": "m"}))), [
+            ("result", results[0]),
+            ("result", results[1]),
+            ("done", {"count": 2, "errors": 1, "model": "m"}),
+        ])
+
+
+class BatchTests(SimpleTestCase):
+    def test_parse_items(self):
+        self.assertEqual(parse_items({"q": ["a", " ", 2]}, "q"), ["a", "2"])
+        self.assertEqual(parse_items({"q": '["a", "b"]'}, "q"), ["a", "b"])
+        self.assertEqual(parse_items({"q": "just one"}, "q"), ["just one"])
+        self.assertEqual(parse_items(QueryDict("q=a&q=b"), "q"), ["a", "b"])
+        self.assertEqual(parse_items(QueryDict('q=["a","b"]'), "q"), ["a", "b"])
+        self.assertEqual(parse_items({"q": {"a": 1}}, "q"), [])
+        self.assertEqual(parse_items({}, "q"), [])
+
+    def test_check_items(self):
+        self.assertEqual(check_items([], "prompts"), "No prompts given")
+        with mock.patch.dict(os.environ, {"BATCH_MAX_ITEMS": "2"}):
+            self.assertIsNone(check_items(["a", "b"], "prompts"))
+            self.assertEqual(check_items(["a", "b", "c"], "prompts"), "Too many prompts: 3 (at most 2)")
+
+    def test_results_carry_answers_and_errors(self):
+        def answer(item):
+            if item == "bad":
+                raise ValueError("no answer")
+            return item.upper()
+
+        results = ordered(run_batch(["a", "bad", "c"], answer, 2, key="prompt"))
+        self.assertEqual(results, [
+            {"index": 0, "prompt": "a", "generated_text": "A"},
+            {"index": 1, "prompt": "bad", "error": "no answer"},
+            {"index": 2, "prompt": "c", "generated_text": "C"},
+        ])
+
+    def test_concurrency_is_bounded(self):
+        lock = threading.Lock()
+        running = [0, 0]
+
+        def answer(item):
+            with lock:
+                running[0] += 1
+                running[1] = max(running[1], running[0])
+            time.sleep(0.02)
+            with lock:
+                running[0] -= 1
+            return item
+
+        self.assertEqual(len(list(run_batch([str(i) for i in range(8)], answer, 3))), 8)
+        self.assertLessEqual(running[1], 3)
+
+    def test_items_not_started_are_cancelled_when_the_caller_stops(self):
+        started = []
+        release = threading.Event()
+
+        def answer(item):
+            started.append(item)
+            if item != "0":
+                release.wait(5)
+            return item
+
+        results = run_batch([str(i) for i in range(10)], answer, 2)
+        self.assertEqual(next(results)["index"], 0)
+        results.close()
+        release.set()
+        time.sleep(0.05)
+        self.assertLessEqual(len(started), 3)
+
+    def test_worker_threads_close_their_database_connections(self):
+        closed = []
+        with mock.patch("APIs.batch.close_old_connections",
+                        side_effect=lambda: closed.append(threading.current_thread().name)):
+            list(run_batch(["a", "b"], str.upper, 2))
+        self.assertEqual(len(closed), 4)
+        self.assertTrue(all(name.startswith("batch") for name in closed))
+
+
+def busy(seconds):
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        pass
+
+
+class ProfilingTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        self.factory = RequestFactory()
+
+    def middleware(self, get_response, **env):
+        settings = {"PROFILE_SAMPLE_RATE": "0", "PROFILE_TOKEN": "", "PROFILE_DIR": self.directory,
+                    "PROFILE_INTERVAL_MS": "1"}
+        settings.update(env)
+        with mock.patch.dict(os.environ, settings):
+            return ProfilingMiddleware(get_response)
+
+    def view(self, request):
+        request.resolver_match = resolve("/metrics")
+        busy(0.05)
+        return HttpResponse("ok")
+
+    def profiles(self):
+        return sorted(os.listdir(self.directory))
+
+    def test_sampler_collects_the_stacks_of_its_thread(self):
+        sampler = StackSampler(threading.get_ident(), interval=0.001)
+        sampler.start()
+        busy(0.05)
+        stacks = sampler.stop()
+        self.assertGreater(sampler.samples, 0)
+        self.assertEqual(sum(stacks.values()), sampler.samples)
+        self.assertTrue(any(stack.endswith(";busy (APIs/tests.py:%d)" % busy.__code__.co_firstlineno)
+                            for stack in stacks))
+        self.assertTrue(all("test_sampler_collects_the_stacks_of_its_thread" in stack for stack in stacks))
+        self.assertFalse(sampler.is_alive())
+
+    def test_size_tag(self):
+        self.assertEqual([_size_tag(size) for size in (0, 1, 500, 65536, 3 << 20)],
+                         ["0B", "1B", "512B", "64KiB", "4MiB"])
+
+    def test_old_profiles_are_rotated(self):
+        for i in range(3):
+            write_profile(self.directory, {"a;b": i + 1}, "view", "GET", 10, 0.25, max_files=2)
+        profiles = self.profiles()
+        self.assertEqual(len(profiles), 2)
+        self.assertTrue(profiles[-1].endswith("-view-GET-16B-250ms-%d.folded" % os.getpid()))
+        with open(os.path.join(self.directory, profiles[-1])) as f:
+            self.assertEqual(f.read(), "a;b 3\n")
+
+    def test_off_by_default(self):
+        middleware = self.middleware(self.view)
+        self.assertFalse(middleware.enabled)
+        with mock.patch("APIs.profiling.StackSampler") as sampler:
+            self.assertEqual(middleware(self.factory.get("/metrics")).content, b"ok")
+        sampler.assert_not_called()
+        self.assertEqual(self.profiles(), [])
+
+    def test_requests_carrying_the_token_are_profiled(self):
+        middleware = self.middleware(self.view, PROFILE_TOKEN="secret")
+        middleware(self.factory.get("/metrics", HTTP_X_PROFILE_TOKEN="wrong"))
+        middleware(self.factory.get("/metrics"))
+        self.assertEqual(self.profiles(), [])
+        self.assertEqual(middleware(self.factory.get("/metrics", HTTP_X_PROFILE_TOKEN="secret")).content, b"ok")
+        [profile] = self.profiles()
+        self.assertIn("-metrics-GET-0B-", profile)
+        with open(os.path.join(self.directory, profile)) as f:
+            self.assertIn("busy (APIs/tests.py:", f.read())
+        # The slot was given back
+        self.assertTrue(middleware._slots.acquire(blocking=False))
+
+    def test_sampled_streams_are_profiled_once_consumed(self):
+        def chunks():
+            busy(0.03)
+            yield b"a"
+            busy(0.03)
+            yield b"b"
+
+        middleware = self.middleware(lambda request: StreamingHttpResponse(chunks()), PROFILE_SAMPLE_RATE="1")
+        response = middleware(self.factory.post("/pdf/", data=b"x" * 100, content_type="application/pdf"))
+        self.assertEqual(self.profiles(), [])
+        self.assertEqual(b"".join(response.streaming_content), b"ab")
+        [profile] = self.profiles()
+        self.assertIn("-unmatched-POST-128B-", profile)
+        with open(os.path.join(self.directory, profile)) as f:
+            self.assertIn("chunks (APIs/tests.py:", f.read())
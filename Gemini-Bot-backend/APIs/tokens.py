@@ -0,0 +1,11 @@
+def estimate_tokens(text):
+    # Roughly four characters per token for English text
+    return len(text) // 4 + 1
+
+
+def estimate_content_tokens(content):
+    """
+    Estimated prompt tokens of one Gemini ``Content`` message
+    """
+    # A few tokens of framing per message and per part
+    return 4 + sum(estimate_tokens(part.text) + 1 for part in content.parts)
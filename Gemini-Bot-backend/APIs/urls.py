@@ -17,8 +17,13 @@ Including another URLconf
 from django.contrib import admin
 from django.urls import path, include
 
+from APIs import views
+
 urlpatterns = [
     path("admin/", admin.site.urls),
+    path("cache/stats/", views.answer_cache_stats, name="answer_cache_stats"),
+    # Prometheus scrapes /metrics, without a trailing slash
+    path("metrics", views.metrics, name="metrics"),
     path("", include("text_bot.urls")),
     path("", include("image_bot.urls")),
     path("", include("pdf_chat.urls")),
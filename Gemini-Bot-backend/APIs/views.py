@@ -0,0 +1,29 @@
+from django.http import HttpResponse
+from django.views.decorators.http import require_GET
+from rest_framework.decorators import api_view
+from rest_framework.response import Response
+
+from APIs.answer_cache import get_answer_cache
+from APIs.metrics import get_metrics
+
+
+@api_view(['GET'])
+def answer_cache_stats(request):
+    """
+    Hit-rate counters of this worker's answer cache
+    """
+    answer_cache = get_answer_cache()
+    if answer_cache is None:
+        return Response({"enabled": False})
+    return Response({"enabled": True, **answer_cache.stats()})
+
+
+@require_GET
+def metrics(request):
+    """
+    Request, stage, upstream call and token metrics in the Prometheus text format
+    """
+    registry = get_metrics()
+    if registry is None:
+        return HttpResponse("Metrics are disabled.\n", status=404, content_type="text/plain")
+    return HttpResponse(registry.render(), content_type="text/plain; version=0.0.4; charset=utf-8")
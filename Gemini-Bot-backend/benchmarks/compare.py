@@ -0,0 +1,74 @@
+"""
+Compare two benchmark result files, e.g. before and after a change.
+
+    python -m benchmarks.compare benchmarks/results/base.json benchmarks/results/head.json
+"""
+import argparse
+import json
+
+# (label, path in a scenario summary, True when higher is better)
+METRICS = (
+    ("rps", ("rps",), True),
+    ("latency p50 ms", ("latency_ms", "p50"), False),
+    ("latency p95 ms", ("latency_ms", "p95"), False),
+    ("latency p99 ms", ("latency_ms", "p99"), False),
+    ("ttft p50 ms", ("ttft_ms", "p50"), False),
+    ("ttft p95 ms", ("ttft_ms", "p95"), False),
+    ("peak rss MB", ("rss", "peak_total_mb"), False),
+)
+
+
+def _get(summary, path):
+    for key in path:
+        if not isinstance(summary, dict):
+            return None
+        summary = summary.get(key)
+    return summary
+
+
+def _change(before, after, higher_is_better):
+    if before is None or after is None or not before:
+        return "", ""
+    change = (after - before) / before * 100
+    better = change > 0 if higher_is_better else change < 0
+    return f"{change:+.1f}%", ("better" if better else "worse") if abs(change) >= 1 else ""
+
+
+def compare(base, head):
+    """
+    Rows of (scenario, metric, base, head, change, verdict) for the scenarios in both runs
+    """
+    rows = []
+    for scenario in base["results"]:
+        if scenario not in head["results"]:
+            continue
+        before, after = base["results"][scenario], head["results"][scenario]
+        for label, path, higher_is_better in METRICS:
+            old, new = _get(before, path), _get(after, path)
+            if old is None and new is None:
+                continue
+            rows.append((scenario, label, old, new, *_change(old, new, higher_is_better)))
+        errors_before = sum(before.get("errors", {}).values())
+        errors_after = sum(after.get("errors", {}).values())
+        if errors_before or errors_after:
+            rows.append((scenario, "errors", errors_before, errors_after, "", ""))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("base")
+    parser.add_argument("head")
+    args = parser.parse_args()
+    with open(args.base) as f:
+        base = json.load(f)
+    with open(args.head) as f:
+        head = json.load(f)
+    print(f"base: {base['meta'].get('git_commit')}  head: {head['meta'].get('git_commit')}")
+    print(f"{'scenario':<8} {'metric':<16} {'base':>10} {'head':>10} {'change':>8}")
+    for scenario, label, old, new, change, verdict in compare(base, head):
+        print(f"{scenario:<8} {label:<16} {str(old):>10} {str(new):>10} {change:>8} {verdict}")
+
+
+if __name__ == "__main__":
+    main()
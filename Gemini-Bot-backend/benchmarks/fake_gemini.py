@@ -0,0 +1,233 @@
+"""
+Local stand-in for the Gemini REST API, for benchmarks.
+
+Serves ``generateContent``, ``streamGenerateContent`` (JSON array or SSE),
+``embedContent`` and ``batchEmbedContents`` for any model, with a configurable
+time to first token, token rate and share of 429 responses. Point the backend
+at it with ``GEMINI_API_BASE_URL=http://127.0.0.1:<port>``.
+
+    python -m benchmarks.fake_gemini --port 8900 --latency-ms 400 --tokens-per-second 60
+"""
+import argparse
+import hashlib
+import json
+import random
+import re
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+
+ROUTE_RE = re.compile(r"^/(?:v1|v1beta|v1alpha)/(?:models/)?(?P<model>[^:/]+):(?P<method>\w+)$")
+WORDS = ("the model reads the question and the context then writes a short answer that cites the "
+         "relevant passage and explains the reasoning in plain words").split()
+
+
+class FakeGeminiConfig:
+    def __init__(self, latency_ms=300, tokens_per_second=80, answer_tokens=120, chunk_tokens=8,
+                 rate_limit_ratio=0.0, embedding_latency_ms=30, embedding_dim=768, seed=0):
+        self.latency = latency_ms / 1000
+        self.tokens_per_second = tokens_per_second
+        self.answer_tokens = answer_tokens
+        self.chunk_tokens = chunk_tokens
+        self.rate_limit_ratio = rate_limit_ratio
+        self.embedding_latency = embedding_latency_ms / 1000
+        self.embedding_dim = embedding_dim
+        self.random = random.Random(seed)
+
+
+class Stats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counts = {}
+
+    def add(self, name):
+        with self._lock:
+            self.counts[name] = self.counts.get(name, 0) + 1
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self.counts)
+
+
+def answer_chunks(config):
+    words = [WORDS[i % len(WORDS)] for i in range(config.answer_tokens)]
+    for start in range(0, len(words), config.chunk_tokens):
+        yield " ".join(words[start:start + config.chunk_tokens]) + " "
+
+
+def embedding(text, dim):
+    seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little")
+    vector = np.random.default_rng(seed).standard_normal(dim).astype(np.float32)
+    return (vector / np.linalg.norm(vector)).tolist()
+
+
+def _response(text, finish=True, prompt_tokens=1, output_tokens=None):
+    candidate = {"content": {"parts": [{"text": text}], "role": "model"}, "index": 0}
+    if finish:
+        candidate["finishReason"] = "STOP"
+    if output_tokens is None:
+        output_tokens = len(text.split())
+    return {
+        "candidates": [candidate],
+        "usageMetadata": {"promptTokenCount": prompt_tokens, "candidatesTokenCount": output_tokens,
+                          "totalTokenCount": prompt_tokens + output_tokens},
+    }
+
+
+def _content_text(content):
+    return " ".join(part.get("text", "") for part in (content or {}).get("parts", []))
+
+
+def _prompt_tokens(request):
+    # Rough count of the words sent, for the usage metadata
+    texts = [_content_text(content) for content in request.get("contents", [])]
+    texts.append(_content_text(request.get("systemInstruction") or request.get("system_instruction")))
+    return sum(len(text.split()) for text in texts)
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server_version = "FakeGemini/1.0"
+    config = None
+    stats = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def _json(self, status, payload):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _chunk(self, data):
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+        self.wfile.flush()
+
+    def do_GET(self):
+        if urlparse(self.path).path == "/stats":
+            return self._json(200, self.stats.snapshot())
+        return self._json(404, {"error": {"code": 404, "message": "Not found", "status": "NOT_FOUND"}})
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        match = ROUTE_RE.match(url.path)
+        if match is None:
+            self.stats.add("unknown")
+            return self._json(404, {"error": {"code": 404, "message": f"Unknown path {url.path}", "status": "NOT_FOUND"}})
+        method = match.group("method")
+        self.stats.add(method)
+
+        if self.config.rate_limit_ratio and self.config.random.random() < self.config.rate_limit_ratio:
+            self.stats.add("429")
+            return self._json(429, {"error": {"code": 429, "message": "Resource has been exhausted (fake).",
+                                              "status": "RESOURCE_EXHAUSTED"}})
+
+        request = json.loads(body or b"{}")
+        if method == "generateContent":
+            time.sleep(self.config.latency + self.config.answer_tokens / self.config.tokens_per_second)
+            return self._json(200, _response("".join(answer_chunks(self.config)), prompt_tokens=_prompt_tokens(request)))
+        if method == "streamGenerateContent":
+            return self._stream(parse_qs(url.query).get("alt", ["json"])[0] == "sse", _prompt_tokens(request))
+        if method == "embedContent":
+            time.sleep(self.config.embedding_latency)
+            return self._json(200, {"embedding": {"values": embedding(_content_text(request.get("content")),
+                                                                      self.config.embedding_dim)}})
+        if method == "batchEmbedContents":
+            time.sleep(self.config.embedding_latency)
+            return self._json(200, {"embeddings": [
+                {"values": embedding(_content_text(item.get("content")), self.config.embedding_dim)}
+                for item in request.get("requests", [])
+            ]})
+        if method == "countTokens":
+            return self._json(200, {"totalTokens": len(body) // 4})
+        return self._json(404, {"error": {"code": 404, "message": f"Unknown method {method}", "status": "NOT_FOUND"}})
+
+    def _stream(self, sse, prompt_tokens):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream" if sse else "application/json")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        time.sleep(self.config.latency)
+        chunks = list(answer_chunks(self.config))
+        delay = self.config.chunk_tokens / self.config.tokens_per_second
+        if not sse:
+            self._chunk(b"[")
+        output_tokens = 0
+        for i, text in enumerate(chunks):
+            if i:
+                time.sleep(delay)
+            # Like the real API, usage is cumulative over the chunks sent so far
+            output_tokens += len(text.split())
+            payload = json.dumps(_response(text, finish=i == len(chunks) - 1, prompt_tokens=prompt_tokens,
+                                           output_tokens=output_tokens)).encode("utf-8")
+            if sse:
+                self._chunk(b"data: " + payload + b"\r\n\r\n")
+            else:
+                self._chunk((b",\r\n" if i else b"") + payload)
+        if not sse:
+            self._chunk(b"]")
+        self._chunk(b"")
+
+
+class FakeGeminiServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # Clients that give up mid-stream are expected under load
+        if isinstance(sys.exc_info()[1], ConnectionError):
+            self.stats.add("disconnected")
+            return
+        super().handle_error(request, client_address)
+
+
+def make_server(host="127.0.0.1", port=8900, config=None):
+    """
+    A ready-to-serve fake server; its request counts are on ``server.stats`` and ``GET /stats``
+    """
+    handler = type("FakeGeminiHandler", (Handler,), {"config": config or FakeGeminiConfig(), "stats": Stats()})
+    server = FakeGeminiServer((host, port), handler)
+    server.stats = handler.stats
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--latency-ms", type=float, default=300, help="time to first token")
+    parser.add_argument("--tokens-per-second", type=float, default=80)
+    parser.add_argument("--answer-tokens", type=int, default=120)
+    parser.add_argument("--chunk-tokens", type=int, default=8, help="tokens per streamed chunk")
+    parser.add_argument("--rate-limit-ratio", type=float, default=0.0, help="share of requests answered with 429")
+    parser.add_argument("--embedding-latency-ms", type=float, default=30)
+    parser.add_argument("--embedding-dim", type=int, default=768)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    config = FakeGeminiConfig(
+        latency_ms=args.latency_ms,
+        tokens_per_second=args.tokens_per_second,
+        answer_tokens=args.answer_tokens,
+        chunk_tokens=args.chunk_tokens,
+        rate_limit_ratio=args.rate_limit_ratio,
+        embedding_latency_ms=args.embedding_latency_ms,
+        embedding_dim=args.embedding_dim,
+        seed=args.seed,
+    )
+    server = make_server(args.host, args.port, config)
+    print(f"Fake Gemini API on http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
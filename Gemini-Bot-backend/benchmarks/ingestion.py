@@ -0,0 +1,307 @@
+"""
+Micro-benchmarks for the CPU side of PDF ingestion and retrieval.
+
+Builds a synthetic corpus (text-heavy and table-heavy PDFs of ``--pages``
+pages) and times each stage of ``pdf_chat`` on it: pdfplumber extraction, text
+splitting, embedding with a deterministic offline stub, FAISS and BM25 build,
+IndexStore save and load, and hybrid retrieval. Every stage reports wall time
+and the peak RSS it added. With ``--baseline`` the run is checked against an
+earlier result file and exits with status 1 when a stage got slower or bigger
+than the thresholds allow.
+
+    python -m benchmarks.ingestion --pages 1,10,100,2000 --output benchmarks/results/ingestion.json
+    python -m benchmarks.ingestion --pages 1,10,100 --baseline benchmarks/results/ingestion.json
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+from importlib import metadata
+
+from langchain_core.embeddings import Embeddings
+from langchain_community.vectorstores import FAISS
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+from benchmarks.fake_gemini import embedding
+from benchmarks.loadtest import RSSSampler, _rss_kb, run_metadata, save_results
+from benchmarks.pdfgen import make_pdf, synthetic_pages, synthetic_table_pages
+from pdf_chat.bm25 import BM25Index
+from pdf_chat.extraction import iter_pages
+from pdf_chat.index_store import IndexStore
+from pdf_chat.ingest import CHUNK_OVERLAP, CHUNK_SIZE, iter_chunks
+from pdf_chat.retrieval import MODE_HYBRID, retrieve
+from pdf_chat.vector_storage import STORAGE_TYPES
+
+KINDS = ("text", "table")
+STAGES = ("extract", "split", "embed", "faiss_build", "bm25_build", "save", "load", "search")
+PACKAGES = ("pdfplumber", "pdfminer.six", "faiss-cpu", "langchain-community", "langchain-text-splitters", "numpy")
+QUERIES = (
+    "What does the warranty cover?",
+    "Which section limits the liability cap?",
+    "reference C-2553",
+    "payment terms of the subscription",
+    "How much was the refund total?",
+    "renewal notice for the maintenance contract",
+)
+
+
+class StubEmbeddings(Embeddings):
+    """
+    Offline embeddings: a unit vector seeded by the SHA-256 of the text, so the same text always maps to the same
+    vector and similar runs build identical indexes
+    """
+
+    def __init__(self, dim=768):
+        self.dim = dim
+
+    def embed_documents(self, texts):
+        return [embedding(text, self.dim) for text in texts]
+
+    def embed_query(self, text):
+        return embedding(text, self.dim)
+
+
+def build_corpus(directory, page_counts, kinds=KINDS):
+    """
+    Write (or reuse) one PDF per page count and kind; returns {name: (kind, pages, path)}
+    """
+    os.makedirs(directory, exist_ok=True)
+    corpus = {}
+    for kind in kinds:
+        for pages in page_counts:
+            name = f"{kind}-{pages}p"
+            path = os.path.join(directory, f"{name}.pdf")
+            if not os.path.exists(path):
+                page_content = synthetic_pages(pages) if kind == "text" else synthetic_table_pages(pages)
+                with open(path + ".tmp", "wb") as f:
+                    f.write(make_pdf(page_content))
+                os.replace(path + ".tmp", path)
+            corpus[name] = (kind, pages, path)
+    return corpus
+
+
+class Stage:
+    """
+    Times a block and samples the RSS it adds on top of the RSS at its start
+    """
+
+    def __init__(self, interval=0.02):
+        self.interval = interval
+        self.seconds = None
+        self.rss_mb = None
+
+    def __enter__(self):
+        self._start_kb = _rss_kb(os.getpid())
+        self._sampler = RSSSampler([os.getpid()], interval=self.interval)
+        self._sampler.start()
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.seconds = time.perf_counter() - self._started
+        self._sampler.sample()
+        peak_kb = self._sampler.stop()["peak_total_mb"] * 1024
+        self.rss_mb = round(max(0.0, peak_kb - self._start_kb) / 1024, 1)
+        return False
+
+
+def run_document(path, store, embeddings, workers=1, queries=QUERIES, search_rounds=20):
+    """
+    Run every stage once over one PDF; returns ({stage: {"seconds", "rss_mb"}}, counts)
+    """
+    stages = {}
+
+    def record(name, stage):
+        stages[name] = {"seconds": stage.seconds, "rss_mb": stage.rss_mb}
+
+    with Stage() as stage:
+        texts = list(iter_pages(path, workers=workers))
+    record("extract", stage)
+
+    splitter = RecursiveCharacterTextSplitter(chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP)
+    with Stage() as stage:
+        chunks = list(iter_chunks(texts, splitter))
+    record("split", stage)
+    chunk_texts = [text for text, _ in chunks]
+    metadatas = [{"chunk_index": i, "pages": chunk_pages} for i, (_, chunk_pages) in enumerate(chunks)]
+
+    with Stage() as stage:
+        vectors = embeddings.embed_documents(chunk_texts)
+    record("embed", stage)
+
+    with Stage() as stage:
+        vector_store = FAISS.from_embeddings(list(zip(chunk_texts, vectors)), embedding=embeddings,
+                                             metadatas=metadatas)
+    record("faiss_build", stage)
+
+    with Stage() as stage:
+        lexical_index = BM25Index.build(chunk_texts)
+    record("bm25_build", stage)
+
+    key = os.path.basename(path)
+    with Stage() as stage:
+        store.save(key, vector_store, lexical_index=lexical_index)
+    record("save", stage)
+    del vector_store, lexical_index, vectors
+
+    with Stage() as stage:
+        loaded = store.load(key, embeddings)
+        loaded_lexical = store.load_lexical(key)
+    record("load", stage)
+
+    with Stage() as stage:
+        for _ in range(search_rounds):
+            for query in queries:
+                retrieve(loaded, query, lexical_index=loaded_lexical, mode=MODE_HYBRID)
+    searches = search_rounds * len(queries)
+    record("search", stage)
+    stages["search"]["per_query_ms"] = round(stage.seconds / searches * 1000, 3)
+    store.delete(key)
+
+    counts = {"pages": len(texts), "characters": sum(len(text) for text in texts), "chunks": len(chunks)}
+    return stages, counts
+
+
+def _merge(runs):
+    """
+    Best time and largest memory of each stage over repeated runs
+    """
+    merged = {}
+    for stage in runs[0]:
+        merged[stage] = {
+            "seconds": round(min(run[stage]["seconds"] for run in runs), 4),
+            "rss_mb": max(run[stage]["rss_mb"] for run in runs),
+        }
+        if "per_query_ms" in runs[0][stage]:
+            merged[stage]["per_query_ms"] = min(run[stage]["per_query_ms"] for run in runs)
+    return merged
+
+
+def run_corpus(corpus, store_dir, workers=1, repeat=1, storage="float32", search_rounds=20):
+    embeddings = StubEmbeddings()
+    store = IndexStore(store_dir, quota_bytes=0, storage=storage)
+    results = {}
+    for name, (kind, pages, path) in corpus.items():
+        runs = []
+        for _ in range(repeat):
+            stages, counts = run_document(path, store, embeddings, workers=workers,
+                                          search_rounds=search_rounds)
+            runs.append(stages)
+        stages = _merge(runs)
+        for stage in stages.values():
+            stage["per_page_ms"] = round(stage["seconds"] / pages * 1000, 3)
+        results[name] = {"kind": kind, "bytes": os.path.getsize(path), **counts, "stages": stages}
+        print_document(name, results[name])
+    return results
+
+
+def print_document(name, result):
+    print(f"\n{name}: {result['pages']} pages, {result['chunks']} chunks, {result['characters']} characters, "
+          f"{result['bytes'] // 1024} KiB")
+    print(f"  {'stage':<12} {'seconds':>10} {'ms/page':>10} {'rss +MB':>9}")
+    for stage in STAGES:
+        values = result["stages"][stage]
+        print(f"  {stage:<12} {values['seconds']:>10.4f} {values['per_page_ms']:>10.3f} {values['rss_mb']:>9.1f}")
+
+
+def print_matrix(results, metric="seconds"):
+    """
+    One row per document and one column per stage, to see which stage dominates as documents grow
+    """
+    print(f"\n{metric} per stage")
+    print(f"  {'document':<14}" + "".join(f"{stage:>12}" for stage in STAGES))
+    for name, result in results.items():
+        print(f"  {name:<14}" + "".join(f"{result['stages'][stage][metric]:>12}" for stage in STAGES))
+
+
+def check_regressions(results, baseline, time_threshold=1.25, memory_threshold=1.25, min_seconds=0.05,
+                      min_mb=10.0):
+    """
+    Stages whose time or added RSS grew past the threshold ratio (and past the noise floor) against ``baseline``
+    """
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if base is None:
+            continue
+        for stage, values in result["stages"].items():
+            old = base["stages"].get(stage)
+            if old is None:
+                continue
+            if values["seconds"] > old["seconds"] * time_threshold and values["seconds"] - old["seconds"] > min_seconds:
+                regressions.append((name, stage, "seconds", old["seconds"], values["seconds"]))
+            if values["rss_mb"] > old["rss_mb"] * memory_threshold and values["rss_mb"] - old["rss_mb"] > min_mb:
+                regressions.append((name, stage, "rss_mb", old["rss_mb"], values["rss_mb"]))
+    return regressions
+
+
+def package_versions():
+    versions = {}
+    for package in PACKAGES:
+        try:
+            versions[package] = metadata.version(package)
+        except metadata.PackageNotFoundError:
+            versions[package] = None
+    return versions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("--pages", default="1,10,100,2000", help="comma-separated page counts")
+    parser.add_argument("--kind", action="append", choices=KINDS, help="repeat for several kinds (default: all)")
+    parser.add_argument("--corpus-dir", help="keep generated PDFs here between runs (default: a temporary directory)")
+    parser.add_argument("--workers", type=int, default=1, help="extraction processes")
+    parser.add_argument("--repeat", type=int, default=1, help="runs per document; best time, largest memory")
+    parser.add_argument("--storage", choices=STORAGE_TYPES, default="float32", help="IndexStore vector storage")
+    parser.add_argument("--search-rounds", type=int, default=20, help="passes over the sample queries")
+    parser.add_argument("--output", help="JSON file for the results")
+    parser.add_argument("--baseline", help="earlier result file to check for regressions")
+    parser.add_argument("--time-threshold", type=float, default=1.25, help="allowed time ratio against the baseline")
+    parser.add_argument("--memory-threshold", type=float, default=1.25, help="allowed RSS ratio against the baseline")
+    parser.add_argument("--min-seconds", type=float, default=0.05, help="time differences below this are noise")
+    parser.add_argument("--min-mb", type=float, default=10.0, help="RSS differences below this are noise")
+    args = parser.parse_args()
+
+    page_counts = [int(value) for value in args.pages.split(",") if value.strip()]
+    workdir = tempfile.mkdtemp(prefix="gemini-bot-ingestion-")
+    try:
+        corpus = build_corpus(args.corpus_dir or os.path.join(workdir, "corpus"), page_counts,
+                              kinds=args.kind or KINDS)
+        results = run_corpus(corpus, os.path.join(workdir, "indexes"), workers=args.workers, repeat=args.repeat,
+                             storage=args.storage, search_rounds=args.search_rounds)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print_matrix(results, "seconds")
+    print_matrix(results, "rss_mb")
+
+    if args.output:
+        meta = run_metadata(vars(args))
+        meta["packages"] = package_versions()
+        save_results(args.output, results, meta)
+        print(f"\nResults written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = check_regressions(results, baseline["results"], args.time_threshold, args.memory_threshold,
+                                        args.min_seconds, args.min_mb)
+        versions = package_versions()
+        changed = {package: (old, versions.get(package))
+                   for package, old in baseline["meta"].get("packages", {}).items() if old != versions.get(package)}
+        if changed:
+            print("\nPackage versions changed since the baseline: "
+                  + ", ".join(f"{package} {old} -> {new}" for package, (old, new) in changed.items()))
+        if regressions:
+            print("\nRegressions against the baseline:")
+            for name, stage, metric, old, new in regressions:
+                print(f"  {name} {stage} {metric}: {old} -> {new}")
+            sys.exit(1)
+        print("\nNo regressions against the baseline")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,371 @@
+"""
+Load test for the backend's /chat/, /image/ and /pdf/ endpoints.
+
+Sends ``--requests`` requests per scenario from ``--concurrency`` client threads
+and reports latency and time-to-first-token percentiles, requests per second and
+the peak RSS of the server processes given with ``--pid``. Results are written
+as JSON so runs on different commits can be compared (``benchmarks.compare``).
+
+    python -m benchmarks.loadtest --url http://127.0.0.1:8000 --scenario chat --concurrency 8 \\
+        --requests 200 --stream --pid 12345 --output benchmarks/results/chat.json
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import subprocess
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import requests
+
+from benchmarks.pdfgen import make_pdf, synthetic_pages
+
+SCENARIOS = ("chat", "image", "pdf")
+PATHS = {"chat": "/chat/", "image": "/image/", "pdf": "/pdf/"}
+ERROR_PREFIXES = ("Something went wrong", "An error occurred", "Error:")
+
+
+class Payloads:
+    """
+    Request bodies for a scenario. Prompts (and with ``unique_files`` the
+    uploaded files) differ per request so that caches do not answer them.
+    """
+
+    def __init__(self, scenario, run_id, turns=1, unique_prompts=True, unique_files=False,
+                 image_size=(4000, 3000), pdf_pages=20):
+        self.scenario = scenario
+        self.run_id = run_id
+        self.turns = turns
+        self.unique_prompts = unique_prompts
+        self.unique_files = unique_files
+        self.image_size = image_size
+        self.pdf_pages = pdf_pages
+        self._base = None
+        self._lock = threading.Lock()
+
+    def _image(self):
+        from PIL import Image
+
+        width, height = self.image_size
+        rng = np.random.default_rng(0)
+        # A gradient with noise compresses like a photo, unlike flat colour
+        gradient = np.linspace(0, 200, width, dtype=np.float32)[None, :, None]
+        pixels = (gradient + rng.random((height, width, 3), dtype=np.float32) * 55).astype(np.uint8)
+        buffer = io.BytesIO()
+        Image.fromarray(pixels).save(buffer, format="JPEG", quality=90)
+        return buffer.getvalue()
+
+    def _file(self, variant):
+        with self._lock:
+            if self._base is None:
+                if self.scenario == "image":
+                    self._base = self._image()
+                else:
+                    self._base = make_pdf(synthetic_pages(self.pdf_pages))
+        if variant is None:
+            return self._base
+        # Different bytes (and hash), same content: a JPEG comment segment, or a trailing PDF comment
+        marker = f"bench-{self.run_id}-{variant}".encode("ascii")
+        if self.scenario == "image":
+            return self._base[:2] + b"\xff\xfe" + (len(marker) + 2).to_bytes(2, "big") + marker + self._base[2:]
+        return self._base + b"%" + marker + b"\n"
+
+    def build(self, index):
+        prompt = "Summarize the key points in three sentences."
+        if self.unique_prompts:
+            prompt = f"Question {index}: {prompt}"
+        data = {"session_id": f"bench-{self.run_id}-{index // self.turns}", "prompt": prompt}
+        if self.scenario == "chat":
+            data["system_prompt"] = "You are a helpful AI Assistant."
+            return data, None
+        variant = index if self.unique_files else None
+        if self.scenario == "image":
+            data["system_prompt"] = "You are a helpful AI Assistant."
+            return data, {"image": (f"bench-{variant}.jpg", self._file(variant), "image/jpeg")}
+        return data, {"pdf": (f"bench-{variant}.pdf", self._file(variant), "application/pdf")}
+
+
+def _iter_lines(response):
+    """
+    Lines of a streamed body as soon as they arrive; ``iter_lines(chunk_size=None)`` waits for the end
+    of a body that is neither chunked nor sized, which is what ``runserver`` sends
+    """
+    raw = response.raw
+    raw.decode_content = True
+    pending = b""
+    while True:
+        data = raw.read1(65536) if hasattr(raw, "read1") else raw.read(1)
+        if not data:
+            break
+        pending += data
+        *lines, pending = pending.split(b"\n")
+        for line in lines:
+            yield line.rstrip(b"\r").decode("utf-8")
+    if pending:
+        yield pending.decode("utf-8")
+
+
+def _send(session, url, data, files, stream, timeout):
+    """
+    One request: returns (latency s, time to first token s or None, error or None)
+    """
+    started = time.perf_counter()
+    first_token = None
+    if not stream:
+        response = session.post(url, data=data, files=files, timeout=timeout)
+        latency = time.perf_counter() - started
+        if response.status_code != 200:
+            return latency, None, f"HTTP {response.status_code}"
+        text = response.json().get("generated_text", "")
+        if text.startswith(ERROR_PREFIXES):
+            return latency, None, text[:80]
+        return latency, None, None
+
+    with session.post(url, data={**data, "stream": "true"}, files=files, stream=True, timeout=timeout) as response:
+        if response.status_code != 200:
+            return time.perf_counter() - started, None, f"HTTP {response.status_code}"
+        if not response.headers.get("Content-Type", "").startswith("text/event-stream"):
+            text = response.json().get("generated_text", "")
+            return time.perf_counter() - started, None, text[:80] or "not streamed"
+        event = None
+        error = None
+        for line in _iter_lines(response):
+            if line.startswith("event:"):
+                event = line[len("event:"):].strip()
+            elif line.startswith("data:"):
+                if event is None and first_token is None:
+                    first_token = time.perf_counter() - started
+                elif event == "error":
+                    error = json.loads(line[len("data:"):]).get("generated_text", "stream error")[:80]
+            elif not line:
+                event = None
+    return time.perf_counter() - started, first_token, error
+
+
+def _rss_kb(pid):
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return 0
+
+
+def _descendants(pid):
+    pids = [pid]
+    for current in pids:
+        try:
+            for task in os.listdir(f"/proc/{current}/task"):
+                with open(f"/proc/{current}/task/{task}/children") as f:
+                    pids.extend(int(child) for child in f.read().split())
+        except OSError:
+            continue
+    return pids
+
+
+class RSSSampler(threading.Thread):
+    """
+    Peak resident memory of the given processes and their children (Linux /proc), sampled in the background
+    """
+
+    def __init__(self, pids, interval=0.2):
+        super().__init__(daemon=True)
+        self.pids = pids
+        self.interval = interval
+        self.peak_total_kb = 0
+        self.peak_kb = {}
+        self._done = threading.Event()
+
+    def sample(self):
+        total = 0
+        for root in self.pids:
+            for pid in _descendants(root):
+                rss = _rss_kb(pid)
+                total += rss
+                self.peak_kb[pid] = max(self.peak_kb.get(pid, 0), rss)
+        self.peak_total_kb = max(self.peak_total_kb, total)
+        return total
+
+    def run(self):
+        while not self._done.is_set():
+            self.sample()
+            self._done.wait(self.interval)
+
+    def stop(self):
+        self._done.set()
+        self.join()
+        return {
+            "peak_total_mb": round(self.peak_total_kb / 1024, 1),
+            "peak_per_process_mb": {str(pid): round(kb / 1024, 1) for pid, kb in sorted(self.peak_kb.items())},
+        }
+
+
+def _percentiles(values):
+    if not values:
+        return None
+    values = np.asarray(values) * 1000
+    return {
+        "p50": round(float(np.percentile(values, 50)), 1),
+        "p95": round(float(np.percentile(values, 95)), 1),
+        "p99": round(float(np.percentile(values, 99)), 1),
+        "mean": round(float(values.mean()), 1),
+        "max": round(float(values.max()), 1),
+    }
+
+
+def run_scenario(base_url, scenario, concurrency=8, requests_count=100, stream=False, pids=(), warmup=0,
+                 timeout=300, use_async=False, **payload_options):
+    """
+    Run one scenario and return its summary
+    """
+    payloads = Payloads(scenario, uuid.uuid4().hex[:8], **payload_options)
+    endpoint = PATHS[scenario] + ("async/" if use_async else "")
+    url = base_url.rstrip("/") + endpoint
+    local = threading.local()
+
+    def session():
+        if not hasattr(local, "session"):
+            local.session = requests.Session()
+        return local.session
+
+    def one(index):
+        data, files = payloads.build(index)
+        try:
+            return _send(session(), url, data, files, stream, timeout)
+        except requests.RequestException as e:
+            return None, None, type(e).__name__
+
+    # Files are generated up front so that their cost is not measured
+    payloads.build(0)
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(one, range(requests_count, requests_count + warmup)))
+
+        sampler = RSSSampler(pids) if pids else None
+        if sampler:
+            sampler.start()
+        started = time.perf_counter()
+        results = list(executor.map(one, range(requests_count)))
+        wall = time.perf_counter() - started
+
+    latencies = [latency for latency, _, error in results if error is None and latency is not None]
+    first_tokens = [first for _, first, error in results if error is None and first is not None]
+    errors = {}
+    for _, _, error in results:
+        if error is not None:
+            errors[error] = errors.get(error, 0) + 1
+    summary = {
+        "scenario": scenario,
+        "endpoint": endpoint,
+        "stream": stream,
+        "concurrency": concurrency,
+        "requests": requests_count,
+        "ok": len(latencies),
+        "errors": errors,
+        "wall_s": round(wall, 3),
+        "rps": round(len(latencies) / wall, 2) if wall else None,
+        "latency_ms": _percentiles(latencies),
+        "ttft_ms": _percentiles(first_tokens),
+    }
+    if sampler:
+        summary["rss"] = sampler.stop()
+    return summary
+
+
+def _git(*args):
+    try:
+        return subprocess.run(["git", *args], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_metadata(args):
+    return {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "git_commit": _git("rev-parse", "HEAD"),
+        "git_dirty": bool(_git("status", "--porcelain", "--untracked-files=no")),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "args": args,
+    }
+
+
+def save_results(path, results, meta):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "w") as f:
+        json.dump({"meta": meta, "results": results}, f, indent=2)
+
+
+def print_summary(summary):
+    latency = summary["latency_ms"] or {}
+    ttft = summary["ttft_ms"] or {}
+    print(f"{summary['scenario']:>6} c={summary['concurrency']:<3} ok={summary['ok']}/{summary['requests']} "
+          f"rps={summary['rps']} p50={latency.get('p50')} p95={latency.get('p95')} p99={latency.get('p99')} ms "
+          f"ttft_p50={ttft.get('p50')} ms rss={summary.get('rss', {}).get('peak_total_mb')} MB "
+          f"errors={summary['errors'] or 0}")
+
+
+def add_load_arguments(parser):
+    parser.add_argument("--scenario", action="append", choices=SCENARIOS,
+                        help="repeat for several scenarios (default: all)")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=100, help="requests per scenario")
+    parser.add_argument("--warmup", type=int, default=4, help="unmeasured requests before each scenario")
+    parser.add_argument("--stream", action="store_true", help="ask for SSE answers and measure time to first token")
+    parser.add_argument("--async", dest="use_async", action="store_true",
+                        help="use the async endpoints (/chat/async/ ...); under ASGI only they stream without buffering")
+    parser.add_argument("--turns", type=int, default=1, help="chat turns per session")
+    parser.add_argument("--repeat-prompts", action="store_true", help="send the same prompt every time")
+    parser.add_argument("--unique-files", action="store_true", help="upload a different image/PDF every time")
+    parser.add_argument("--image-size", default="4000x3000")
+    parser.add_argument("--pdf-pages", type=int, default=20)
+    parser.add_argument("--timeout", type=float, default=300)
+    parser.add_argument("--output", help="JSON file for the results")
+
+
+def run_all(base_url, args, pids=()):
+    width, height = (int(value) for value in args.image_size.split("x"))
+    results = {}
+    for scenario in args.scenario or SCENARIOS:
+        summary = run_scenario(
+            base_url, scenario,
+            concurrency=args.concurrency,
+            requests_count=args.requests,
+            stream=args.stream,
+            pids=pids,
+            warmup=args.warmup,
+            timeout=args.timeout,
+            use_async=args.use_async,
+            turns=args.turns,
+            unique_prompts=not args.repeat_prompts,
+            unique_files=args.unique_files,
+            image_size=(width, height),
+            pdf_pages=args.pdf_pages,
+        )
+        print_summary(summary)
+        results[scenario] = summary
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--pid", type=int, action="append", default=[],
+                        help="server process to sample RSS from, with its children")
+    add_load_arguments(parser)
+    args = parser.parse_args()
+    results = run_all(args.url, args, pids=args.pid)
+    if args.output:
+        save_results(args.output, results, run_metadata(vars(args)))
+        print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
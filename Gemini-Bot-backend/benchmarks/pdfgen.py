@@ -0,0 +1,112 @@
+"""
+Synthetic PDFs with real text layers, written without any PDF library
+"""
+import random
+
+TOPICS = ("invoice", "contract", "warranty", "shipment", "refund", "account", "subscription", "support ticket",
+          "maintenance", "inspection", "policy", "incident")
+VERBS = ("covers", "requires", "excludes", "describes", "limits", "extends", "replaces", "confirms")
+OBJECTS = ("the service level", "the delivery date", "the payment terms", "the liability cap", "the renewal notice",
+           "the data retention period", "the spare parts", "the on-site visit", "the late fee", "the audit rights")
+
+
+def synthetic_lines(rng, count, page):
+    lines = []
+    for i in range(count):
+        topic = rng.choice(TOPICS)
+        lines.append(f"Section {page}.{i + 1}: the {topic} {rng.choice(VERBS)} {rng.choice(OBJECTS)} "
+                     f"for reference {rng.choice('ABCDEFGH')}-{rng.randint(1000, 9999)} "
+                     f"at {rng.randint(1, 99)} percent.")
+    return lines
+
+
+def synthetic_pages(pages, lines_per_page=40, seed=0):
+    """
+    ``pages`` pages of varied, numbered sentences; the same seed gives the same text
+    """
+    rng = random.Random(seed)
+    return [synthetic_lines(rng, lines_per_page, page + 1) for page in range(pages)]
+
+
+def synthetic_table_pages(pages, rows=45, seed=0):
+    """
+    ``pages`` pages of ruled tables, one tuple of cells per row; the same seed gives the same cells
+    """
+    rng = random.Random(seed)
+    result = []
+    for page in range(pages):
+        table = [("Item", "Reference", "Topic", "Quantity", "Unit price", "Total")]
+        for row in range(rows):
+            quantity = rng.randint(1, 500)
+            price = rng.randint(100, 99999) / 100
+            table.append((f"{page + 1}.{row + 1}", f"{rng.choice('ABCDEFGH')}-{rng.randint(1000, 9999)}",
+                          rng.choice(TOPICS), str(quantity), f"{price:.2f}", f"{quantity * price:.2f}"))
+        result.append(table)
+    return result
+
+
+def _escape(text):
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)").encode("latin-1", "replace")
+
+
+def _text_stream(lines):
+    return b"BT /F1 9 Tf 40 800 Td 11 TL " + b" ".join(b"(" + _escape(line) + b") '" for line in lines) + b" ET"
+
+
+def _table_stream(rows, left=40, top=800, row_height=17, column_width=88):
+    """
+    Cells placed one by one with ruling lines around them, like an exported spreadsheet
+    """
+    columns = max(len(row) for row in rows)
+    right = left + columns * column_width
+    bottom = top - len(rows) * row_height
+    parts = [b"0.5 w"]
+    for i in range(len(rows) + 1):
+        y = top - i * row_height
+        parts.append(b"%d %d m %d %d l S" % (left, y, right, y))
+    for column in range(columns + 1):
+        x = left + column * column_width
+        parts.append(b"%d %d m %d %d l S" % (x, top, x, bottom))
+    parts.append(b"BT /F1 8 Tf")
+    for i, row in enumerate(rows):
+        y = top - (i + 1) * row_height + 5
+        for column, cell in enumerate(row):
+            parts.append(b"1 0 0 1 %d %d Tm (%s) Tj" % (left + column * column_width + 3, y, _escape(cell)))
+    parts.append(b"ET")
+    return b"\n".join(parts)
+
+
+def make_pdf(pages):
+    """
+    Bytes of a PDF with one Helvetica page per item of ``pages``: a list of
+    text lines, or a list of row tuples for a table page
+    """
+    objects = []
+
+    def add(body):
+        objects.append(body)
+        return len(objects)
+
+    font = add(b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+    pages_id = add(b"")
+    kids = []
+    for lines in pages:
+        stream = _table_stream(lines) if lines and isinstance(lines[0], tuple) else _text_stream(lines)
+        contents = add(b"<< /Length %d >>\nstream\n%s\nendstream" % (len(stream), stream))
+        kids.append(add(b"<< /Type /Page /Parent %d 0 R /MediaBox [0 0 612 842] "
+                        b"/Resources << /Font << /F1 %d 0 R >> >> /Contents %d 0 R >>" % (pages_id, font, contents)))
+    objects[pages_id - 1] = (b"<< /Type /Pages /Kids [" + b" ".join(b"%d 0 R" % kid for kid in kids)
+                             + b"] /Count %d >>" % len(kids))
+    catalog = add(b"<< /Type /Catalog /Pages %d 0 R >>" % pages_id)
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n%s\nendobj\n" % (number, body)
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    for offset in offsets:
+        out += b"%010d 00000 n \n" % offset
+    out += b"trailer\n<< /Size %d /Root %d 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, catalog, xref)
+    return bytes(out)
@@ -0,0 +1,147 @@
+"""
+Benchmark the backend end to end against the fake Gemini server.
+
+Starts ``benchmarks.fake_gemini`` in-process, migrates a throwaway database,
+launches the backend (``runserver`` or ``uvicorn`` with ``--workers``) with all
+of its state in a temporary directory, runs the load test and saves the results
+together with the fake server's request counts.
+
+    python -m benchmarks.run --server uvicorn --workers 2 --concurrency 16 --requests 200 \\
+        --output benchmarks/results/$(git rev-parse --short HEAD).json
+"""
+import argparse
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from benchmarks.fake_gemini import FakeGeminiConfig, make_server
+from benchmarks.loadtest import add_load_arguments, run_all, run_metadata, save_results
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _wait_for_port(port, process, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Backend exited with code {process.returncode}")
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=1):
+                return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f"Backend did not listen on port {port} within {timeout}s")
+
+
+def backend_env(workdir, fake_url, args):
+    """
+    Environment for the backend: the fake API, and every database, index and store under ``workdir``
+    """
+    env = dict(os.environ)
+    env.update({
+        "GEMINI_API_KEY": "bench",
+        "GEMINI_API_BASE_URL": fake_url,
+        "DATABASE_PATH": os.path.join(workdir, "db.sqlite3"),
+        "PDF_INDEX_DIR": os.path.join(workdir, "embeddings") + os.sep,
+        "PDF_CORPUS_DIR": os.path.join(workdir, "corpus") + os.sep,
+        "PDF_UPLOAD_DIR": os.path.join(workdir, "pdfs") + os.sep,
+        "PDF_EMBEDDING_CACHE_PATH": os.path.join(workdir, "embedding_cache.sqlite3"),
+        "PDF_EMBEDDING_UPSTREAM_URL": "",
+        "CHAT_SESSION_PATH": os.path.join(workdir, "sessions.sqlite3"),
+        "IMAGE_STORE_DIR": os.path.join(workdir, "images"),
+        # The fake server has no Files API
+        "IMAGE_UPLOAD_FILES": "False",
+        "ANSWER_CACHE_ENABLED": str(not args.no_answer_cache),
+        "PYTHONUNBUFFERED": "1",
+    })
+    for item in args.env:
+        key, _, value = item.partition("=")
+        env[key] = value
+    return env
+
+
+def backend_command(port, args):
+    if args.server == "uvicorn":
+        return [sys.executable, "-m", "uvicorn", "APIs.asgi:application", "--host", "127.0.0.1",
+                "--port", str(port), "--workers", str(args.workers), "--log-level", "warning", "--no-access-log"]
+    command = [sys.executable, "manage.py", "runserver", f"127.0.0.1:{port}", "--noreload"]
+    if args.no_threading:
+        command.append("--nothreading")
+    return command
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("--server", choices=("runserver", "uvicorn"), default="uvicorn")
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn worker processes")
+    parser.add_argument("--no-threading", action="store_true", help="runserver without threads")
+    parser.add_argument("--no-answer-cache", action="store_true", help="start with ANSWER_CACHE_ENABLED=False")
+    parser.add_argument("--env", action="append", default=[], metavar="KEY=VALUE",
+                        help="extra backend setting, may be repeated")
+    parser.add_argument("--keep", action="store_true", help="keep the temporary state directory")
+    parser.add_argument("--latency-ms", type=float, default=300, help="fake time to first token")
+    parser.add_argument("--tokens-per-second", type=float, default=80)
+    parser.add_argument("--answer-tokens", type=int, default=120)
+    parser.add_argument("--chunk-tokens", type=int, default=8)
+    parser.add_argument("--rate-limit-ratio", type=float, default=0.0, help="share of fake 429 responses")
+    parser.add_argument("--embedding-latency-ms", type=float, default=30)
+    add_load_arguments(parser)
+    args = parser.parse_args()
+
+    fake = make_server("127.0.0.1", _free_port(), FakeGeminiConfig(
+        latency_ms=args.latency_ms,
+        tokens_per_second=args.tokens_per_second,
+        answer_tokens=args.answer_tokens,
+        chunk_tokens=args.chunk_tokens,
+        rate_limit_ratio=args.rate_limit_ratio,
+        embedding_latency_ms=args.embedding_latency_ms,
+    ))
+    threading.Thread(target=fake.serve_forever, daemon=True).start()
+    fake_url = f"http://127.0.0.1:{fake.server_address[1]}"
+
+    workdir = tempfile.mkdtemp(prefix="gemini-bot-bench-")
+    env = backend_env(workdir, fake_url, args)
+    port = _free_port()
+    process = None
+    try:
+        subprocess.run([sys.executable, "manage.py", "migrate", "--verbosity", "0"], cwd=BACKEND_DIR, env=env,
+                       check=True)
+        process = subprocess.Popen(backend_command(port, args), cwd=BACKEND_DIR, env=env)
+        _wait_for_port(port, process)
+        print(f"Backend ({args.server}) on http://127.0.0.1:{port}, fake Gemini API on {fake_url}")
+
+        results = run_all(f"http://127.0.0.1:{port}", args, pids=[process.pid])
+        upstream = fake.stats.snapshot()
+        print(f"Fake API calls: {upstream}")
+        if args.output:
+            meta = run_metadata(vars(args))
+            meta["upstream_calls"] = upstream
+            save_results(args.output, results, meta)
+            print(f"Results written to {args.output}")
+    finally:
+        if process is not None:
+            process.terminate()
+            try:
+                process.wait(timeout=15)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        fake.shutdown()
+        if args.keep:
+            print(f"State kept in {workdir}")
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+import os
+import shutil
+import uuid
+
+IMAGE_DIR = "image_bot/images"
+EXTENSIONS = {"image/jpeg": "jpg", "image/png": "png"}
+MIME_TYPES = {extension: mime_type for mime_type, extension in EXTENSIONS.items()}
+
+
+class ImageStore:
+    """
+    Prepared images on disk, one directory per content hash holding the parts
+    sent to the model (``0.jpg``, then ``1.jpg``... for tiles)
+    """
+
+    def __init__(self, root=IMAGE_DIR):
+        self.root = root
+
+    def path_for(self, file_hash):
+        return os.path.join(self.root, file_hash)
+
+    def exists(self, file_hash):
+        return os.path.isdir(self.path_for(file_hash))
+
+    def part_paths(self, file_hash):
+        """
+        (path, mime type) of each stored part, in order
+        """
+        path = self.path_for(file_hash)
+        try:
+            names = os.listdir(path)
+        except FileNotFoundError:
+            return []
+        parts = []
+        for name in names:
+            index, _, extension = name.partition(".")
+            if index.isdigit() and extension in MIME_TYPES:
+                parts.append((int(index), os.path.join(path, name), MIME_TYPES[extension]))
+        return [(part_path, mime_type) for _, part_path, mime_type in sorted(parts)]
+
+    def save(self, file_hash, parts):
+        """
+        Write the ``{"mime_type", "data"}`` parts of an image, replacing any stored copy at once
+        """
+        os.makedirs(self.root, exist_ok=True)
+        tmp_path = os.path.join(self.root, f".{file_hash}.{uuid.uuid4().hex}")
+        os.makedirs(tmp_path)
+        for index, part in enumerate(parts):
+            with open(os.path.join(tmp_path, f"{index}.{EXTENSIONS[part['mime_type']]}"), "wb") as f:
+                f.write(part["data"])
+        path = self.path_for(file_hash)
+        if os.path.isdir(path):
+            shutil.rmtree(path, ignore_errors=True)
+        try:
+            os.replace(tmp_path, path)
+        except OSError:
+            # Stored concurrently by another request, which holds the same bytes
+            shutil.rmtree(tmp_path, ignore_errors=True)
+
+    def load(self, file_hash):
+        """
+        The stored parts as ``{"mime_type", "data"}`` blobs, or None when the image is not stored
+        """
+        parts = []
+        for part_path, mime_type in self.part_paths(file_hash):
+            with open(part_path, "rb") as f:
+                parts.append({"mime_type": mime_type, "data": f.read()})
+        return parts or None
+
+    def delete(self, file_hash):
+        shutil.rmtree(self.path_for(file_hash), ignore_errors=True)
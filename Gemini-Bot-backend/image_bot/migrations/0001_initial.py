@@ -0,0 +1,70 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:41
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImageDocument',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('session_id', models.CharField(db_index=True, max_length=255, unique=True)),
+                ('file_name', models.CharField(max_length=500)),
+                ('file_size', models.IntegerField()),
+                ('file_hash', models.CharField(max_length=64, unique=True)),
+                ('image_width', models.IntegerField(blank=True, null=True)),
+                ('image_height', models.IntegerField(blank=True, null=True)),
+                ('mime_type', models.CharField(default='image/jpeg', max_length=50)),
+                ('format', models.CharField(max_length=20)),
+                ('created_at', models.DateTimeField(auto_now_add=True, db_index=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('original_filename', models.CharField(blank=True, max_length=500, null=True)),
+                ('upload_ip', models.GenericIPAddressField(blank=True, null=True)),
+                ('description', models.TextField(blank=True, null=True)),
+            ],
+            options={
+                'ordering': ['-created_at'],
+                'indexes': [models.Index(fields=['-created_at'], name='image_bot_i_created_b65df1_idx'), models.Index(fields=['session_id'], name='image_bot_i_session_513adb_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='ImageAnalysis',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('analysis_text', models.TextField()),
+                ('extracted_text', models.TextField(blank=True, null=True)),
+                ('objects_detected', models.JSONField(blank=True, null=True)),
+                ('analysis_time_ms', models.IntegerField(blank=True, null=True)),
+                ('model_used', models.CharField(default='gemini-vision', max_length=100)),
+                ('confidence_scores', models.JSONField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('image_document', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='analysis', to='image_bot.imagedocument')),
+            ],
+            options={
+                'ordering': ['-created_at'],
+            },
+        ),
+        migrations.CreateModel(
+            name='ImageQuery',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('query_text', models.TextField()),
+                ('response_text', models.TextField()),
+                ('response_time_ms', models.IntegerField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True, db_index=True)),
+                ('image_document', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='queries', to='image_bot.imagedocument')),
+            ],
+            options={
+                'ordering': ['-created_at'],
+            },
+        ),
+    ]
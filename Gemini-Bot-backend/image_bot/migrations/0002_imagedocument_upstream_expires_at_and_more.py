@@ -0,0 +1,42 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('image_bot', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='imagedocument',
+            name='upstream_expires_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='imagedocument',
+            name='upstream_files',
+            field=models.JSONField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='imagequery',
+            name='model_used',
+            field=models.CharField(default='gemini-vision', max_length=100),
+        ),
+        migrations.AddField(
+            model_name='imagequery',
+            name='query_key',
+            field=models.CharField(default='', max_length=64),
+        ),
+        migrations.AlterField(
+            model_name='imagedocument',
+            name='session_id',
+            field=models.CharField(db_index=True, max_length=255),
+        ),
+        migrations.AddIndex(
+            model_name='imagequery',
+            index=models.Index(fields=['image_document', 'query_key'], name='image_bot_i_image_d_3e448d_idx'),
+        ),
+    ]
@@ -5,7 +5,7 @@ class ImageDocument(models.Model):
     """
     Model to store image document metadata
     """
-    session_id = models.CharField(max_length=255, unique=True, db_index=True)
+    session_id = models.CharField(max_length=255, db_index=True)  # Session that first uploaded the image
     file_name = models.CharField(max_length=500)
     file_size = models.IntegerField()  # in bytes
     file_hash = models.CharField(max_length=64, unique=True)  # SHA256 hash
@@ -13,6 +13,10 @@ class ImageDocument(models.Model):
     image_height = models.IntegerField(null=True, blank=True)
     mime_type = models.CharField(max_length=50, default="image/jpeg")
     format = models.CharField(max_length=20)  # jpeg, png, webp, etc.
+
+    # Prepared image uploaded to the Gemini Files API: [{"uri", "mime_type"}, ...]
+    upstream_files = models.JSONField(null=True, blank=True)
+    upstream_expires_at = models.DateTimeField(null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True, db_index=True)
     updated_at = models.DateTimeField(auto_now=True)
     
@@ -59,12 +63,18 @@ class ImageQuery(models.Model):
     """
     image_document = models.ForeignKey(ImageDocument, on_delete=models.CASCADE, related_name='queries')
     query_text = models.TextField()
+    # Hash of the prompt, system prompt and model, to answer a repeated question from here
+    query_key = models.CharField(max_length=64, default="")
     response_text = models.TextField()
     response_time_ms = models.IntegerField(null=True, blank=True)
+    model_used = models.CharField(max_length=100, default="gemini-vision")
     created_at = models.DateTimeField(auto_now_add=True, db_index=True)
     
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['image_document', 'query_key']),
+        ]
     
     def __str__(self):
         return f"Query on {self.image_document.file_name}"
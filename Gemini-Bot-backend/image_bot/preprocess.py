@@ -0,0 +1,109 @@
+import io
+import math
+
+from PIL import Image, ImageOps
+
+# Gemini sees images as 768px tiles, so larger edges mostly cost upload time
+DEFAULT_MAX_EDGE = 1536
+DEFAULT_JPEG_QUALITY = 85
+DEFAULT_MAX_TILES = 4
+
+
+class PreparedImage:
+    """
+    Upload-ready image parts (``{"mime_type", "data"}`` blobs) and what was done to get them
+    """
+
+    def __init__(self, parts, source_format, source_size, size, source_bytes):
+        self.parts = parts
+        self.source_format = source_format
+        self.source_size = source_size
+        self.size = size
+        self.source_bytes = source_bytes
+
+    @property
+    def nbytes(self):
+        return sum(len(part["data"]) for part in self.parts)
+
+    def stats(self):
+        return {
+            "source_size": self.source_size,
+            "size": self.size,
+            "parts": len(self.parts),
+            "source_bytes": self.source_bytes,
+            "bytes": self.nbytes,
+        }
+
+
+def _scale(size, max_edge):
+    return min(1.0, max_edge / max(size))
+
+
+def _has_alpha(img):
+    return img.mode in ("RGBA", "LA", "PA") or (img.mode == "P" and "transparency" in img.info)
+
+
+def _encode(img, quality):
+    """
+    JPEG for opaque images, PNG when transparency has to be kept
+    """
+    buffer = io.BytesIO()
+    if _has_alpha(img):
+        if img.mode not in ("RGBA", "LA"):
+            img = img.convert("RGBA")
+        img.save(buffer, format="PNG", optimize=False, compress_level=6)
+        return {"mime_type": "image/png", "data": buffer.getvalue()}
+    if img.mode not in ("RGB", "L"):
+        img = img.convert("RGB")
+    img.save(buffer, format="JPEG", quality=quality, optimize=True)
+    return {"mime_type": "image/jpeg", "data": buffer.getvalue()}
+
+
+def _tiles(img, tile_edge):
+    columns = math.ceil(img.width / tile_edge)
+    rows = math.ceil(img.height / tile_edge)
+    width = math.ceil(img.width / columns)
+    height = math.ceil(img.height / rows)
+    for row in range(rows):
+        for column in range(columns):
+            box = (column * width, row * height,
+                   min(img.width, (column + 1) * width), min(img.height, (row + 1) * height))
+            yield img.crop(box)
+
+
+def prepare_image(data, max_edge=DEFAULT_MAX_EDGE, quality=DEFAULT_JPEG_QUALITY, tile=False,
+                  max_tiles=DEFAULT_MAX_TILES):
+    """
+    Decode uploaded image bytes in memory, upright them from their EXIF
+    orientation, shrink them to ``max_edge`` on the longest side and re-encode.
+
+    JPEGs are decoded at a reduced scale (``draft``) when the target is at least
+    half the size, so a phone photo is never decoded at full resolution. With
+    ``tile``, an image larger than ``max_edge`` is sent as an overview followed
+    by up to ``max_tiles`` crops of at most ``max_edge`` each, keeping detail
+    that a single downscaled image would lose.
+    """
+    img = Image.open(io.BytesIO(data))
+    source_format = img.format
+    source_size = img.size
+
+    target_edge = max_edge
+    if tile and max(source_size) > max_edge:
+        # Largest edge whose tile grid still fits in max_tiles
+        per_side = max(1, math.isqrt(max_tiles))
+        target_edge = min(max(source_size), max_edge * per_side)
+
+    scale = _scale(source_size, target_edge)
+    if scale < 1.0 and img.format == "JPEG":
+        img.draft("RGB", (math.ceil(source_size[0] * scale), math.ceil(source_size[1] * scale)))
+    img = ImageOps.exif_transpose(img)
+    img.thumbnail((target_edge, target_edge), Image.LANCZOS)
+
+    if target_edge == max_edge:
+        return PreparedImage([_encode(img, quality)], source_format, source_size, img.size, len(data))
+
+    overview = img.copy()
+    overview.thumbnail((max_edge, max_edge), Image.LANCZOS)
+    parts = [_encode(overview, quality)]
+    parts.extend(_encode(crop, quality) for crop in _tiles(img, max_edge))
+    return PreparedImage(parts, source_format, source_size, img.size, len(data))
@@ -1,3 +1,165 @@
-from django.test import TestCase
+import asyncio
+import hashlib
+import io
+import os
+import tempfile
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import RequestFactory, SimpleTestCase, TestCase
+from django.utils import timezone
+from PIL import Image, UnidentifiedImageError
+
+from image_bot import views
+from image_bot.image_store import ImageStore
+from image_bot.models import ImageDocument, ImageQuery
+from image_bot.preprocess import prepare_image
+
+
+def encoded(size, mode="RGB", format="JPEG", exif=None):
+    buffer = io.BytesIO()
+    kwargs = {"exif": exif} if exif is not None else {}
+    Image.new(mode, size, color="red" if mode == "RGB" else None).save(buffer, format=format, **kwargs)
+    return buffer.getvalue()
+
+
+def decoded(part):
+    return Image.open(io.BytesIO(part["data"]))
+
+
+class PrepareImageTests(SimpleTestCase):
+    def test_large_images_are_downscaled(self):
+        prepared = prepare_image(encoded((4000, 3000)), max_edge=1000)
+        self.assertEqual(prepared.source_size, (4000, 3000))
+        self.assertEqual(prepared.source_format, "JPEG")
+        self.assertEqual(prepared.size, (1000, 750))
+        self.assertEqual(len(prepared.parts), 1)
+        self.assertEqual(decoded(prepared.parts[0]).size, (1000, 750))
+        self.assertLess(prepared.nbytes, prepared.source_bytes)
+
+    def test_small_images_keep_their_size(self):
+        prepared = prepare_image(encoded((300, 200), format="PNG"), max_edge=1000)
+        self.assertEqual(prepared.size, (300, 200))
+        self.assertEqual(prepared.parts[0]["mime_type"], "image/jpeg")
+
+    def test_transparency_is_kept_as_png(self):
+        prepared = prepare_image(encoded((300, 200), mode="RGBA", format="PNG"))
+        self.assertEqual(prepared.parts[0]["mime_type"], "image/png")
+        self.assertEqual(decoded(prepared.parts[0]).mode, "RGBA")
+
+    def test_exif_orientation_is_applied(self):
+        exif = Image.Exif()
+        exif[0x0112] = 6  # Rotated 90 degrees
+        prepared = prepare_image(encoded((400, 200), exif=exif), max_edge=1000)
+        self.assertEqual(prepared.size, (200, 400))
+
+    def test_tiles_follow_an_overview(self):
+        prepared = prepare_image(encoded((4000, 3000)), max_edge=1000, tile=True, max_tiles=4)
+        self.assertEqual(prepared.size, (2000, 1500))
+        self.assertEqual(len(prepared.parts), 5)
+        self.assertEqual(decoded(prepared.parts[0]).size, (1000, 750))
+        self.assertEqual([decoded(part).size for part in prepared.parts[1:]], [(1000, 750)] * 4)
+        self.assertEqual(prepared.stats()["parts"], 5)
+
+    def test_tiling_small_images_sends_one_part(self):
+        prepared = prepare_image(encoded((800, 600)), max_edge=1000, tile=True)
+        self.assertEqual(len(prepared.parts), 1)
+
+    def test_invalid_data_raises(self):
+        with self.assertRaises(UnidentifiedImageError):
+            prepare_image(b"not an image")
+
+
+class ImageStoreTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.store = ImageStore(directory.name)
+
+    def test_missing_image(self):
+        self.assertFalse(self.store.exists("missing"))
+        self.assertIsNone(self.store.load("missing"))
+        self.store.delete("missing")
+
+    def test_parts_round_trip_in_order(self):
+        parts = [{"mime_type": "image/jpeg", "data": bytes([i])} for i in range(12)]
+        parts.append({"mime_type": "image/png", "data": b"png"})
+        self.store.save("abc", parts)
+        self.assertTrue(self.store.exists("abc"))
+        self.assertEqual(self.store.load("abc"), parts)
+
+    def test_save_replaces_the_stored_copy(self):
+        self.store.save("abc", [{"mime_type": "image/jpeg", "data": b"1"}] * 3)
+        self.store.save("abc", [{"mime_type": "image/png", "data": b"2"}])
+        self.assertEqual(self.store.load("abc"), [{"mime_type": "image/png", "data": b"2"}])
+        self.store.delete("abc")
+        self.assertFalse(self.store.exists("abc"))
+
+
+class BlockedModel:
+    def __init__(self):
+        self.response = mock.Mock(parts=[], prompt_feedback="blocked", usage_metadata=None)
+
+    def generate_content(self, content):
+        return self.response
+
+    async def generate_content_async(self, content):
+        return self.response
+
+
+@mock.patch.dict(os.environ, {"IMAGE_UPLOAD_FILES": "False"})
+class ImageAnswerTests(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.store = ImageStore(directory.name)
+        patcher = mock.patch("image_bot.views._get_image_store", return_value=self.store)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.data = encoded((300, 200))
+        self.file_hash = hashlib.sha256(self.data).hexdigest()
+        self.store.save(self.file_hash, prepare_image(self.data).parts)
+        self.document = ImageDocument.objects.create(session_id="s", file_name="a.jpg", file_size=len(self.data),
+                                                     file_hash=self.file_hash, format="jpeg")
+        self.key = views._query_key("", "What is it?")
+        views._store_answer(self.document, "What is it?", self.key, "A red square.", 0)
+
+    def test_repeated_questions_replay_the_stored_answer(self):
+        self.assertEqual(views._stored_answer(self.document, self.key), "A red square.")
+        self.assertEqual(views._stored_answer(self.document, views._query_key("", "Colour?")), None)
+        response = views._answer_image(self.document, "", "what is it", stream=False)
+        self.assertEqual(response.data, {"generated_text": "A red square.", "image_id": self.document.pk})
+
+    def test_stored_answers_expire(self):
+        ImageQuery.objects.update(created_at=timezone.now() - timedelta(seconds=3601))
+        with mock.patch.dict(os.environ, {"IMAGE_ANSWER_TTL_SECONDS": "7200"}):
+            self.assertEqual(views._stored_answer(self.document, self.key), "A red square.")
+        with mock.patch.dict(os.environ, {"IMAGE_ANSWER_TTL_SECONDS": "3600"}):
+            self.assertIsNone(views._stored_answer(self.document, self.key))
+        with mock.patch.dict(os.environ, {"IMAGE_ANSWER_TTL_SECONDS": "0"}):
+            self.assertIsNone(views._stored_answer(self.document, self.key))
+
+    def test_stored_answers_go_with_the_stored_image(self):
+        self.store.delete(self.file_hash)
+        self.assertIsNone(views._stored_answer(self.document, self.key))
+        # Uploading the image again does not bring the old answers back
+        document = views._store_upload(SimpleUploadedFile("a.jpg", self.data), "s")
+        self.assertEqual(document.pk, self.document.pk)
+        self.assertTrue(self.store.exists(self.file_hash))
+        self.assertIsNone(views._stored_answer(document, self.key))
+        self.assertEqual(ImageQuery.objects.get().response_text, "A red square.")
+
+    def test_blocked_answers_carry_the_image_id(self):
+        with mock.patch("image_bot.views._get_vision_model", return_value=BlockedModel()):
+            response = views._answer_image(self.document, "", "Something else?", stream=False)
+            self.assertEqual(response.data, {"generated_text": views.BLOCKED_MESSAGE, "image_id": self.document.pk})
+
+            request = RequestFactory().post("/image/query/async/")
+            with mock.patch("image_bot.views._stored_answer", return_value=None), \
+                    mock.patch("image_bot.views._image_parts", return_value=[]):
+                response = asyncio.run(views._aanswer_image(request, {"prompt": "Something else?"}, self.document))
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(f'"image_id": {self.document.pk}', response.content.decode())
+        # Blocked answers are not stored
+        self.assertEqual(ImageQuery.objects.count(), 1)
@@ -3,4 +3,8 @@ from image_bot import views
 
 urlpatterns = [
     path('image/', views.image_bot, name='image'),
+    path('image/async/', views.image_bot_async, name='image_async'),
+    path('image/upload/', views.image_upload, name='image_upload'),
+    path('image/query/', views.image_query, name='image_query'),
+    path('image/query/async/', views.image_query_async, name='image_query_async'),
 ]
@@ -1,15 +1,38 @@
+from django.http import JsonResponse
+from django.utils import timezone
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
 from rest_framework.decorators import api_view
 import google.generativeai as genai
 from rest_framework.response import Response
-from PIL import Image
 from decouple import config
+from datetime import timedelta
+import hashlib
 import os
+import time
+
+from APIs.answer_cache import normalize_question
+from APIs.async_utils import aiter_values, get_executor, request_data, run_blocking
+from APIs.gemini import configure_genai
+from APIs.metrics import atimed_chunks, count_image, count_tokens, count_usage, span, timed_chunks, upstream_call
+from APIs.streaming import async_sse_response, sse_response, wants_stream
+from APIs.tokens import estimate_tokens
+from image_bot.image_store import ImageStore
+from image_bot.models import ImageDocument, ImageQuery
+from image_bot.preprocess import DEFAULT_JPEG_QUALITY, DEFAULT_MAX_EDGE, DEFAULT_MAX_TILES, prepare_image
 
 API_KEY = config("GEMINI_API_KEY", default=None)
 # API_KEY = os.environ["GEMINI_API_KEY"]
 
 # Model Initialization
 _vision_model = None
+_image_store = None
+
+# Bump when the way prompts are sent changes, so stored answers are not reused
+IMAGE_PROMPT_VERSION = 1
+BLOCKED_MESSAGE = "Error: The response was blocked by safety filters."
+# Files API uploads are refreshed this long before they expire
+UPSTREAM_EXPIRY_MARGIN = timedelta(minutes=10)
 
 
 def _get_api_key():
@@ -27,10 +50,217 @@ def _get_vision_model():
         api_key = _get_api_key()
         if not api_key:
             raise ValueError("GEMINI_API_KEY not configured")
-        genai.configure(api_key=api_key)
+        configure_genai(api_key)
         _vision_model = genai.GenerativeModel(_get_vision_model_name())
     return _vision_model
 
+def _get_image_store():
+    global _image_store
+    if _image_store is None:
+        _image_store = ImageStore(config("IMAGE_STORE_DIR", default="image_bot/images"))
+    return _image_store
+
+def _prepare_image(data):
+    """
+    Uploaded image bytes as blobs sized for the vision model, decoded in memory
+    """
+    with span("image", "prepare"):
+        prepared = prepare_image(
+            data,
+            max_edge=config("IMAGE_MAX_EDGE", default=DEFAULT_MAX_EDGE, cast=int),
+            quality=config("IMAGE_JPEG_QUALITY", default=DEFAULT_JPEG_QUALITY, cast=int),
+            tile=config("IMAGE_TILING", default=False, cast=bool),
+            max_tiles=config("IMAGE_MAX_TILES", default=DEFAULT_MAX_TILES, cast=int),
+        )
+    count_image(prepared.source_bytes, prepared.nbytes)
+    return prepared
+
+def _store_upload(image, session_id, upload_ip=None):
+    """
+    Store an uploaded image once per content hash and return its ImageDocument.
+    An image already stored is neither decoded nor written again.
+    """
+    data = b"".join(image.chunks())
+    file_hash = hashlib.sha256(data).hexdigest()
+    image_store = _get_image_store()
+
+    document = ImageDocument.objects.filter(file_hash=file_hash).first()
+    if document is not None and image_store.exists(file_hash):
+        return document
+
+    prepared = _prepare_image(data)
+    with span("image", "save_image"):
+        image_store.save(file_hash, prepared.parts)
+    width, height = prepared.size
+    fields = {
+        "image_width": width,
+        "image_height": height,
+        "mime_type": prepared.parts[0]["mime_type"],
+        "format": (prepared.source_format or "").lower(),
+    }
+    document, created = ImageDocument.objects.get_or_create(
+        file_hash=file_hash,
+        defaults={
+            "session_id": session_id or "",
+            "file_name": os.path.basename(image.name or file_hash),
+            "original_filename": image.name,
+            "file_size": len(data),
+            "upload_ip": upload_ip,
+            **fields,
+        },
+    )
+    if not created:
+        # The stored copy had gone missing: the new one may differ, so is any Files API upload
+        fields.update(upstream_files=None, upstream_expires_at=None)
+        ImageDocument.objects.filter(pk=document.pk).update(**fields)
+        # and the answers given about the old copy are not replayed (they stay in the query log)
+        ImageQuery.objects.filter(image_document=document).update(query_key="")
+        for name, value in fields.items():
+            setattr(document, name, value)
+    return document
+
+def _upstream_files(document):
+    """
+    Files API references to the stored image, uploading it when there are none left valid
+    """
+    now = timezone.now()
+    if document.upstream_files and document.upstream_expires_at \
+            and document.upstream_expires_at - UPSTREAM_EXPIRY_MARGIN > now:
+        return document.upstream_files
+
+    files = []
+    expires_at = None
+    for index, (path, mime_type) in enumerate(_get_image_store().part_paths(document.file_hash)):
+        with span("image", "upload_file"), upstream_call("upload_file", "files"):
+            uploaded = genai.upload_file(path, mime_type=mime_type,
+                                         display_name=f"{document.file_hash[:16]}-{index}")
+        files.append({"uri": uploaded.uri, "mime_type": uploaded.mime_type})
+        if uploaded.expiration_time is not None:
+            expires_at = min(expires_at or uploaded.expiration_time, uploaded.expiration_time)
+    if not files:
+        return None
+    ImageDocument.objects.filter(pk=document.pk).update(upstream_files=files, upstream_expires_at=expires_at)
+    document.upstream_files = files
+    document.upstream_expires_at = expires_at
+    return files
+
+def _image_parts(document):
+    """
+    The stored image as content parts: Files API references when enabled, else the bytes inline.
+    Returns None when the image is no longer stored.
+    """
+    if config("IMAGE_UPLOAD_FILES", default=True, cast=bool):
+        try:
+            files = _upstream_files(document)
+            if files:
+                return [genai.protos.Part(file_data=genai.protos.FileData(file_uri=f["uri"], mime_type=f["mime_type"]))
+                        for f in files]
+        except Exception as e:
+            print(f"Could not upload image {document.file_hash} to the Files API, sending it inline: {e}")
+    return _get_image_store().load(document.file_hash)
+
+def _content(system_prompt, prompt, image_parts):
+    content = []
+    if system_prompt:
+        content.append(system_prompt)
+    if prompt:
+        content.append(prompt)
+    content.extend(image_parts)
+    return content
+
+def _query_key(system_prompt, prompt):
+    key = "\n".join([str(IMAGE_PROMPT_VERSION), _get_vision_model_name(), system_prompt or "",
+                     normalize_question(prompt)])
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+def _stored_answer(document, query_key):
+    """
+    The answer given to the same question about this image within IMAGE_ANSWER_TTL_SECONDS,
+    while the image is still stored, or None
+    """
+    ttl = config("IMAGE_ANSWER_TTL_SECONDS", default=86400, cast=int)
+    if ttl <= 0 or not _get_image_store().exists(document.file_hash):
+        return None
+    return ImageQuery.objects.filter(image_document=document, query_key=query_key,
+                                     created_at__gte=timezone.now() - timedelta(seconds=ttl)) \
+        .values_list("response_text", flat=True).first()
+
+def _store_answer(document, prompt, query_key, text, started):
+    # Blocked or empty answers are not worth replaying
+    if not text or BLOCKED_MESSAGE in text:
+        return
+    ImageQuery.objects.create(
+        image_document=document,
+        query_text=prompt or "",
+        query_key=query_key,
+        response_text=text,
+        response_time_ms=int((time.perf_counter() - started) * 1000),
+        model_used=_get_vision_model_name(),
+    )
+
+def _count_tokens(usage, prompt, text):
+    # Estimated when the response carries no usage metadata; image tokens are then left out
+    if not count_usage("image", usage):
+        count_tokens("image", estimate_tokens(prompt or ''), estimate_tokens(text))
+
+def _generate(model, content, prompt):
+    with span("image", "generate"), upstream_call("generate", _get_vision_model_name()):
+        response = model.generate_content(content)
+    _count_tokens(response.usage_metadata, prompt, response.text if response.parts else "")
+    return response
+
+def _stream_content(model, content, prompt):
+    started = time.perf_counter()
+    parts = []
+    usage = None
+    with upstream_call("stream", _get_vision_model_name()):
+        for chunk in timed_chunks(model.generate_content(content, stream=True), "image", started=started):
+            usage = chunk.usage_metadata
+            if not chunk.parts:
+                print(f"Response blocked or empty. Feedback: {chunk.prompt_feedback}")
+                yield BLOCKED_MESSAGE
+                return
+            parts.append(chunk.text)
+            yield chunk.text
+    _count_tokens(usage, prompt, "".join(parts))
+
+def _answer_image(document, system_prompt, prompt, stream):
+    """
+    Answer a question about a stored image, replaying the stored answer to a repeated question
+    """
+    extra = {"image_id": document.pk}
+    query_key = _query_key(system_prompt, prompt)
+    answer = _stored_answer(document, query_key)
+    if answer is not None:
+        if stream:
+            return sse_response([answer], extra=extra)
+        return Response({"generated_text": answer, **extra})
+
+    model = _get_vision_model()
+    with span("image", "load_image"):
+        image_parts = _image_parts(document)
+    if image_parts is None:
+        return Response({"generated_text": "Image expired, please upload it again."}, status=410)
+    content = _content(system_prompt, prompt, image_parts)
+    started = time.perf_counter()
+
+    if stream:
+        return sse_response(
+            _stream_content(model, content, prompt),
+            on_complete=lambda text: _store_answer(document, prompt, query_key, text, started),
+            extra=extra,
+        )
+
+    response = _generate(model, content, prompt)
+    # Check if response was blocked or invalid
+    if not response.parts:
+        print(f"Response blocked or empty. Feedback: {response.prompt_feedback}")
+        return Response({'generated_text': BLOCKED_MESSAGE, **extra})
+
+    text = response.text
+    _store_answer(document, prompt, query_key, text, started)
+    return Response({'generated_text': text, **extra})
+
 @api_view(['POST'])
 def image_bot(request):
     if request.method == 'POST':
@@ -39,40 +269,151 @@ def image_bot(request):
             system_prompt = request.data.get('system_prompt', '')
             prompt = request.data.get('prompt')
             image = request.data.get('image')
+            if image is None:
+                return Response({"generated_text": "No image uploaded"}, status=400)
 
-            os.makedirs('image_bot/images/', exist_ok=True)
-            image_path = f"image_bot/images/{session_id}.png"
-            with open(image_path, 'wb') as f:
-                for chunk in image.chunks():
-                    f.write(chunk)
-
-            img = Image.open(image_path)
-            
-            model = _get_vision_model()
-            
-            content = []
-            if system_prompt:
-                content.append(system_prompt)
-            if prompt:
-                content.append(prompt)
-            content.append(img)
-            
-            response = model.generate_content(content)
-            # Check if response was blocked or invalid
-            if not response.parts:
-                 print(f"Response blocked or empty. Feedback: {response.prompt_feedback}")
-                 return Response({'generated_text': "Error: The response was blocked by safety filters."})
-                 
-            text = response.text
-            
-            img.close() # Close image before deleting
-            if os.path.exists(image_path):
-                os.remove(image_path)
-
-            return Response({'generated_text': text})
+            document = _store_upload(image, session_id, request.META.get("REMOTE_ADDR"))
+            return _answer_image(document, system_prompt, prompt, wants_stream(request))
         except Exception as e:
             print(f"Error in image_bot: {e}")
             traceback.print_exc()
             if hasattr(e, 'response'):
                 print(f"Response feedback: {e.response.prompt_feedback}")
-            return Response({"generated_text": "Something went wrong. Please try again later. Error: " + str(e)}, status=200)
\ No newline at end of file
+            return Response({"generated_text": "Something went wrong. Please try again later. Error: " + str(e)}, status=200)
+
+def _image_status(document):
+    return {
+        "image_id": document.pk,
+        "file_hash": document.file_hash,
+        "width": document.image_width,
+        "height": document.image_height,
+    }
+
+@api_view(['POST'])
+def image_upload(request):
+    """
+    Store an image once so that questions can refer to it by ``image_id``
+    """
+    try:
+        image = request.data.get('image')
+        if image is None:
+            return Response({"generated_text": "No image uploaded"}, status=400)
+        document = _store_upload(image, request.data.get('session_id'), request.META.get("REMOTE_ADDR"))
+        return Response(_image_status(document))
+    except Exception as e:
+        print(f"Error in image_upload: {e}")
+        traceback.print_exc()
+        return Response({"generated_text": f"An error occurred: {str(e)}"}, status=500)
+
+@api_view(['POST'])
+def image_query(request):
+    """
+    Answer a question about an image stored by ``image_upload``
+    """
+    try:
+        image_id = request.data.get('image_id')
+        document = ImageDocument.objects.filter(pk=image_id).first() if image_id else None
+        if document is None:
+            return Response({"generated_text": "Image not found"}, status=404)
+        return _answer_image(document, request.data.get('system_prompt', ''), request.data.get('prompt'),
+                             wants_stream(request))
+    except Exception as e:
+        print(f"Error in image_query: {e}")
+        traceback.print_exc()
+        return Response({"generated_text": "Something went wrong. Please try again later. Error: " + str(e)}, status=200)
+
+async def _stream_content_async(model, content, prompt):
+    started = time.perf_counter()
+    parts = []
+    usage = None
+    with upstream_call("stream", _get_vision_model_name()):
+        response = await model.generate_content_async(content, stream=True)
+        async for chunk in atimed_chunks(response, "image", started=started):
+            usage = chunk.usage_metadata
+            if not chunk.parts:
+                print(f"Response blocked or empty. Feedback: {chunk.prompt_feedback}")
+                yield BLOCKED_MESSAGE
+                return
+            parts.append(chunk.text)
+            yield chunk.text
+    _count_tokens(usage, prompt, "".join(parts))
+
+
+async def _aanswer_image(request, data, document):
+    """
+    ``_answer_image`` for async views: database and file work runs on the blocking executor
+    """
+    system_prompt = data.get('system_prompt', '')
+    prompt = data.get('prompt')
+    extra = {"image_id": document.pk}
+    query_key = _query_key(system_prompt, prompt)
+    answer = await run_blocking(_stored_answer, document, query_key)
+    if answer is not None:
+        if wants_stream(request, data):
+            return async_sse_response(aiter_values([answer]), extra=extra)
+        return JsonResponse({"generated_text": answer, **extra})
+
+    model = _get_vision_model()
+    with span("image", "load_image"):
+        image_parts = await run_blocking(_image_parts, document)
+    if image_parts is None:
+        return JsonResponse({"generated_text": "Image expired, please upload it again."}, status=410)
+    content = _content(system_prompt, prompt, image_parts)
+    started = time.perf_counter()
+
+    if wants_stream(request, data):
+        return async_sse_response(
+            _stream_content_async(model, content, prompt),
+            on_complete=lambda text: get_executor().submit(_store_answer, document, prompt, query_key, text, started),
+            extra=extra,
+        )
+
+    with span("image", "generate"), upstream_call("generate", _get_vision_model_name()):
+        response = await model.generate_content_async(content)
+    _count_tokens(response.usage_metadata, prompt, response.text if response.parts else "")
+    # Check if response was blocked or invalid
+    if not response.parts:
+        print(f"Response blocked or empty. Feedback: {response.prompt_feedback}")
+        return JsonResponse({'generated_text': BLOCKED_MESSAGE, **extra})
+    await run_blocking(_store_answer, document, prompt, query_key, response.text, started)
+    return JsonResponse({'generated_text': response.text, **extra})
+
+
+@csrf_exempt
+@require_POST
+async def image_bot_async(request):
+    """
+    ``image_bot`` for ASGI: the upload is stored on the blocking executor
+    and the Gemini call is awaited
+    """
+    try:
+        data = request_data(request)
+        image = data.get('image')
+        if image is None:
+            return JsonResponse({"generated_text": "No image uploaded"}, status=400)
+
+        document = await run_blocking(_store_upload, image, data.get('session_id'), request.META.get("REMOTE_ADDR"))
+        return await _aanswer_image(request, data, document)
+    except Exception as e:
+        print(f"Error in image_bot_async: {e}")
+        traceback.print_exc()
+        return JsonResponse({"generated_text": "Something went wrong. Please try again later. Error: " + str(e)}, status=200)
+
+
+@csrf_exempt
+@require_POST
+async def image_query_async(request):
+    """
+    ``image_query`` for ASGI
+    """
+    try:
+        data = request_data(request)
+        image_id = data.get('image_id')
+        document = await ImageDocument.objects.filter(pk=image_id).afirst() if image_id else None
+        if document is None:
+            return JsonResponse({"generated_text": "Image not found"}, status=404)
+        return await _aanswer_image(request, data, document)
+    except Exception as e:
+        print(f"Error in image_query_async: {e}")
+        traceback.print_exc()
+        return JsonResponse({"generated_text": "Something went wrong. Please try again later. Error: " + str(e)}, status=200)
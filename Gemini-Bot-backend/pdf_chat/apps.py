@@ -1,6 +1,31 @@
+import os
+import sys
+
 from django.apps import AppConfig
 
 
+def _serves_requests():
+    """
+    Whether this process is a web server process: any WSGI/ASGI server, or the
+    serving child of ``runserver`` (not its autoreloader parent nor other management commands)
+    """
+    if "pytest" in sys.modules:
+        return False
+    if os.path.basename(sys.argv[0]) not in ("manage.py", "django-admin"):
+        return True
+    if len(sys.argv) < 2 or sys.argv[1] != "runserver":
+        return False
+    return "--noreload" in sys.argv or os.environ.get("RUN_MAIN") == "true"
+
+
 class PdfChatConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "pdf_chat"
+
+    def ready(self):
+        from pdf_chat import signals  # noqa: F401
+
+        # Jobs queued or requeued before a restart are picked up without waiting for the next upload
+        if _serves_requests():
+            from pdf_chat.views import start_worker_pool
+            start_worker_pool()
@@ -0,0 +1,132 @@
+import heapq
+import math
+import pickle
+import re
+from array import array
+from collections import Counter
+
+# Words plus compound identifiers such as part numbers ("AX-200/3") and clause ids ("4.2.1")
+TOKEN_RE = re.compile(r"[a-z0-9]+(?:[-_./:][a-z0-9]+)*")
+SPLIT_RE = re.compile(r"[-_./:]")
+FORMAT_VERSION = 1
+
+
+def tokenize(text):
+    """
+    Lowercase word tokens. Compound identifiers are kept whole and also emitted
+    as their parts, so both "ax-200" and "200" match.
+    """
+    tokens = []
+    for match in TOKEN_RE.finditer(text.lower()):
+        token = match.group()
+        tokens.append(token)
+        if SPLIT_RE.search(token):
+            tokens.extend(part for part in SPLIT_RE.split(token) if part)
+    return tokens
+
+
+def is_exact_lookup(query):
+    """
+    Whether the query names an identifier (a token with a digit), the case
+    where exact lexical matching beats semantic search
+    """
+    return any(any(c.isdigit() for c in token) for token in TOKEN_RE.findall(query.lower()))
+
+
+class BM25Index:
+    """
+    Okapi BM25 over a fixed list of chunks, with integer-encoded postings.
+
+    Terms map to ids; the postings of every term are stored back to back in two
+    ``array('I')`` buffers (chunk ids and term frequencies) addressed by per-term
+    offsets. Chunk ids are positions in the input list, which match the FAISS ids
+    of the same chunks.
+    """
+
+    def __init__(self, k1=1.5, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self.vocab = {}
+        self.offsets = array('Q', [0])
+        self.doc_ids = array('I')
+        self.term_freqs = array('I')
+        self.doc_lengths = array('I')
+        self.avg_length = 0.0
+
+    @classmethod
+    def build(cls, texts, k1=1.5, b=0.75):
+        index = cls(k1=k1, b=b)
+        postings = {}
+        for doc_id, text in enumerate(texts):
+            counts = Counter(tokenize(text))
+            index.doc_lengths.append(sum(counts.values()))
+            for term, tf in counts.items():
+                term_id = index.vocab.setdefault(term, len(index.vocab))
+                postings.setdefault(term_id, []).append((doc_id, tf))
+
+        for term_id in range(len(index.vocab)):
+            for doc_id, tf in postings.pop(term_id):
+                index.doc_ids.append(doc_id)
+                index.term_freqs.append(tf)
+            index.offsets.append(len(index.doc_ids))
+
+        if index.doc_lengths:
+            index.avg_length = sum(index.doc_lengths) / len(index.doc_lengths)
+        return index
+
+    def __len__(self):
+        return len(self.doc_lengths)
+
+    def nbytes(self):
+        vocab_bytes = sum(len(term) + 80 for term in self.vocab)
+        arrays = (self.offsets, self.doc_ids, self.term_freqs, self.doc_lengths)
+        return vocab_bytes + sum(a.itemsize * len(a) for a in arrays)
+
+    def search(self, query, k=10):
+        """
+        Return up to ``k`` (chunk id, score) pairs, best first
+        """
+        n = len(self.doc_lengths)
+        if not n:
+            return []
+        scores = {}
+        for term in set(tokenize(query)):
+            term_id = self.vocab.get(term)
+            if term_id is None:
+                continue
+            start, stop = self.offsets[term_id], self.offsets[term_id + 1]
+            df = stop - start
+            idf = math.log(1 + (n - df + 0.5) / (df + 0.5))
+            for i in range(start, stop):
+                doc_id = self.doc_ids[i]
+                tf = self.term_freqs[i]
+                norm = self.k1 * (1 - self.b + self.b * self.doc_lengths[doc_id] / self.avg_length)
+                scores[doc_id] = scores.get(doc_id, 0.0) + idf * tf * (self.k1 + 1) / (tf + norm)
+        return heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+
+    def dumps(self):
+        return pickle.dumps({
+            "version": FORMAT_VERSION,
+            "k1": self.k1,
+            "b": self.b,
+            "terms": list(self.vocab),
+            "offsets": self.offsets,
+            "doc_ids": self.doc_ids,
+            "term_freqs": self.term_freqs,
+            "doc_lengths": self.doc_lengths,
+        }, protocol=pickle.HIGHEST_PROTOCOL)
+
+    @classmethod
+    def loads(cls, data):
+        state = pickle.loads(data)
+        if state.get("version") != FORMAT_VERSION:
+            raise ValueError("Unsupported BM25 index format")
+        index = cls(k1=state["k1"], b=state["b"])
+        index.vocab = {term: term_id for term_id, term in enumerate(state["terms"])}
+        index.offsets = state["offsets"]
+        index.doc_ids = state["doc_ids"]
+        index.term_freqs = state["term_freqs"]
+        index.doc_lengths = state["doc_lengths"]
+        if index.doc_lengths:
+            index.avg_length = sum(index.doc_lengths) / len(index.doc_lengths)
+        return index
@@ -0,0 +1,173 @@
+import re
+
+import numpy as np
+from langchain_core.documents import Document
+
+from APIs.tokens import estimate_tokens
+from pdf_chat.bm25 import tokenize
+from pdf_chat.ingest import CHUNK_OVERLAP
+
+SENTENCE_RE = re.compile(r"(?<=[.!?])\s+|\n\s*\n")
+# Sentences longer than this (tables, text without punctuation) are cut into lines, then windows
+MAX_SENTENCE_CHARS = 1000
+# Length of the prefix of a chunk searched for in its predecessor's tail
+OVERLAP_PROBE_CHARS = 64
+ELLIPSIS = "..."
+
+
+def mmr(query_vector, vectors, k, lambda_mult=0.5):
+    """
+    Maximal marginal relevance: order up to ``k`` rows of ``vectors`` by
+    similarity to the query, penalised by similarity to the rows already picked
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if not len(vectors):
+        return []
+    query = np.asarray(query_vector, dtype=np.float32)
+    vectors = vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+    query = query / max(float(np.linalg.norm(query)), 1e-12)
+
+    relevance = vectors @ query
+    similarity = vectors @ vectors.T
+    selected = [int(np.argmax(relevance))]
+    redundancy = similarity[selected[0]].copy()
+    while len(selected) < min(k, len(vectors)):
+        scores = lambda_mult * relevance - (1 - lambda_mult) * redundancy
+        scores[selected] = -np.inf
+        best = int(np.argmax(scores))
+        selected.append(best)
+        np.maximum(redundancy, similarity[best], out=redundancy)
+    return selected
+
+
+def strip_overlap(previous, text, max_overlap=CHUNK_OVERLAP * 2):
+    """
+    Drop the prefix of ``text`` that repeats the end of ``previous``, the
+    overlap the splitter adds between neighbouring chunks
+    """
+    probe = text[:OVERLAP_PROBE_CHARS]
+    if not probe:
+        return text
+    pos = previous.find(probe, max(0, len(previous) - max_overlap))
+    while pos >= 0:
+        # The earliest match that runs to the end of previous is the longest overlap
+        if text.startswith(previous[pos:]):
+            return text[len(previous) - pos:].lstrip()
+        pos = previous.find(probe, pos + 1)
+    return text
+
+
+def _sentences(text):
+    for sentence in SENTENCE_RE.split(text):
+        sentence = sentence.strip()
+        if len(sentence) <= MAX_SENTENCE_CHARS:
+            if sentence:
+                yield sentence
+            continue
+        for line in sentence.splitlines():
+            for start in range(0, len(line), MAX_SENTENCE_CHARS):
+                piece = line[start:start + MAX_SENTENCE_CHARS].strip()
+                if piece:
+                    yield piece
+
+
+def _adjacent(previous, document):
+    before, after = previous.metadata, document.metadata
+    if "chunk_index" not in before or "chunk_index" not in after:
+        return False
+    return (before.get("document_id") == after.get("document_id")
+            and after["chunk_index"] == before["chunk_index"] + 1)
+
+
+def _trim(chunks, question, budget_tokens):
+    """
+    Keep the sentences that share the most terms with the question, preferring
+    earlier (more relevant) chunks on ties, until the budget is spent. Sentences
+    stay in document order; gaps are marked with an ellipsis.
+    """
+    terms = set(tokenize(question))
+    candidates = []
+    for rank, (_, text) in enumerate(chunks):
+        for position, sentence in enumerate(_sentences(text)):
+            hits = len(terms.intersection(tokenize(sentence)))
+            candidates.append((-hits, rank, position, sentence))
+    candidates.sort(key=lambda c: c[:3])
+
+    kept = [dict() for _ in chunks]
+    remaining = budget_tokens
+    for _, rank, position, sentence in candidates:
+        # One extra token covers the joining space or gap ellipsis
+        tokens = estimate_tokens(sentence) + 1
+        if tokens <= remaining:
+            kept[rank][position] = sentence
+            remaining -= tokens
+
+    trimmed = []
+    for (document, _), sentences in zip(chunks, kept):
+        if not sentences:
+            continue
+        parts = []
+        last = None
+        for position in sorted(sentences):
+            if last is not None and position != last + 1:
+                parts.append(ELLIPSIS)
+            parts.append(sentences[position])
+            last = position
+        trimmed.append((document, " ".join(parts)))
+    return trimmed
+
+
+def pack_context(question, documents, vectors=None, query_vector=None, budget_tokens=3000, max_chunks=4,
+                 lambda_mult=0.5):
+    """
+    Choose and shrink retrieved chunks to fit a prompt token budget.
+
+    With chunk vectors and the query vector, MMR picks up to ``max_chunks``
+    diverse chunks from ``documents``; otherwise the retrieval order is kept.
+    Overlap shared with a neighbouring selected chunk is sent once and, if the
+    chunks still exceed ``budget_tokens``, they are cut down to the sentences
+    most relevant to the question.
+
+    Returns the packed documents (in document order) and a stats dict with the
+    tokens the top ``max_chunks`` chunks would have cost and the tokens sent.
+    """
+    baseline = sum(estimate_tokens(doc.page_content) for doc in documents[:max_chunks])
+    if vectors is not None and query_vector is not None and len(documents) > 1:
+        order = mmr(query_vector, vectors, max_chunks, lambda_mult=lambda_mult)
+    else:
+        order = list(range(min(max_chunks, len(documents))))
+
+    # Relevance rank of each selected chunk, then deduplicate in reading order
+    ranked = [documents[i] for i in order]
+    reading = sorted(range(len(ranked)), key=lambda r: (str(ranked[r].metadata.get("document_id", "")),
+                                                        ranked[r].metadata.get("chunk_index", r)))
+    texts = {}
+    seen = set()
+    previous = None
+    for r in reading:
+        document = ranked[r]
+        text = document.page_content
+        if text in seen:
+            previous = document
+            continue
+        seen.add(text)
+        if previous is not None and _adjacent(previous, document):
+            text = strip_overlap(previous.page_content, text)
+        texts[r] = text
+        previous = document
+
+    chunks = [(ranked[r], texts[r]) for r in range(len(ranked)) if r in texts]
+    if sum(estimate_tokens(text) for _, text in chunks) > budget_tokens:
+        chunks = _trim(chunks, question, budget_tokens)
+
+    position = {id(document): i for i, document in enumerate(ranked[r] for r in reading)}
+    chunks.sort(key=lambda chunk: position[id(chunk[0])])
+    packed = [Document(page_content=text, metadata=document.metadata) for document, text in chunks]
+    packed_tokens = sum(estimate_tokens(doc.page_content) for doc in packed)
+    return packed, {
+        "candidates": len(documents),
+        "chunks": len(packed),
+        "baseline_tokens": baseline,
+        "context_tokens": packed_tokens,
+        "tokens_saved": max(0, baseline - packed_tokens),
+    }
@@ -0,0 +1,323 @@
+import fcntl
+import json
+import os
+import threading
+import uuid
+from contextlib import contextmanager
+
+import faiss
+import numpy as np
+
+INDEX_FLAT = "flat"
+INDEX_IVF = "ivf"
+INDEX_HNSW = "hnsw"
+INDEX_TYPES = (INDEX_FLAT, INDEX_IVF, INDEX_HNSW)
+
+META_FILE = "corpus.json"
+TOMBSTONE_FILE = "tombstones.npy"
+LOCK_FILE = "corpus.lock"
+
+# IVF needs this many training vectors per list before it is worth building
+IVF_TRAINING_FACTOR = 39
+# Filters matching at most this many vectors are scored exactly instead of through the ANN index
+EXACT_SEARCH_LIMIT = 4096
+# Added batches are logged as small delta files and folded into the base index after this many
+MAX_DELTAS = 64
+
+
+class CorpusIndex:
+    """
+    One persistent ANN index over the chunks of every ingested PDF.
+
+    Vectors are stored under int64 ids (PDFChunk.embedding_vector_id) in a FAISS
+    IndexIDMap2 around a Flat, IVF or HNSW index. On disk the index is a base
+    file plus a log of delta files, one per ``add``, so adding a document does
+    not rewrite the whole corpus. Deletes only record tombstones, which searches
+    filter out, until ``compact`` rebuilds the index without them.
+
+    Writes from any process are serialised with an exclusive file lock. Every
+    process keeps the index in memory and replays new deltas (or reloads a new
+    base) when the metadata file changes.
+    """
+
+    def __init__(self, root, index_type=INDEX_FLAT, nlist=1024, nprobe=16, hnsw_m=32,
+                 ef_search=64, compact_ratio=0.2):
+        if index_type not in INDEX_TYPES:
+            raise ValueError(f"Unknown corpus index type: {index_type}")
+        self.root = str(root)
+        self.index_type = index_type
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.hnsw_m = hnsw_m
+        self.ef_search = ef_search
+        self.compact_ratio = compact_ratio
+        self._index = None
+        self._meta = {"next_id": 0, "dim": None, "built_as": None, "generation": 0, "deltas": []}
+        self._generation = 0
+        self._applied = 0
+        self._tombstones = np.empty(0, dtype=np.int64)
+        self._version = None
+        self._lock = threading.RLock()
+        os.makedirs(self.root, exist_ok=True)
+
+    def _path(self, name):
+        return os.path.join(self.root, name)
+
+    @contextmanager
+    def _file_lock(self, mode):
+        with open(self._path(LOCK_FILE), "a") as lock_file:
+            fcntl.flock(lock_file, mode)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    @contextmanager
+    def _write_lock(self):
+        with self._lock, self._file_lock(fcntl.LOCK_EX):
+            self._refresh_locked()
+            yield
+
+    def _disk_version(self):
+        try:
+            stat = os.stat(self._path(META_FILE))
+        except OSError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns
+
+    def _refresh(self):
+        if self._disk_version() == self._version:
+            return
+        with self._file_lock(fcntl.LOCK_SH):
+            self._refresh_locked()
+
+    def _refresh_locked(self):
+        """
+        Catch up with the files on disk: reload the base after a checkpoint or
+        compaction, otherwise only replay the deltas added since the last refresh
+        """
+        version = self._disk_version()
+        if version is None or version == self._version:
+            return
+        with open(self._path(META_FILE)) as f:
+            meta = json.load(f)
+
+        if meta["generation"] != self._generation:
+            base = self._path(f"corpus-{meta['generation']}.faiss")
+            self._index = faiss.read_index(base) if os.path.exists(base) else None
+            self._prepare(self._index)
+            self._generation = meta["generation"]
+            self._applied = 0
+        for name in meta["deltas"][self._applied:]:
+            delta = np.load(self._path(name))
+            self._add_to_index(delta["vectors"], delta["ids"], meta)
+        self._applied = len(meta["deltas"])
+
+        tombstones = self._path(TOMBSTONE_FILE)
+        self._tombstones = np.load(tombstones) if os.path.exists(tombstones) else np.empty(0, dtype=np.int64)
+        self._meta = meta
+        self._version = version
+
+    def _write_meta(self):
+        tmp = self._path(f"{META_FILE}.{uuid.uuid4().hex}")
+        with open(tmp, "w") as f:
+            json.dump(self._meta, f)
+        # The metadata file is replaced last, its version marks a complete write
+        os.replace(tmp, self._path(META_FILE))
+        self._version = self._disk_version()
+
+    def _write_tombstones(self):
+        tmp = self._path(f"{TOMBSTONE_FILE}.{uuid.uuid4().hex}")
+        with open(tmp, "wb") as f:
+            np.save(f, self._tombstones)
+        os.replace(tmp, self._path(TOMBSTONE_FILE))
+
+    def _checkpoint(self):
+        """
+        Write the in-memory index as a new base generation and drop the delta log
+        """
+        old_generation, old_deltas = self._meta["generation"], self._meta["deltas"]
+        generation = old_generation + 1
+        faiss.write_index(self._index, self._path(f"corpus-{generation}.faiss"))
+        self._meta["generation"] = generation
+        self._meta["deltas"] = []
+        self._generation = generation
+        self._applied = 0
+        self._write_meta()
+        for name in [f"corpus-{old_generation}.faiss", *old_deltas]:
+            try:
+                os.remove(self._path(name))
+            except OSError:
+                pass
+
+    def _prepare(self, index):
+        if index is None:
+            return
+        base = faiss.downcast_index(index.index)
+        ivf = faiss.try_extract_index_ivf(base)
+        if ivf is not None:
+            # Needed to reconstruct vectors by id for exact search and compaction
+            ivf.make_direct_map()
+            ivf.nprobe = self.nprobe
+        if isinstance(base, faiss.IndexHNSW):
+            base.hnsw.efSearch = self.ef_search
+
+    def _buildable_type(self, count):
+        """
+        The index type built for ``count`` vectors: IVF falls back to Flat until
+        there are enough vectors to train it
+        """
+        if self.index_type == INDEX_IVF and count < self.nlist * IVF_TRAINING_FACTOR:
+            return INDEX_FLAT
+        return self.index_type
+
+    def _new_index(self, dim, training_vectors, meta):
+        """
+        Build an empty index of the configured type, or Flat while IVF cannot be
+        trained yet; a compaction once the corpus is large enough upgrades it.
+        """
+        built_as = self._buildable_type(len(training_vectors))
+
+        if built_as == INDEX_IVF:
+            quantizer = faiss.IndexFlatL2(dim)
+            base = faiss.IndexIVFFlat(quantizer, dim, self.nlist)
+            base.train(training_vectors)
+        elif built_as == INDEX_HNSW:
+            base = faiss.IndexHNSWFlat(dim, self.hnsw_m)
+        else:
+            base = faiss.IndexFlatL2(dim)
+        index = faiss.IndexIDMap2(base)
+        self._prepare(index)
+        meta["built_as"] = built_as
+        return index
+
+    def _add_to_index(self, vectors, ids, meta):
+        if self._index is None:
+            self._index = self._new_index(vectors.shape[1], vectors, meta)
+        self._index.add_with_ids(vectors, ids)
+
+    def __len__(self):
+        with self._lock:
+            self._refresh()
+            if self._index is None:
+                return 0
+            return self._index.ntotal - len(self._tombstones)
+
+    def add(self, vectors):
+        """
+        Add vectors and return the ids assigned to them
+        """
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        if not len(vectors):
+            return []
+        with self._write_lock():
+            start = self._meta["next_id"]
+            ids = np.arange(start, start + len(vectors), dtype=np.int64)
+            self._meta["dim"] = int(vectors.shape[1])
+            self._add_to_index(vectors, ids, self._meta)
+
+            name = f"delta-{uuid.uuid4().hex}.npz"
+            with open(self._path(name), "wb") as f:
+                np.savez(f, ids=ids, vectors=vectors)
+            self._meta["deltas"].append(name)
+            self._meta["next_id"] = int(start + len(vectors))
+            self._applied = len(self._meta["deltas"])
+            if len(self._meta["deltas"]) >= MAX_DELTAS:
+                self._checkpoint()
+            else:
+                self._write_meta()
+        return ids.tolist()
+
+    def delete(self, ids):
+        """
+        Tombstone ``ids``; they disappear from searches right away and from the
+        index itself at the next compaction
+        """
+        ids = np.asarray(list(ids), dtype=np.int64)
+        if not len(ids):
+            return
+        with self._write_lock():
+            self._tombstones = np.union1d(self._tombstones, ids)
+            self._write_tombstones()
+            self._write_meta()
+
+    def needs_compaction(self):
+        with self._lock:
+            self._refresh()
+            if self._index is None or not self._index.ntotal:
+                return False
+            # Only worth rebuilding as another type if the live vectors are enough to build it
+            live = self._index.ntotal - len(self._tombstones)
+            upgradeable = self._meta.get("built_as") != self._buildable_type(live)
+            return upgradeable or len(self._tombstones) > self.compact_ratio * self._index.ntotal
+
+    def compact(self):
+        """
+        Rebuild the index without tombstoned vectors (and as the configured type)
+        """
+        with self._write_lock():
+            if self._index is None:
+                return
+            ids = faiss.vector_to_array(self._index.id_map).astype(np.int64)
+            live = ids[~np.isin(ids, self._tombstones)]
+            vectors = self._index.reconstruct_batch(live) if len(live) else \
+                np.empty((0, self._meta["dim"]), dtype=np.float32)
+            self._index = self._new_index(self._meta["dim"], vectors, self._meta)
+            if len(live):
+                self._index.add_with_ids(vectors, live)
+            self._tombstones = np.empty(0, dtype=np.int64)
+            self._write_tombstones()
+            self._checkpoint()
+
+    def search(self, query_vector, k=4, allowed_ids=None):
+        """
+        Return up to ``k`` (id, distance) pairs, nearest first. ``allowed_ids``
+        restricts the search, e.g. to the chunks of one document or session.
+        """
+        query = np.asarray(query_vector, dtype=np.float32).reshape(1, -1)
+        # Searches share the lock with in-process adds, FAISS indexes are not
+        # safe to read while they are being written
+        with self._lock:
+            self._refresh()
+            index, tombstones = self._index, self._tombstones
+            if index is None or not index.ntotal:
+                return []
+
+            if allowed_ids is not None:
+                allowed = np.setdiff1d(np.asarray(list(allowed_ids), dtype=np.int64), tombstones)
+                if not len(allowed):
+                    return []
+                if len(allowed) <= EXACT_SEARCH_LIMIT:
+                    return self._exact_search(index, query, allowed, k)
+                selector = faiss.IDSelectorBatch(allowed)
+            elif len(tombstones):
+                selector = faiss.IDSelectorNot(faiss.IDSelectorBatch(tombstones))
+            else:
+                selector = None
+
+            params = None
+            if selector is not None:
+                built_as = self._meta.get("built_as")
+                if built_as == INDEX_IVF:
+                    params = faiss.SearchParametersIVF(sel=selector, nprobe=self.nprobe)
+                elif built_as == INDEX_HNSW:
+                    params = faiss.SearchParametersHNSW(sel=selector, efSearch=self.ef_search)
+                else:
+                    params = faiss.SearchParameters(sel=selector)
+            distances, ids = index.search(query, k, params=params)
+        return [(int(i), float(d)) for i, d in zip(ids[0], distances[0]) if i >= 0]
+
+    def reconstruct(self, ids):
+        """
+        Return the stored vectors for ``ids``, in order
+        """
+        with self._lock:
+            self._refresh()
+            return self._index.reconstruct_batch(np.asarray(list(ids), dtype=np.int64))
+
+    @staticmethod
+    def _exact_search(index, query, ids, k):
+        vectors = index.reconstruct_batch(ids)
+        distances = ((vectors - query) ** 2).sum(axis=1)
+        order = np.argsort(distances)[:k]
+        return [(int(ids[i]), float(distances[i])) for i in order]
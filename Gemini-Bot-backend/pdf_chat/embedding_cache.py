@@ -0,0 +1,187 @@
+import hashlib
+import sqlite3
+import threading
+import time
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS embeddings (
+    model TEXT NOT NULL,
+    text_hash BLOB NOT NULL,
+    vector BLOB NOT NULL,
+    nbytes INTEGER NOT NULL,
+    last_used REAL NOT NULL,
+    PRIMARY KEY (model, text_hash)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used);
+CREATE TABLE IF NOT EXISTS stats (id INTEGER PRIMARY KEY CHECK (id = 0), total_bytes INTEGER NOT NULL);
+INSERT OR IGNORE INTO stats (id, total_bytes) VALUES (0, 0);
+CREATE TRIGGER IF NOT EXISTS embeddings_insert AFTER INSERT ON embeddings
+BEGIN
+    UPDATE stats SET total_bytes = total_bytes + new.nbytes WHERE id = 0;
+END;
+CREATE TRIGGER IF NOT EXISTS embeddings_delete AFTER DELETE ON embeddings
+BEGIN
+    UPDATE stats SET total_bytes = total_bytes - old.nbytes WHERE id = 0;
+END;
+"""
+
+# Rows deleted per eviction round, and the fraction of the budget eviction shrinks the cache to
+_EVICT_BATCH = 512
+_EVICT_TARGET = 0.9
+# Appended to the model name for cached query embeddings
+QUERY_SUFFIX = ":query"
+
+
+def _text_hash(text):
+    return hashlib.sha256(text.encode("utf-8")).digest()
+
+
+class EmbeddingCache:
+    """
+    Content-addressed store of embedding vectors, keyed by (model name, SHA-256 of the text).
+
+    Vectors are stored as raw float32 blobs in a SQLite database in WAL mode so it
+    can be shared by every worker process on the host. Once the stored vectors
+    exceed ``max_bytes`` the least recently used entries are evicted.
+    """
+
+    def __init__(self, path, max_bytes):
+        self.path = str(path)
+        self.max_bytes = max_bytes
+        self._local = threading.local()
+        conn = self._connection()
+        conn.executescript(_SCHEMA)
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get_many(self, model, texts):
+        """
+        Return a list aligned with ``texts`` holding cached vectors or None for misses
+        """
+        conn = self._connection()
+        hashes = [_text_hash(text) for text in texts]
+        found = {}
+        unique = list(dict.fromkeys(hashes))
+        # Stay below SQLite's bound-parameter limit
+        for start in range(0, len(unique), 500):
+            batch = unique[start:start + 500]
+            placeholders = ",".join("?" * len(batch))
+            rows = conn.execute(
+                f"SELECT text_hash, vector FROM embeddings WHERE model = ? AND text_hash IN ({placeholders})",
+                [model, *batch],
+            ).fetchall()
+            for text_hash, vector in rows:
+                found[text_hash] = np.frombuffer(vector, dtype=np.float32).tolist()
+
+        if found:
+            now = time.time()
+            conn.executemany(
+                "UPDATE embeddings SET last_used = ? WHERE model = ? AND text_hash = ?",
+                [(now, model, text_hash) for text_hash in found],
+            )
+        return [found.get(text_hash) for text_hash in hashes]
+
+    def put_many(self, model, texts, vectors):
+        conn = self._connection()
+        now = time.time()
+        rows = []
+        for text, vector in zip(texts, vectors):
+            blob = np.asarray(vector, dtype=np.float32).tobytes()
+            rows.append((model, _text_hash(text), blob, len(blob), now))
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.executemany(
+                "INSERT OR IGNORE INTO embeddings (model, text_hash, vector, nbytes, last_used) VALUES (?, ?, ?, ?, ?)",
+                rows,
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        self.evict()
+
+    def size_bytes(self):
+        row = self._connection().execute("SELECT total_bytes FROM stats WHERE id = 0").fetchone()
+        return row[0] if row else 0
+
+    def evict(self):
+        """
+        Drop least recently used vectors until the cache is back under budget
+        """
+        if self.size_bytes() <= self.max_bytes:
+            return
+        conn = self._connection()
+        target = int(self.max_bytes * _EVICT_TARGET)
+        while self.size_bytes() > target:
+            deleted = conn.execute(
+                "DELETE FROM embeddings WHERE (model, text_hash) IN "
+                "(SELECT model, text_hash FROM embeddings ORDER BY last_used LIMIT ?)",
+                (_EVICT_BATCH,),
+            ).rowcount
+            if not deleted:
+                break
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Embeddings wrapper that only sends cache misses to the underlying model.
+    Repeated questions reuse their query embedding too.
+    """
+
+    def __init__(self, embeddings, cache, model_name):
+        self.embeddings = embeddings
+        self.cache = cache
+        self.model_name = model_name
+
+    def embed_documents(self, texts):
+        vectors = self.cache.get_many(self.model_name, texts)
+        missing = {}
+        for i, vector in enumerate(vectors):
+            if vector is None:
+                missing.setdefault(texts[i], []).append(i)
+
+        if missing:
+            miss_texts = list(missing)
+            miss_vectors = self.embeddings.embed_documents(miss_texts)
+            self.cache.put_many(self.model_name, miss_texts, miss_vectors)
+            for text, vector in zip(miss_texts, miss_vectors):
+                for i in missing[text]:
+                    vectors[i] = list(vector)
+        return vectors
+
+    def embed_query(self, text):
+        # Query embeddings use a different task type, keep them apart from document vectors
+        model = f"{self.model_name}{QUERY_SUFFIX}"
+        vector = self.cache.get_many(model, [text])[0]
+        if vector is None:
+            vector = list(self.embeddings.embed_query(text))
+            self.cache.put_many(model, [text], [vector])
+        return vector
+
+    def embed_queries(self, texts):
+        """
+        Query embeddings for many questions, the uncached ones in a single request
+        """
+        model = f"{self.model_name}{QUERY_SUFFIX}"
+        vectors = self.cache.get_many(model, texts)
+        miss_texts = list(dict.fromkeys(text for text, vector in zip(texts, vectors) if vector is None))
+        if miss_texts:
+            if hasattr(self.embeddings, "embed_queries"):
+                miss_vectors = self.embeddings.embed_queries(miss_texts)
+            else:
+                miss_vectors = [self.embeddings.embed_query(text) for text in miss_texts]
+            miss_vectors = [list(vector) for vector in miss_vectors]
+            self.cache.put_many(model, miss_texts, miss_vectors)
+            computed = dict(zip(miss_texts, miss_vectors))
+            vectors = [computed[text] if vector is None else vector for text, vector in zip(texts, vectors)]
+        return vectors
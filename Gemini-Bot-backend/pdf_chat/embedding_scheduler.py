@@ -0,0 +1,245 @@
+import json
+import queue
+import random
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from langchain_core.embeddings import Embeddings
+
+from APIs.metrics import count_retry, count_tokens, upstream_call
+from APIs.tokens import estimate_tokens
+
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+
+
+class UpstreamError(Exception):
+    def __init__(self, message, status=None):
+        super().__init__(message)
+        self.status = status
+
+
+def is_retryable(exc):
+    status = getattr(exc, "status", None) or getattr(exc, "code", None) or getattr(exc, "status_code", None)
+    if isinstance(status, int):
+        return status in RETRYABLE_STATUS
+    name = type(exc).__name__
+    return name in ("ResourceExhausted", "ServiceUnavailable", "TooManyRequests", "DeadlineExceeded") or "429" in str(exc)
+
+
+class LangchainUpstream:
+    """
+    Upstream that sends each batch through a langchain Embeddings object
+    """
+
+    def __init__(self, embeddings):
+        self.embeddings = embeddings
+        self.model = getattr(embeddings, "model", "")
+
+    def __call__(self, texts):
+        return self.embeddings.embed_documents(texts)
+
+
+class HTTPUpstream:
+    """
+    Upstream that speaks the Gemini REST ``batchEmbedContents`` protocol.
+    Point ``base_url`` at a local fake server to test without the real API.
+    """
+
+    def __init__(self, base_url, model, api_key=None, timeout=60):
+        self.url = f"{base_url.rstrip('/')}/v1beta/{model}:batchEmbedContents"
+        self.model = model
+        self.api_key = api_key
+        self.timeout = timeout
+
+    def __call__(self, texts):
+        body = json.dumps({
+            "requests": [
+                {"model": self.model, "content": {"parts": [{"text": text}]}, "taskType": "RETRIEVAL_DOCUMENT"}
+                for text in texts
+            ]
+        }).encode("utf-8")
+        request = urllib.request.Request(self.url, data=body, method="POST", headers={"Content-Type": "application/json"})
+        if self.api_key:
+            request.add_header("x-goog-api-key", self.api_key)
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                payload = json.loads(response.read())
+        except urllib.error.HTTPError as e:
+            raise UpstreamError(f"Embedding request failed with HTTP {e.code}", status=e.code) from e
+        return [item["values"] for item in payload["embeddings"]]
+
+
+class RateLimiter:
+    """
+    Token buckets for requests per minute and tokens per minute (0 disables a limit)
+    """
+
+    def __init__(self, requests_per_minute=0, tokens_per_minute=0):
+        self.rpm = requests_per_minute
+        self.tpm = tokens_per_minute
+        self._requests = float(requests_per_minute)
+        self._tokens = float(tokens_per_minute)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        elapsed = now - self._updated
+        self._updated = now
+        if self.rpm:
+            self._requests = min(self.rpm, self._requests + elapsed * self.rpm / 60)
+        if self.tpm:
+            self._tokens = min(self.tpm, self._tokens + elapsed * self.tpm / 60)
+
+    def acquire(self, tokens=0):
+        if self.tpm:
+            # A batch larger than the whole budget can only wait for a full bucket
+            tokens = min(tokens, self.tpm)
+        while True:
+            with self._lock:
+                self._refill()
+                wait = 0.0
+                if self.rpm and self._requests < 1:
+                    wait = max(wait, (1 - self._requests) * 60 / self.rpm)
+                if self.tpm and self._tokens < tokens:
+                    wait = max(wait, (tokens - self._tokens) * 60 / self.tpm)
+                if wait == 0.0:
+                    if self.rpm:
+                        self._requests -= 1
+                    if self.tpm:
+                        self._tokens -= tokens
+                    return
+            time.sleep(wait)
+
+
+class _Request:
+    def __init__(self, texts):
+        self.vectors = [None] * len(texts)
+        self.remaining = len(texts)
+        self.future = Future()
+        self.lock = threading.Lock()
+
+
+class EmbeddingScheduler:
+    """
+    Process-wide coalescing of embedding work.
+
+    Callers from any thread ``submit`` lists of texts; a dispatcher thread packs
+    pending texts from all callers into batches of up to ``max_batch`` texts,
+    flushing early once the oldest pending text has waited ``max_wait`` seconds.
+    Batches respect the rate limiter, are retried with exponential backoff and
+    their vectors are routed back to each caller's future.
+    """
+
+    def __init__(self, upstream, max_batch=100, max_wait=0.05, requests_per_minute=0,
+                 tokens_per_minute=0, concurrency=4, max_retries=5, backoff=1.0, max_backoff=30.0):
+        self.upstream = upstream
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.limiter = RateLimiter(requests_per_minute, tokens_per_minute)
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self._pending = queue.Queue()
+        self._slots = threading.BoundedSemaphore(concurrency)
+        self._executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="embed-batch")
+        self._dispatcher = threading.Thread(target=self._dispatch, name="embed-dispatcher", daemon=True)
+        self._dispatcher.start()
+
+    def submit(self, texts):
+        request = _Request(texts)
+        if not texts:
+            request.future.set_result([])
+            return request.future
+        now = time.monotonic()
+        for i, text in enumerate(texts):
+            self._pending.put((now, request, i, text))
+        return request.future
+
+    def embed(self, texts):
+        return self.submit(texts).result()
+
+    def _collect(self):
+        first = self._pending.get()
+        batch = [first]
+        deadline = first[0] + self.max_wait
+        while len(batch) < self.max_batch:
+            timeout = deadline - time.monotonic()
+            try:
+                item = self._pending.get(timeout=timeout) if timeout > 0 else self._pending.get_nowait()
+            except queue.Empty:
+                break
+            batch.append(item)
+        return batch
+
+    def _dispatch(self):
+        while True:
+            batch = self._collect()
+            self.limiter.acquire(sum(estimate_tokens(text) for _, _, _, text in batch))
+            self._slots.acquire()
+            self._executor.submit(self._run_batch, batch)
+
+    def _call_upstream(self, texts):
+        attempt = 0
+        model = getattr(self.upstream, "model", "")
+        while True:
+            try:
+                with upstream_call("embed", model):
+                    vectors = self.upstream(texts)
+                count_tokens("embed", sum(estimate_tokens(text) for text in texts))
+                return vectors
+            except Exception as e:
+                attempt += 1
+                if attempt > self.max_retries or not is_retryable(e):
+                    raise
+                count_retry("embed")
+                delay = min(self.max_backoff, self.backoff * 2 ** (attempt - 1))
+                time.sleep(delay * random.uniform(0.5, 1.0))
+                self.limiter.acquire(sum(estimate_tokens(text) for text in texts))
+
+    def _run_batch(self, batch):
+        try:
+            vectors = self._call_upstream([text for _, _, _, text in batch])
+            if len(vectors) != len(batch):
+                raise UpstreamError(f"Expected {len(batch)} embeddings, got {len(vectors)}")
+        except Exception as e:
+            for _, request, _, _ in batch:
+                with request.lock:
+                    if not request.future.done():
+                        request.future.set_exception(e)
+            return
+        finally:
+            self._slots.release()
+
+        for (_, request, i, _), vector in zip(batch, vectors):
+            with request.lock:
+                if request.future.done():
+                    continue
+                request.vectors[i] = vector
+                request.remaining -= 1
+                if request.remaining == 0:
+                    request.future.set_result(request.vectors)
+
+
+class ScheduledEmbeddings(Embeddings):
+    """
+    Embeddings wrapper that routes document embedding through an EmbeddingScheduler.
+    Queries are latency sensitive and go straight to ``query_embeddings``.
+    """
+
+    def __init__(self, scheduler, query_embeddings):
+        self.scheduler = scheduler
+        self.query_embeddings = query_embeddings
+
+    def embed_documents(self, texts):
+        return self.scheduler.embed(list(texts))
+
+    def embed_query(self, text):
+        return self.query_embeddings.embed_query(text)
+
+    def embed_queries(self, texts):
+        # One batched request, with the query task type
+        return self.query_embeddings.embed_documents(list(texts), task_type="RETRIEVAL_QUERY")
@@ -0,0 +1,129 @@
+import atexit
+import math
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+
+import pdfplumber
+
+# Documents with fewer pages than this are extracted in the request thread,
+# the pool round trip costs more than it saves
+MIN_PARALLEL_PAGES = 16
+# Smallest page range handed to a worker
+MIN_RANGE_PAGES = 8
+
+_executor = None
+_executor_workers = 0
+# Extractions in progress per pool, so a replaced pool is only shut down once they are done
+_executor_users = {}
+_executor_lock = threading.Lock()
+
+
+@contextmanager
+def _use_executor(workers):
+    """
+    The shared extraction pool, rebuilt with ``workers`` processes when a caller
+    asks for a different size than the current one
+    """
+    global _executor, _executor_workers
+    with _executor_lock:
+        if _executor is None or _executor_workers != workers:
+            if _executor is not None and not _executor_users.get(_executor):
+                _executor.shutdown(wait=False)
+            _executor = ProcessPoolExecutor(max_workers=workers)
+            _executor_workers = workers
+        executor = _executor
+        _executor_users[executor] = _executor_users.get(executor, 0) + 1
+    try:
+        yield executor
+    finally:
+        with _executor_lock:
+            _executor_users[executor] -= 1
+            if not _executor_users[executor]:
+                del _executor_users[executor]
+                if executor is not _executor:
+                    executor.shutdown(wait=False)
+
+
+def _shutdown_executor():
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+
+
+atexit.register(_shutdown_executor)
+
+
+def page_count(pdf_path):
+    with pdfplumber.open(pdf_path) as pd:
+        return len(pd.pages)
+
+
+def extract_page_range(pdf_path, start, stop):
+    """
+    Extract the text of pages ``start`` (inclusive) to ``stop`` (exclusive), 0-based.
+    Runs inside pool workers, so each call opens the file itself.
+    """
+    texts = []
+    # pdfplumber takes 1-based page numbers and only parses the requested pages
+    with pdfplumber.open(pdf_path, pages=range(start + 1, stop + 1)) as pd:
+        for page in pd.pages:
+            texts.append(page.extract_text() or "")
+            # Drop the parsed layout objects as soon as the text is out
+            page.close()
+    return texts
+
+
+def partition_pages(total, workers):
+    """
+    Split ``total`` pages into contiguous (start, stop) ranges, a few per worker
+    so a slow range does not leave the other workers idle
+    """
+    if total <= 0:
+        return []
+    size = max(MIN_RANGE_PAGES, math.ceil(total / (workers * 4)))
+    return [(start, min(start + size, total)) for start in range(0, total, size)]
+
+
+def iter_pages(pdf_path, workers=1, max_pages=0):
+    """
+    Yield the text of every page of ``pdf_path`` in page order.
+
+    Pages are read in contiguous ranges, each from a freshly opened file, so
+    pdfplumber's per-document caches never outlive a range. Large documents are
+    fanned out to a process pool with at most two ranges per worker in flight.
+    ``max_pages`` caps how many leading pages are read (0 = no cap).
+    """
+    total = page_count(pdf_path)
+    if max_pages:
+        total = min(total, max_pages)
+
+    if workers <= 1 or total < MIN_PARALLEL_PAGES:
+        for start in range(0, total, MIN_RANGE_PAGES):
+            yield from extract_page_range(pdf_path, start, min(start + MIN_RANGE_PAGES, total))
+        return
+
+    ranges = iter(partition_pages(total, workers))
+    with _use_executor(workers) as executor:
+        pending = deque()
+        try:
+            for start, stop in ranges:
+                pending.append(executor.submit(extract_page_range, pdf_path, start, stop))
+                if len(pending) >= workers * 2:
+                    break
+            while pending:
+                texts = pending.popleft().result()
+                next_range = next(ranges, None)
+                if next_range is not None:
+                    pending.append(executor.submit(extract_page_range, pdf_path, *next_range))
+                yield from texts
+        finally:
+            for future in pending:
+                future.cancel()
+
+
+def extract_pages(pdf_path, workers=1, max_pages=0):
+    """
+    Return the text of every page of ``pdf_path`` in page order
+    """
+    return list(iter_pages(pdf_path, workers=workers, max_pages=max_pages))
@@ -0,0 +1,96 @@
+import os
+import sys
+import threading
+from collections import OrderedDict
+
+# Rough per-document overhead of a langchain Document and its docstore entry
+_DOCUMENT_OVERHEAD = 400
+
+
+def estimate_index_bytes(vector_store):
+    """
+    Approximate the memory held by a loaded FAISS vector store: the index codes
+    plus the docstore texts and metadata. Memory-mapped codes live in the shared
+    page cache and are not counted.
+    """
+    index = vector_store.index
+    total = 0
+    if not getattr(index, "is_mmapped", False):
+        code_size = getattr(index, "code_size", None) or index.d * 4
+        total = index.ntotal * code_size
+    for document in vector_store.docstore._dict.values():
+        total += sys.getsizeof(document.page_content) + _DOCUMENT_OVERHEAD
+        if document.metadata:
+            total += sys.getsizeof(document.metadata)
+    total += len(vector_store.index_to_docstore_id) * 100
+    return total
+
+
+def index_version(path):
+    """
+    Identify one on-disk generation of an index. Saves write a fresh directory and
+    rename it into place, so a rewritten index always has a new inode/mtime.
+    """
+    try:
+        stat = os.stat(os.path.join(path, "index.faiss"))
+    except OSError:
+        return None
+    return stat.st_ino, stat.st_mtime_ns
+
+
+class IndexCache:
+    """
+    Per-process LRU cache of loaded vector stores with a memory budget.
+
+    Entries are keyed by document (file hash, or file hash and artifact name for
+    side indexes) and remember the on-disk version they were loaded from; a
+    lookup whose version no longer matches is a miss.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, version):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[2] != version:
+                if entry is not None:
+                    self._remove(key)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, version, vector_store, nbytes=None):
+        if nbytes is None:
+            nbytes = estimate_index_bytes(vector_store)
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            if nbytes > self.max_bytes:
+                return
+            self._entries[key] = (vector_store, nbytes, version)
+            self._bytes += nbytes
+            while self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+
+    def invalidate(self, key):
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+
+    def _remove(self, key):
+        _, nbytes, _ = self._entries.pop(key)
+        self._bytes -= nbytes
+
+    def size_bytes(self):
+        return self._bytes
+
+    def __len__(self):
+        return len(self._entries)
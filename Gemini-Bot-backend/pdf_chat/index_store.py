@@ -0,0 +1,227 @@
+import hashlib
+import os
+import shutil
+import threading
+import time
+import uuid
+
+from langchain_community.vectorstores import FAISS
+
+from pdf_chat.bm25 import BM25Index
+from pdf_chat.index_cache import index_version
+from pdf_chat.vector_storage import STORAGE_FLOAT32, STORAGE_TYPES, load_mapped, write_compressed
+
+INDEX_SUFFIX = "_index"
+LEXICAL_FILE = "bm25.bin"
+
+
+def save_upload(uploaded_file, path):
+    """
+    Write an uploaded file to disk and return the SHA-256 hex digest of its content
+    """
+    digest = hashlib.sha256()
+    with open(path, 'wb') as f:
+        for chunk in uploaded_file.chunks():
+            digest.update(chunk)
+            f.write(chunk)
+    return digest.hexdigest()
+
+
+def _dir_size(path):
+    total = 0
+    for dirpath, _, filenames in os.walk(path):
+        for name in filenames:
+            try:
+                total += os.path.getsize(os.path.join(dirpath, name))
+            except OSError:
+                pass
+    return total
+
+
+class IndexStore:
+    """
+    Disk-backed store of FAISS indexes keyed by PDFDocument.file_hash.
+
+    Each index lives in ``<root>/<file_hash>_index``. The directory mtime is
+    bumped on every load so garbage collection can evict the least recently
+    used indexes once the store grows past its quota. With an IndexCache, hot
+    indexes are served from memory as long as their on-disk version is unchanged.
+
+    ``storage`` selects how vectors are written (float32, float16, int8 or pq);
+    with ``mmap`` indexes are memory-mapped read-only on load instead of copied
+    into each worker's heap, and ``rescore`` re-ranks compressed search results
+    against the exact vectors kept next to the index (at the cost of storing
+    them too, so compression then saves memory but not disk).
+    """
+
+    def __init__(self, root, quota_bytes, cache=None, storage=STORAGE_FLOAT32, mmap=True, rescore=False,
+                 rescore_factor=4, pq_m=0):
+        if storage not in STORAGE_TYPES:
+            raise ValueError(f"Unknown index storage: {storage}")
+        self.root = str(root)
+        self.quota_bytes = quota_bytes
+        self.cache = cache
+        self.storage = storage
+        self.mmap = mmap
+        self.rescore = rescore
+        self.rescore_factor = rescore_factor
+        self.pq_m = pq_m
+        self._sizes = None
+        self._lock = threading.Lock()
+        os.makedirs(self.root, exist_ok=True)
+
+    def path_for(self, file_hash):
+        return os.path.join(self.root, f"{file_hash}{INDEX_SUFFIX}")
+
+    def exists(self, file_hash):
+        return os.path.isdir(self.path_for(file_hash))
+
+    def touch(self, file_hash):
+        try:
+            os.utime(self.path_for(file_hash))
+        except OSError:
+            pass
+
+    def load(self, file_hash, embeddings):
+        """
+        Return the stored vector store for ``file_hash`` or None if it is not on disk
+        """
+        path = self.path_for(file_hash)
+        version = index_version(path)
+        if version is None:
+            self._invalidate(file_hash)
+            return None
+
+        if self.cache is not None:
+            vector_store = self.cache.get(file_hash, version)
+            if vector_store is not None:
+                self.touch(file_hash)
+                return vector_store
+
+        try:
+            if self.mmap:
+                vector_store = load_mapped(path, embeddings, rescore=self.rescore,
+                                           rescore_factor=self.rescore_factor)
+            else:
+                vector_store = FAISS.load_local(path, embeddings, allow_dangerous_deserialization=True)
+        except Exception as e:
+            if os.path.isdir(path):
+                # Still there but unreadable (a truncated FAISS file or docstore pickle):
+                # drop it, so the caller builds it again instead of failing every time
+                print(f"Discarding unreadable index {file_hash}: {e}")
+                self.delete(file_hash)
+            # Otherwise it was evicted or is half-deleted by another worker
+            return None
+        self.touch(file_hash)
+        if self.cache is not None:
+            self.cache.put(file_hash, version, vector_store)
+        return vector_store
+
+    def load_lexical(self, file_hash):
+        """
+        Return the BM25 index stored next to the vector index, or None
+        """
+        path = self.path_for(file_hash)
+        version = index_version(path)
+        if version is None:
+            return None
+        key = (file_hash, LEXICAL_FILE)
+        if self.cache is not None:
+            lexical_index = self.cache.get(key, version)
+            if lexical_index is not None:
+                return lexical_index
+        try:
+            with open(os.path.join(path, LEXICAL_FILE), 'rb') as f:
+                lexical_index = BM25Index.loads(f.read())
+        except (OSError, ValueError):
+            return None
+        if self.cache is not None:
+            self.cache.put(key, version, lexical_index, nbytes=lexical_index.nbytes())
+        return lexical_index
+
+    def _invalidate(self, file_hash):
+        if self.cache is not None:
+            self.cache.invalidate(file_hash)
+            self.cache.invalidate((file_hash, LEXICAL_FILE))
+
+    def save(self, file_hash, vector_store, lexical_index=None):
+        """
+        Persist ``vector_store`` (and optionally its BM25 index) under ``file_hash``.
+
+        The index is written to a temporary directory and renamed into place so
+        concurrent readers never see a partially written index.
+        """
+        path = self.path_for(file_hash)
+        tmp_path = os.path.join(self.root, f".tmp-{uuid.uuid4().hex}")
+        vector_store.save_local(tmp_path)
+        write_compressed(tmp_path, vector_store, self.storage, pq_m=self.pq_m, keep_exact=self.rescore)
+        if lexical_index is not None:
+            with open(os.path.join(tmp_path, LEXICAL_FILE), 'wb') as f:
+                f.write(lexical_index.dumps())
+        try:
+            os.rename(tmp_path, path)
+        except OSError:
+            # Another worker finished the same document first
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            self.touch(file_hash)
+            return path
+
+        self._invalidate(file_hash)
+        with self._lock:
+            if self._sizes is not None:
+                self._sizes[file_hash] = _dir_size(path)
+        self.collect_garbage(keep=(file_hash,))
+        return path
+
+    def delete(self, file_hash):
+        shutil.rmtree(self.path_for(file_hash), ignore_errors=True)
+        self._invalidate(file_hash)
+        with self._lock:
+            if self._sizes is not None:
+                self._sizes.pop(file_hash, None)
+
+    def _scan(self):
+        sizes = {}
+        for name in os.listdir(self.root):
+            if not name.endswith(INDEX_SUFFIX):
+                continue
+            path = os.path.join(self.root, name)
+            if os.path.isdir(path):
+                sizes[name[:-len(INDEX_SUFFIX)]] = _dir_size(path)
+        return sizes
+
+    def size_bytes(self):
+        with self._lock:
+            if self._sizes is None:
+                self._sizes = self._scan()
+            return sum(self._sizes.values())
+
+    def collect_garbage(self, keep=()):
+        """
+        Delete least recently used indexes until the store fits in its quota.
+        Returns the list of evicted file hashes.
+        """
+        evicted = []
+        with self._lock:
+            # Rescan so indexes written by other worker processes are accounted for
+            self._sizes = self._scan()
+            total = sum(self._sizes.values())
+            if total <= self.quota_bytes:
+                return evicted
+
+            def last_used(file_hash):
+                try:
+                    return os.path.getmtime(self.path_for(file_hash))
+                except OSError:
+                    return time.time()
+
+            for file_hash in sorted(self._sizes, key=last_used):
+                if total <= self.quota_bytes:
+                    break
+                if file_hash in keep:
+                    continue
+                shutil.rmtree(self.path_for(file_hash), ignore_errors=True)
+                self._invalidate(file_hash)
+                total -= self._sizes.pop(file_hash)
+                evicted.append(file_hash)
+        return evicted
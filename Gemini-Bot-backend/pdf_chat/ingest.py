@@ -0,0 +1,136 @@
+import time
+from bisect import bisect_left, bisect_right
+from itertools import islice
+
+from langchain_community.vectorstores import FAISS
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+from pdf_chat.extraction import iter_pages
+
+CHUNK_SIZE = 10000
+CHUNK_OVERLAP = 1000
+# The splitter runs once the buffer holds this many characters
+SPLIT_THRESHOLD = CHUNK_SIZE * 4
+EMBEDDING_BATCH_SIZE = 64
+
+
+class PDFTextError(Exception):
+    pass
+
+
+def iter_chunks(page_texts, text_splitter, split_threshold=SPLIT_THRESHOLD):
+    """
+    Incrementally split a stream of page texts into (chunk text, page numbers) pairs.
+
+    Only a bounded buffer of text is held at a time. Every chunk but the last one
+    of each split is final; the rest of the buffer from the last chunk on is
+    carried over and re-split together with the following pages, so chunk
+    boundaries and overlap follow a split of the whole document. Page numbers are
+    1-based and list every page the chunk's text spans.
+    """
+    buffer = ""
+    buffer_offset = 0  # Document offset of buffer[0]
+    page_starts = []  # Document offset where each page's text begins
+    document_length = 0
+
+    def located(chunks):
+        cursor = 0
+        for chunk in chunks:
+            pos = buffer.find(chunk, cursor)
+            if pos < 0:
+                pos = cursor
+            cursor = pos + 1
+            start = buffer_offset + pos
+            first = bisect_right(page_starts, start) - 1
+            last = max(first, bisect_left(page_starts, start + len(chunk)) - 1)
+            yield pos, chunk, list(range(first + 1, last + 2))
+
+    for text in page_texts:
+        page_starts.append(document_length)
+        document_length += len(text)
+        buffer += text
+        if len(buffer) < split_threshold:
+            continue
+        chunks = list(located(text_splitter.split_text(buffer)))
+        if len(chunks) < 2:
+            continue
+        for _, chunk, pages in chunks[:-1]:
+            yield chunk, pages
+        carry = chunks[-1][0]
+        buffer = buffer[carry:]
+        buffer_offset += carry
+
+    if buffer:
+        for _, chunk, pages in located(text_splitter.split_text(buffer)):
+            yield chunk, pages
+
+
+def iter_batches(items, size):
+    items = iter(items)
+    while True:
+        batch = list(islice(items, size))
+        if not batch:
+            return
+        yield batch
+
+
+def build_vector_store(pdf_path, embeddings, workers=1, max_pages=0, batch_size=EMBEDDING_BATCH_SIZE, stats=None):
+    """
+    Stream a PDF through pages -> chunks -> embedding batches -> FAISS index.
+
+    Pages, chunks and vectors are released as soon as the next stage has consumed
+    them, so peak memory depends on the batch size rather than on the page count.
+    When ``stats`` is a dict it is filled with page, character and chunk counts,
+    and with the seconds spent in each stage under ``seconds``.
+    """
+    if stats is None:
+        stats = {}
+    stats.update(pages=0, characters=0, chunks=0)
+    seconds = stats["seconds"] = {"extract": 0.0, "split": 0.0, "embed": 0.0, "index": 0.0}
+    text_splitter = RecursiveCharacterTextSplitter(chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP)
+    pages = iter_pages(pdf_path, workers=workers, max_pages=max_pages)
+
+    vector_store = None
+
+    def track(page_texts):
+        page_texts = iter(page_texts)
+        while True:
+            started = time.perf_counter()
+            text = next(page_texts, None)
+            seconds["extract"] += time.perf_counter() - started
+            if text is None:
+                return
+            stats["pages"] += 1
+            stats["characters"] += len(text)
+            yield text
+
+    batches = iter_batches(iter_chunks(track(pages), text_splitter), batch_size)
+    while True:
+        # Pulling a batch runs extraction and splitting, extraction is subtracted below
+        started = time.perf_counter()
+        batch = next(batches, None)
+        seconds["split"] += time.perf_counter() - started
+        if batch is None:
+            break
+        texts = [text for text, _ in batch]
+        metadatas = [
+            {"chunk_index": stats["chunks"] + i, "pages": pages}
+            for i, (_, pages) in enumerate(batch)
+        ]
+        started = time.perf_counter()
+        vectors = embeddings.embed_documents(texts)
+        seconds["embed"] += time.perf_counter() - started
+        stats["chunks"] += len(batch)
+        started = time.perf_counter()
+        if vector_store is None:
+            vector_store = FAISS.from_embeddings(list(zip(texts, vectors)), embedding=embeddings, metadatas=metadatas)
+        else:
+            vector_store.add_embeddings(list(zip(texts, vectors)), metadatas=metadatas)
+        seconds["index"] += time.perf_counter() - started
+    seconds["split"] = max(0.0, seconds["split"] - seconds["extract"])
+
+    if not stats["characters"]:
+        raise PDFTextError("Could not extract text from the PDF.")
+    if vector_store is None:
+        raise PDFTextError("PDF text is empty after splitting.")
+    return vector_store
@@ -0,0 +1,224 @@
+import threading
+import time
+import traceback
+from datetime import timedelta
+
+from django.db import close_old_connections, connection
+from django.db.models import F, Q
+from django.utils import timezone
+
+from pdf_chat.models import PDFDocument
+
+
+def enqueue(document):
+    """
+    Put ``document`` (back) on the ingestion queue
+    """
+    PDFDocument.objects.filter(pk=document.pk).update(
+        status=PDFDocument.STATUS_QUEUED,
+        error_message=None,
+        started_at=None,
+        heartbeat_at=None,
+        finished_at=None,
+    )
+    document.status = PDFDocument.STATUS_QUEUED
+
+
+def claim_next():
+    """
+    Atomically move the oldest queued document to processing and return it,
+    or None when the queue is empty. Safe to call from several processes.
+    """
+    candidates = (
+        PDFDocument.objects
+        .filter(status=PDFDocument.STATUS_QUEUED)
+        .order_by('created_at')
+        .values_list('pk', flat=True)[:5]
+    )
+    for pk in candidates:
+        now = timezone.now()
+        claimed = PDFDocument.objects.filter(pk=pk, status=PDFDocument.STATUS_QUEUED).update(
+            status=PDFDocument.STATUS_PROCESSING,
+            started_at=now,
+            heartbeat_at=now,
+            attempts=F('attempts') + 1,
+        )
+        if claimed:
+            return PDFDocument.objects.get(pk=pk)
+    return None
+
+
+def requeue_stale(timeout_seconds, max_attempts):
+    """
+    Recover jobs whose worker died mid-run (no heartbeat for ``timeout_seconds``):
+    requeue them, or fail them once they have used up their attempts
+    """
+    cutoff = timezone.now() - timedelta(seconds=timeout_seconds)
+    stale = PDFDocument.objects.filter(
+        Q(heartbeat_at__lt=cutoff) | Q(heartbeat_at=None, started_at__lt=cutoff),
+        status=PDFDocument.STATUS_PROCESSING,
+    )
+    stale.filter(attempts__gte=max_attempts).update(
+        status=PDFDocument.STATUS_FAILED,
+        error_message="Ingestion timed out.",
+        finished_at=timezone.now(),
+    )
+    stale.filter(attempts__lt=max_attempts).update(status=PDFDocument.STATUS_QUEUED, started_at=None,
+                                                   heartbeat_at=None)
+
+
+def current_attempt(document):
+    """
+    The document's row while it is still being processed by the attempt that claimed ``document``
+    """
+    return PDFDocument.objects.filter(pk=document.pk, status=PDFDocument.STATUS_PROCESSING,
+                                      attempts=document.attempts)
+
+
+class Heartbeat(threading.Thread):
+    """
+    Refresh ``heartbeat_at`` of a claimed document every ``interval`` seconds
+    while its job runs, so ``requeue_stale`` leaves long ingestions alone
+    """
+
+    def __init__(self, document, interval):
+        super().__init__(name=f"pdf-heartbeat-{document.pk}", daemon=True)
+        self.document = document
+        self.interval = interval
+        self._done = threading.Event()
+
+    def run(self):
+        try:
+            while not self._done.wait(self.interval):
+                if not current_attempt(self.document).update(heartbeat_at=timezone.now()):
+                    return
+        except Exception as e:
+            print(f"Error recording heartbeat for PDF {self.document.pk}: {e}")
+        finally:
+            connection.close()
+
+    def stop(self):
+        self._done.set()
+        self.join()
+
+
+class IngestionWorkerPool:
+    """
+    Background threads that drain the PDFDocument ingestion queue.
+
+    ``handler(document)`` does the actual work and returns the fields to store on
+    the document once it is ready. Workers sleep until ``notify`` is called or
+    the poll interval passes, so jobs queued by other processes are picked up too.
+    A running job beats every ``job_timeout / 4`` seconds; one silent for
+    ``job_timeout`` is taken to have lost its worker and is requeued.
+    ``maintenance()``, if given, runs on one worker after jobs were processed
+    and otherwise at most every ``maintenance_interval`` seconds.
+    """
+
+    def __init__(self, handler, workers=2, poll_interval=2.0, job_timeout=900, max_attempts=3, maintenance=None,
+                 maintenance_interval=60.0):
+        self.handler = handler
+        self.maintenance = maintenance
+        self.maintenance_interval = maintenance_interval
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.job_timeout = job_timeout
+        self.max_attempts = max_attempts
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._start_lock = threading.Lock()
+        self._maintenance_lock = threading.Lock()
+        self._maintained_at = time.monotonic()
+        self._threads = []
+
+    def start(self):
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._run, name=f"pdf-ingest-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def ensure_started(self):
+        with self._start_lock:
+            if not self._threads:
+                self.start()
+
+    def stop(self):
+        self._stopping.set()
+        self._wakeup.set()
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def notify(self):
+        self._wakeup.set()
+
+    def run_pending(self):
+        """
+        Process queued documents until the queue is empty. Returns the number processed.
+        """
+        processed = 0
+        while not self._stopping.is_set():
+            close_old_connections()
+            document = claim_next()
+            if document is None:
+                break
+            self.process(document)
+            processed += 1
+        return processed
+
+    def process(self, document):
+        heartbeat = Heartbeat(document, self.job_timeout / 4)
+        heartbeat.start()
+        try:
+            fields = self.handler(document) or {}
+        except Exception as e:
+            print(f"Error ingesting PDF {document.pk}: {e}")
+            traceback.print_exc()
+            updated = current_attempt(document).update(
+                status=PDFDocument.STATUS_FAILED,
+                error_message=str(e),
+                finished_at=timezone.now(),
+            )
+        else:
+            updated = current_attempt(document).update(
+                status=PDFDocument.STATUS_READY,
+                error_message=None,
+                finished_at=timezone.now(),
+                **fields,
+            )
+        finally:
+            heartbeat.stop()
+        if not updated:
+            # Requeued or deleted meanwhile; whoever holds it now decides its state
+            print(f"PDF {document.pk} attempt {document.attempts} was superseded, result dropped")
+
+    def maintain(self, force=False):
+        """
+        Run ``maintenance()`` if it is due (or ``force``) and no other worker thread is running it
+        """
+        if self.maintenance is None:
+            return
+        if not force and time.monotonic() - self._maintained_at < self.maintenance_interval:
+            return
+        if not self._maintenance_lock.acquire(blocking=False):
+            return
+        try:
+            self.maintenance()
+        finally:
+            self._maintained_at = time.monotonic()
+            self._maintenance_lock.release()
+
+    def _run(self):
+        while not self._stopping.is_set():
+            try:
+                close_old_connections()
+                requeue_stale(self.job_timeout, self.max_attempts)
+                processed = self.run_pending()
+                self.maintain(force=processed > 0)
+            except Exception as e:
+                print(f"Error in PDF ingestion worker: {e}")
+                traceback.print_exc()
+            finally:
+                close_old_connections()
+            self._wakeup.wait(self.poll_interval)
+            self._wakeup.clear()
@@ -0,0 +1,27 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from pdf_chat.views import get_worker_pool
+
+
+class Command(BaseCommand):
+    help = "Run PDF ingestion workers in the foreground (use with PDF_INGEST_IN_PROCESS=False)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--once", action="store_true", help="Drain the queue once and exit")
+
+    def handle(self, *args, **options):
+        pool = get_worker_pool()
+        if options["once"]:
+            processed = pool.run_pending()
+            self.stdout.write(f"Processed {processed} document(s)")
+            return
+
+        pool.start()
+        self.stdout.write(f"Started {pool.workers} PDF ingestion worker(s)")
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            pool.stop()
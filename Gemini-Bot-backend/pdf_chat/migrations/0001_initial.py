@@ -0,0 +1,75 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:17
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PDFDocument',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('session_id', models.CharField(db_index=True, max_length=255)),
+                ('file_name', models.CharField(max_length=500)),
+                ('file_size', models.IntegerField()),
+                ('file_hash', models.CharField(max_length=64, unique=True)),
+                ('page_count', models.IntegerField(default=0)),
+                ('text_content_length', models.IntegerField(default=0)),
+                ('embedding_index_path', models.CharField(max_length=500)),
+                ('status', models.CharField(choices=[('queued', 'Queued'), ('processing', 'Processing'), ('ready', 'Ready'), ('failed', 'Failed')], db_index=True, default='queued', max_length=20)),
+                ('source_path', models.CharField(blank=True, max_length=500, null=True)),
+                ('attempts', models.IntegerField(default=0)),
+                ('error_message', models.TextField(blank=True, null=True)),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True, db_index=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('original_filename', models.CharField(blank=True, max_length=500, null=True)),
+                ('mime_type', models.CharField(default='application/pdf', max_length=50)),
+                ('upload_ip', models.GenericIPAddressField(blank=True, null=True)),
+            ],
+            options={
+                'ordering': ['-created_at'],
+                'indexes': [models.Index(fields=['-created_at'], name='pdf_chat_pd_created_e022ac_idx'), models.Index(fields=['session_id'], name='pdf_chat_pd_session_74c845_idx'), models.Index(fields=['status', 'created_at'], name='pdf_chat_pd_status_c70a4d_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='PDFQuery',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('query_text', models.TextField()),
+                ('response_text', models.TextField()),
+                ('response_time_ms', models.IntegerField(blank=True, null=True)),
+                ('relevant_chunks_count', models.IntegerField()),
+                ('created_at', models.DateTimeField(auto_now_add=True, db_index=True)),
+                ('pdf_document', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='queries', to='pdf_chat.pdfdocument')),
+            ],
+            options={
+                'ordering': ['-created_at'],
+            },
+        ),
+        migrations.CreateModel(
+            name='PDFChunk',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('chunk_index', models.IntegerField()),
+                ('text_content', models.TextField()),
+                ('chunk_size', models.IntegerField()),
+                ('page_numbers', models.CharField(help_text='Comma-separated page numbers', max_length=255)),
+                ('embedding_vector_id', models.CharField(blank=True, max_length=255, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('pdf_document', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='chunks', to='pdf_chat.pdfdocument')),
+            ],
+            options={
+                'ordering': ['pdf_document', 'chunk_index'],
+                'indexes': [models.Index(fields=['pdf_document', 'chunk_index'], name='pdf_chat_pd_pdf_doc_8e08dc_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:22
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pdf_chat', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PDFUpload',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('session_id', models.CharField(db_index=True, max_length=255)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('pdf_document', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='uploads', to='pdf_chat.pdfdocument')),
+            ],
+            options={
+                'ordering': ['-created_at'],
+                'constraints': [models.UniqueConstraint(fields=('pdf_document', 'session_id'), name='unique_pdf_upload_per_session')],
+            },
+        ),
+    ]
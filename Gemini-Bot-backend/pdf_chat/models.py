@@ -4,15 +4,35 @@ from django.utils import timezone
 
 class PDFDocument(models.Model):
     """
-    Model to store PDF document metadata
+    Model to store PDF document metadata and the state of its ingestion job
     """
-    session_id = models.CharField(max_length=255, unique=True, db_index=True)
+    STATUS_QUEUED = "queued"
+    STATUS_PROCESSING = "processing"
+    STATUS_READY = "ready"
+    STATUS_FAILED = "failed"
+    STATUS_CHOICES = [
+        (STATUS_QUEUED, "Queued"),
+        (STATUS_PROCESSING, "Processing"),
+        (STATUS_READY, "Ready"),
+        (STATUS_FAILED, "Failed"),
+    ]
+
+    session_id = models.CharField(max_length=255, db_index=True)  # Session that first uploaded the file
     file_name = models.CharField(max_length=500)
     file_size = models.IntegerField()  # in bytes
     file_hash = models.CharField(max_length=64, unique=True)  # SHA256 hash
     page_count = models.IntegerField(default=0)
     text_content_length = models.IntegerField(default=0)
     embedding_index_path = models.CharField(max_length=500)  # Path to FAISS index
+
+    # Ingestion job
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=STATUS_QUEUED, db_index=True)
+    source_path = models.CharField(max_length=500, null=True, blank=True)  # Uploaded PDF awaiting ingestion
+    attempts = models.IntegerField(default=0)
+    error_message = models.TextField(null=True, blank=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    heartbeat_at = models.DateTimeField(null=True, blank=True)  # Refreshed while a worker runs the job
+    finished_at = models.DateTimeField(null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True, db_index=True)
     updated_at = models.DateTimeField(auto_now=True)
     
@@ -26,6 +46,7 @@ class PDFDocument(models.Model):
         indexes = [
             models.Index(fields=['-created_at']),
             models.Index(fields=['session_id']),
+            models.Index(fields=['status', 'created_at']),
         ]
     
     def __str__(self):
@@ -70,3 +91,21 @@ class PDFQuery(models.Model):
     
     def __str__(self):
         return f"Query on {self.pdf_document.file_name}"
+
+
+class PDFUpload(models.Model):
+    """
+    Model to record which sessions uploaded a document, so a session can search its whole library
+    """
+    pdf_document = models.ForeignKey(PDFDocument, on_delete=models.CASCADE, related_name='uploads')
+    session_id = models.CharField(max_length=255, db_index=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        ordering = ['-created_at']
+        constraints = [
+            models.UniqueConstraint(fields=['pdf_document', 'session_id'], name='unique_pdf_upload_per_session'),
+        ]
+    
+    def __str__(self):
+        return f"{self.pdf_document.file_name} ({self.session_id})"
@@ -0,0 +1,97 @@
+import numpy as np
+from langchain_community.vectorstores.utils import DistanceStrategy
+
+from pdf_chat.bm25 import is_exact_lookup
+
+MODE_VECTOR = "vector"
+MODE_HYBRID = "hybrid"
+MODE_LEXICAL = "lexical"
+
+
+def _documents(vector_store, ids):
+    return [vector_store.docstore.search(vector_store.index_to_docstore_id[int(i)]) for i in ids]
+
+
+def is_decisive(hits, ratio):
+    """
+    The lexical ranking settles the answer when the best chunk clearly beats the runner-up
+    """
+    if not hits:
+        return False
+    if len(hits) == 1:
+        return True
+    return hits[0][1] >= ratio * hits[1][1]
+
+
+def rerank(vector_store, query_vector, ids, k):
+    """
+    Order candidate chunk ids by vector similarity to the query, using the vectors
+    already stored in the FAISS index
+    """
+    ids = np.asarray(ids, dtype=np.int64)
+    vectors = vector_store.index.reconstruct_batch(ids)
+    query = np.asarray(query_vector, dtype=np.float32)
+    if vector_store._normalize_L2:
+        query = query / (np.linalg.norm(query) or 1.0)
+    if vector_store.distance_strategy == DistanceStrategy.MAX_INNER_PRODUCT:
+        order = np.argsort(-(vectors @ query))
+    else:
+        order = np.argsort(((vectors - query) ** 2).sum(axis=1))
+    return ids[order[:k]].tolist()
+
+
+def chunk_vectors(vector_store, documents):
+    """
+    Read the stored vectors of retrieved chunks back from the FAISS index
+    """
+    positions = []
+    reverse = None
+    for document in documents:
+        position = document.metadata.get("chunk_index")
+        if position is None or vector_store.index_to_docstore_id.get(position) != document.id:
+            # Stores built without chunk_index metadata: look the docstore id up
+            if reverse is None:
+                reverse = {doc_id: i for i, doc_id in vector_store.index_to_docstore_id.items()}
+            position = reverse[document.id]
+        positions.append(position)
+    if not positions:
+        return np.empty((0, vector_store.index.d), dtype=np.float32)
+    return vector_store.index.reconstruct_batch(np.asarray(positions, dtype=np.int64))
+
+
+def retrieve_with_vector(vector_store, query, lexical_index=None, mode=MODE_HYBRID, k=4, candidates=50,
+                         decisive_ratio=2.0):
+    """
+    ``retrieve``, also returning the query vector it computed (None when the
+    answer came from BM25 alone and the query was never embedded)
+    """
+    if lexical_index is not None and mode != MODE_VECTOR:
+        hits = lexical_index.search(query, k=candidates)
+        if mode == MODE_LEXICAL or (is_exact_lookup(query) and is_decisive(hits, decisive_ratio)):
+            if hits:
+                return _documents(vector_store, [doc_id for doc_id, _ in hits[:k]]), None
+            if mode == MODE_LEXICAL:
+                return [], None
+
+        if len(hits) >= k:
+            query_vector = vector_store._embed_query(query)
+            ids = rerank(vector_store, query_vector, [doc_id for doc_id, _ in hits], k)
+            return _documents(vector_store, ids), query_vector
+        # Too few lexical matches to re-rank, search the whole index
+
+    query_vector = vector_store._embed_query(query)
+    return vector_store.similarity_search_by_vector(query_vector, k=k), query_vector
+
+
+def retrieve(vector_store, query, lexical_index=None, mode=MODE_HYBRID, k=4, candidates=50, decisive_ratio=2.0):
+    """
+    Return the ``k`` chunks most relevant to ``query``.
+
+    ``vector`` mode is a plain similarity search. ``hybrid`` takes the BM25
+    top ``candidates`` and re-ranks them by vector similarity, answering straight
+    from BM25 (no query embedding) when the query names an identifier and the
+    lexical ranking is decisive. ``lexical`` uses BM25 alone.
+    """
+    documents, _ = retrieve_with_vector(vector_store, query, lexical_index=lexical_index, mode=mode, k=k,
+                                        candidates=candidates, decisive_ratio=decisive_ratio)
+    return documents
@@ -0,0 +1,11 @@
+from django.db.models.signals import pre_delete
+from django.dispatch import receiver
+
+from pdf_chat.models import PDFDocument
+
+
+@receiver(pre_delete, sender=PDFDocument)
+def tombstone_corpus_vectors(sender, instance, **kwargs):
+    # Chunks go with the document (CASCADE), so their vector ids are read first
+    from pdf_chat.views import delete_corpus_vectors
+    delete_corpus_vectors(instance)
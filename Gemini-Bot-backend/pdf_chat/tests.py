@@ -1,3 +1,969 @@
-from django.test import TestCase
+import asyncio
+import hashlib
+import os
+import pickle
+import shutil
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+import faiss
+import numpy as np
+import pdfplumber
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import SimpleTestCase, TransactionTestCase
+from django.utils import timezone
+from langchain_community.vectorstores import FAISS
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+from APIs.answer_cache import AnswerCache
+from benchmarks.pdfgen import make_pdf, synthetic_pages
+from pdf_chat import views as pdf_views
+from pdf_chat.bm25 import BM25Index, is_exact_lookup, tokenize
+from pdf_chat.context import ELLIPSIS, mmr, pack_context
+from pdf_chat.corpus_index import INDEX_FLAT, INDEX_HNSW, INDEX_IVF, CorpusIndex
+from pdf_chat.embedding_cache import QUERY_SUFFIX, CachedEmbeddings, EmbeddingCache
+from pdf_chat.embedding_scheduler import EmbeddingScheduler, RateLimiter, UpstreamError, is_retryable
+from pdf_chat.extraction import MIN_PARALLEL_PAGES, extract_pages, page_count, partition_pages
+from pdf_chat.index_cache import IndexCache, estimate_index_bytes, index_version
+from pdf_chat.index_store import IndexStore, save_upload
+from pdf_chat.ingest import PDFTextError, build_vector_store, iter_batches, iter_chunks
+from pdf_chat.jobs import IngestionWorkerPool, claim_next, enqueue, requeue_stale
+from pdf_chat.models import PDFDocument, PDFQuery
+from pdf_chat.retrieval import MODE_LEXICAL, is_decisive, retrieve_with_vector
+from pdf_chat.vector_storage import (
+    DOCSTORE_FILE,
+    EXACT_VECTORS_FILE,
+    INDEX_FILE,
+    STORAGE_FLOAT16,
+    STORAGE_FLOAT32,
+    STORAGE_INT8,
+    STORAGE_PQ,
+    MappedIndex,
+    compress_index,
+    load_mapped,
+    write_compressed,
+)
+
+
+class RecordingUpstream:
+    """
+    Upstream returning one-element vectors (the text length) and recording every batch it was sent
+    """
+
+    def __init__(self, failures=()):
+        self.batches = []
+        self.failures = list(failures)
+        self.lock = threading.Lock()
+
+    def __call__(self, texts):
+        with self.lock:
+            self.batches.append(list(texts))
+            if self.failures:
+                raise self.failures.pop(0)
+        return [[float(len(text))] for text in texts]
+
+
+class EmbeddingSchedulerTests(SimpleTestCase):
+    def scheduler(self, upstream, **kwargs):
+        kwargs.setdefault("max_wait", 0.05)
+        kwargs.setdefault("backoff", 0)
+        return EmbeddingScheduler(upstream, **kwargs)
+
+    def test_empty_submit_does_not_call_upstream(self):
+        upstream = RecordingUpstream()
+        self.assertEqual(self.scheduler(upstream).embed([]), [])
+        self.assertEqual(upstream.batches, [])
+
+    def test_concurrent_callers_share_one_batch(self):
+        upstream = RecordingUpstream()
+        scheduler = self.scheduler(upstream, max_wait=0.2)
+        first = scheduler.submit(["a", "bb"])
+        second = scheduler.submit(["ccc"])
+        self.assertEqual(first.result(timeout=5), [[1.0], [2.0]])
+        self.assertEqual(second.result(timeout=5), [[3.0]])
+        self.assertEqual(upstream.batches, [["a", "bb", "ccc"]])
+
+    def test_batches_are_capped_and_vectors_keep_their_order(self):
+        upstream = RecordingUpstream()
+        texts = ["x" * n for n in range(1, 6)]
+        vectors = self.scheduler(upstream, max_batch=2).embed(texts)
+        self.assertEqual(vectors, [[float(n)] for n in range(1, 6)])
+        self.assertEqual([len(batch) for batch in upstream.batches], [2, 2, 1])
+
+    def test_retryable_errors_are_retried(self):
+        upstream = RecordingUpstream(failures=[UpstreamError("rate limited", status=429)])
+        self.assertEqual(self.scheduler(upstream).embed(["abc"]), [[3.0]])
+        self.assertEqual(len(upstream.batches), 2)
+
+    def test_other_errors_fail_the_callers_without_retrying(self):
+        upstream = RecordingUpstream(failures=[UpstreamError("bad request", status=400)])
+        with self.assertRaises(UpstreamError):
+            self.scheduler(upstream).embed(["abc"])
+        self.assertEqual(len(upstream.batches), 1)
+
+    def test_retries_give_up_after_max_retries(self):
+        upstream = RecordingUpstream(failures=[UpstreamError("unavailable", status=503)] * 3)
+        with self.assertRaises(UpstreamError):
+            self.scheduler(upstream, max_retries=2).embed(["abc"])
+        self.assertEqual(len(upstream.batches), 3)
+
+    def test_wrong_number_of_vectors_is_an_error(self):
+        scheduler = self.scheduler(lambda texts: [[0.0]])
+        with self.assertRaises(UpstreamError):
+            scheduler.embed(["a", "b"])
+
+    def test_is_retryable(self):
+        self.assertTrue(is_retryable(UpstreamError("", status=429)))
+        self.assertTrue(is_retryable(UpstreamError("", status=503)))
+        self.assertFalse(is_retryable(UpstreamError("", status=400)))
+        self.assertTrue(is_retryable(Exception("429 Resource has been exhausted")))
+        self.assertFalse(is_retryable(ValueError("invalid input")))
+
+
+class RateLimiterTests(SimpleTestCase):
+    def test_no_limits_never_wait(self):
+        limiter = RateLimiter()
+        started = time.monotonic()
+        for _ in range(1000):
+            limiter.acquire(10_000)
+        self.assertLess(time.monotonic() - started, 0.5)
+
+    def test_waits_once_the_request_bucket_is_empty(self):
+        # 600 per minute: a full bucket of 600, then one request every 0.1s
+        limiter = RateLimiter(requests_per_minute=600)
+        for _ in range(600):
+            limiter.acquire()
+        started = time.monotonic()
+        limiter.acquire()
+        self.assertGreaterEqual(time.monotonic() - started, 0.05)
+
+    def test_batch_larger_than_the_token_budget_does_not_block_forever(self):
+        limiter = RateLimiter(tokens_per_minute=60)
+        started = time.monotonic()
+        limiter.acquire(1_000)
+        self.assertLess(time.monotonic() - started, 0.5)
+
+
+class CountingEmbeddings(Embeddings):
+    """
+    Deterministic embeddings (letter counts) that count how often a query was embedded
+    """
+
+    def __init__(self):
+        self.queries = 0
+
+    @staticmethod
+    def vector(text):
+        counts = [0.0] * 26
+        for c in text.lower():
+            if "a" <= c <= "z":
+                counts[ord(c) - ord("a")] += 1
+        return counts
+
+    def embed_documents(self, texts):
+        return [self.vector(text) for text in texts]
+
+    def embed_query(self, text):
+        self.queries += 1
+        return self.vector(text)
+
+
+def make_store(texts, embeddings=None):
+    embeddings = embeddings or CountingEmbeddings()
+    return FAISS.from_embeddings(
+        list(zip(texts, embeddings.embed_documents(texts))),
+        embedding=embeddings,
+        metadatas=[{"chunk_index": i} for i in range(len(texts))],
+    )
+
+
+CHUNKS = [
+    "The warranty covers parts and labour for two years.",
+    "Replacement pump AX-200 ships with a three year warranty.",
+    "Payment terms are thirty days from the invoice date.",
+    "The subscription renews every year unless cancelled.",
+    "Refunds are issued to the original payment method.",
+]
+
+
+class RecordingEmbeddings(CountingEmbeddings):
+    def __init__(self):
+        super().__init__()
+        self.documents = []
+
+    def embed_documents(self, texts):
+        self.documents.append(list(texts))
+        return super().embed_documents(texts)
+
+
+class EmbeddingCacheTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, "embeddings.sqlite3")
+        self.now = 1000.0
+        patcher = mock.patch("pdf_chat.embedding_cache.time.time", side_effect=lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_misses_are_embedded_once_and_then_hit(self):
+        inner = RecordingEmbeddings()
+        embeddings = CachedEmbeddings(inner, EmbeddingCache(self.path, 1024 * 1024), "model")
+        first = embeddings.embed_documents(["abc", "bcd", "abc"])
+        self.assertEqual(inner.documents, [["abc", "bcd"]])
+        self.assertEqual(first, inner.embed_documents(["abc", "bcd", "abc"]))
+        inner.documents.clear()
+        self.assertEqual(embeddings.embed_documents(["bcd", "cde"]), [first[1], CountingEmbeddings.vector("cde")])
+        self.assertEqual(inner.documents, [["cde"]])
+
+    def test_queries_are_cached_apart_from_documents(self):
+        inner = RecordingEmbeddings()
+        cache = EmbeddingCache(self.path, 1024 * 1024)
+        embeddings = CachedEmbeddings(inner, cache, "model")
+        embeddings.embed_documents(["abc"])
+        self.assertEqual(embeddings.embed_query("abc"), CountingEmbeddings.vector("abc"))
+        self.assertEqual(embeddings.embed_query("abc"), CountingEmbeddings.vector("abc"))
+        self.assertEqual(inner.queries, 1)
+        self.assertEqual(embeddings.embed_queries(["abc", "xyz", "xyz"]), [CountingEmbeddings.vector(t)
+                                                                           for t in ("abc", "xyz", "xyz")])
+        self.assertEqual(inner.queries, 2)
+        self.assertIsNotNone(cache.get_many(f"model{QUERY_SUFFIX}", ["xyz"])[0])
+        self.assertIsNone(cache.get_many("model", ["xyz"])[0])
+
+    def test_models_do_not_share_vectors(self):
+        cache = EmbeddingCache(self.path, 1024 * 1024)
+        cache.put_many("old", ["abc"], [[1.0, 2.0]])
+        cache.put_many("new", ["abc"], [[3.0]])
+        self.assertEqual(cache.get_many("old", ["abc", "zzz"]), [[1.0, 2.0], None])
+        self.assertEqual(cache.get_many("new", ["abc"]), [[3.0]])
+        # A second process sees the same rows
+        self.assertEqual(EmbeddingCache(self.path, 1024 * 1024).get_many("new", ["abc"]), [[3.0]])
+
+    def test_least_recently_used_vectors_are_evicted(self):
+        vector = [0.0] * 25  # 100 bytes
+        cache = EmbeddingCache(self.path, 350)
+        patcher = mock.patch("pdf_chat.embedding_cache._EVICT_BATCH", 1)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        for i, text in enumerate(("a", "b", "c")):
+            self.now = 1000.0 + i
+            cache.put_many("model", [text], [vector])
+        self.now = 1010.0
+        cache.get_many("model", ["a"])
+        self.assertEqual(cache.size_bytes(), 300)
+        self.now = 1011.0
+        cache.put_many("model", ["d"], [vector])
+        self.assertEqual(cache.size_bytes(), 300)
+        found = cache.get_many("model", ["a", "b", "c", "d"])
+        self.assertEqual([vector is not None for vector in found], [True, False, True, True])
+
+
+class BM25IndexTests(SimpleTestCase):
+    def test_tokenize_keeps_identifiers_whole_and_split(self):
+        self.assertEqual(tokenize("Pump AX-200/3"), ["pump", "ax-200/3", "ax", "200", "3"])
+
+    def test_is_exact_lookup(self):
+        self.assertTrue(is_exact_lookup("Which pump is AX-200?"))
+        self.assertTrue(is_exact_lookup("clause 4.2.1"))
+        self.assertFalse(is_exact_lookup("What does the warranty cover?"))
+        self.assertFalse(is_exact_lookup(""))
+
+    def test_empty_index_and_empty_query(self):
+        self.assertEqual(BM25Index.build([]).search("warranty"), [])
+        self.assertEqual(BM25Index.build(CHUNKS).search(""), [])
+        self.assertEqual(BM25Index.build(["", ""]).search("warranty"), [])
+
+    def test_search_ranks_matching_chunks(self):
+        index = BM25Index.build(CHUNKS)
+        hits = index.search("AX-200", k=3)
+        self.assertEqual(hits[0][0], 1)
+        self.assertEqual(index.search("200")[0][0], 1)
+        self.assertEqual({doc_id for doc_id, _ in index.search("warranty")}, {0, 1})
+        self.assertEqual(len(index.search("the payment warranty year", k=2)), 2)
+
+    def test_dumps_and_loads_round_trip(self):
+        index = BM25Index.build(CHUNKS)
+        loaded = BM25Index.loads(index.dumps())
+        self.assertEqual(len(loaded), len(CHUNKS))
+        self.assertEqual(loaded.search("payment terms"), index.search("payment terms"))
+
+    def test_loads_rejects_other_formats(self):
+        with self.assertRaises(ValueError):
+            BM25Index.loads(pickle.dumps({"version": -1}))
+
+
+class RetrievalTests(SimpleTestCase):
+    def test_is_decisive_thresholds(self):
+        self.assertFalse(is_decisive([], 2.0))
+        self.assertTrue(is_decisive([(0, 1.0)], 2.0))
+        self.assertTrue(is_decisive([(0, 2.0), (1, 1.0)], 2.0))
+        self.assertFalse(is_decisive([(0, 1.99), (1, 1.0)], 2.0))
+
+    def test_decisive_identifier_lookup_skips_the_query_embedding(self):
+        embeddings = CountingEmbeddings()
+        store = make_store(CHUNKS, embeddings)
+        docs, query_vector = retrieve_with_vector(store, "AX-200", lexical_index=BM25Index.build(CHUNKS), k=2)
+        self.assertIsNone(query_vector)
+        self.assertEqual(embeddings.queries, 0)
+        self.assertEqual(docs[0].page_content, CHUNKS[1])
+
+    def test_other_questions_are_embedded_once(self):
+        embeddings = CountingEmbeddings()
+        store = make_store(CHUNKS, embeddings)
+        docs, query_vector = retrieve_with_vector(store, "what about the warranty", k=2,
+                                                  lexical_index=BM25Index.build(CHUNKS))
+        self.assertIsNotNone(query_vector)
+        self.assertEqual(embeddings.queries, 1)
+        self.assertEqual(len(docs), 2)
+
+    def test_lexical_mode_without_matches_returns_nothing(self):
+        store = make_store(CHUNKS)
+        docs, query_vector = retrieve_with_vector(store, "zebra", lexical_index=BM25Index.build(CHUNKS),
+                                                  mode=MODE_LEXICAL)
+        self.assertEqual((docs, query_vector), ([], None))
+
+
+class CorpusIndexTests(SimpleTestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root, ignore_errors=True)
+        # Vector i sits at (i, 0, 0, 0), so the nearest ids to (x, 0, 0, 0) are known
+        self.vectors = np.array([[i, 0, 0, 0] for i in range(10)], dtype=np.float32)
+
+    def corpus(self, **kwargs):
+        kwargs.setdefault("index_type", INDEX_FLAT)
+        return CorpusIndex(self.root, **kwargs)
+
+    def test_empty_index(self):
+        corpus = self.corpus()
+        self.assertEqual(len(corpus), 0)
+        self.assertEqual(corpus.search([0, 0, 0, 0]), [])
+        self.assertEqual(corpus.add(np.empty((0, 4))), [])
+        corpus.delete([])
+        corpus.compact()
+        self.assertFalse(corpus.needs_compaction())
+
+    def test_add_assigns_increasing_ids_and_search_is_nearest_first(self):
+        corpus = self.corpus()
+        self.assertEqual(corpus.add(self.vectors[:5]), [0, 1, 2, 3, 4])
+        self.assertEqual(corpus.add(self.vectors[5:]), [5, 6, 7, 8, 9])
+        self.assertEqual([i for i, _ in corpus.search([6.2, 0, 0, 0], k=3)], [6, 7, 5])
+        self.assertEqual([i for i, _ in corpus.search([6.2, 0, 0, 0], k=2, allowed_ids=[1, 2, 9])], [9, 2])
+
+    def test_tombstoned_ids_are_never_returned(self):
+        corpus = self.corpus()
+        corpus.add(self.vectors)
+        corpus.delete([6, 7])
+        self.assertEqual(len(corpus), 8)
+        self.assertEqual([i for i, _ in corpus.search([6.2, 0, 0, 0], k=3)], [5, 8, 4])
+        self.assertEqual([i for i, _ in corpus.search([6.2, 0, 0, 0], k=3, allowed_ids=[6, 7, 1])], [1])
+        self.assertEqual(corpus.search([6.2, 0, 0, 0], allowed_ids=[6, 7]), [])
+
+    def test_filtered_search_through_the_ann_index_skips_tombstones(self):
+        corpus = self.corpus(index_type=INDEX_HNSW)
+        corpus.add(self.vectors)
+        corpus.delete([6])
+        with mock.patch("pdf_chat.corpus_index.EXACT_SEARCH_LIMIT", 0):
+            hits = corpus.search([6.2, 0, 0, 0], k=2, allowed_ids=[5, 6, 7])
+        self.assertEqual([i for i, _ in hits], [7, 5])
+
+    def test_needs_compaction_past_the_tombstone_ratio(self):
+        corpus = self.corpus(compact_ratio=0.2)
+        corpus.add(self.vectors)
+        corpus.delete([0, 1])
+        self.assertFalse(corpus.needs_compaction())
+        corpus.delete([2])
+        self.assertTrue(corpus.needs_compaction())
+
+    def test_small_ivf_corpus_settles_after_one_compaction(self):
+        corpus = self.corpus(index_type=INDEX_IVF, nlist=16)
+        corpus.add(np.random.default_rng(0).random((100, 4), dtype=np.float32))
+        self.assertFalse(corpus.needs_compaction())
+        corpus.delete(range(30))
+        self.assertTrue(corpus.needs_compaction())
+        corpus.compact()
+        self.assertFalse(corpus.needs_compaction())
+        self.assertEqual(corpus._meta["generation"], 1)
+
+    def test_ivf_corpus_is_upgraded_once_it_can_be_trained(self):
+        corpus = self.corpus(index_type=INDEX_IVF, nlist=2)
+        corpus.add(np.random.default_rng(0).random((60, 4), dtype=np.float32))
+        self.assertFalse(corpus.needs_compaction())
+        corpus.add(np.random.default_rng(1).random((30, 4), dtype=np.float32))
+        self.assertTrue(corpus.needs_compaction())
+        corpus.compact()
+        self.assertEqual(corpus._meta["built_as"], INDEX_IVF)
+        self.assertFalse(corpus.needs_compaction())
+        self.assertEqual(len(corpus), 90)
+
+    def test_compact_drops_tombstones_and_keeps_ids(self):
+        corpus = self.corpus()
+        corpus.add(self.vectors)
+        corpus.delete([6, 7, 8])
+        corpus.compact()
+        self.assertEqual(len(corpus), 7)
+        self.assertFalse(corpus.needs_compaction())
+        self.assertEqual([i for i, _ in corpus.search([6.2, 0, 0, 0], k=2)], [5, 4])
+        np.testing.assert_array_equal(corpus.reconstruct([9]), self.vectors[[9]])
+
+    def test_compacting_everything_away(self):
+        corpus = self.corpus()
+        corpus.add(self.vectors[:2])
+        corpus.delete([0, 1])
+        corpus.compact()
+        self.assertEqual(len(corpus), 0)
+        self.assertEqual(corpus.search([0, 0, 0, 0]), [])
+        self.assertEqual(corpus.add(self.vectors[2:3]), [2])
+
+    def test_other_instances_see_adds_deletes_and_compactions(self):
+        writer, reader = self.corpus(), self.corpus()
+        writer.add(self.vectors[:5])
+        self.assertEqual(len(reader), 5)
+        writer.add(self.vectors[5:])
+        writer.delete([9])
+        self.assertEqual([i for i, _ in reader.search([9, 0, 0, 0], k=1)], [8])
+        writer.compact()
+        self.assertEqual(len(reader), 9)
+        self.assertEqual(reader.add(self.vectors[:1]), [10])
+        self.assertEqual(len(writer), 10)
+
+    def test_delta_log_is_checkpointed_into_a_new_base(self):
+        with mock.patch("pdf_chat.corpus_index.MAX_DELTAS", 3):
+            corpus = self.corpus()
+            for i in range(4):
+                corpus.add(self.vectors[i:i + 1])
+        self.assertEqual(len([name for name in os.listdir(self.root) if name.startswith("delta-")]), 1)
+        self.assertEqual(len(self.corpus()), 4)
+
+
+def numbered_pages(count, words=40):
+    return [" ".join(f"p{page}w{word}" for word in range(words)) + " " for page in range(1, count + 1)]
+
+
+class IterChunksTests(SimpleTestCase):
+    def setUp(self):
+        self.splitter = RecursiveCharacterTextSplitter(chunk_size=120, chunk_overlap=30)
+
+    def test_empty_input(self):
+        self.assertEqual(list(iter_chunks([], self.splitter)), [])
+        self.assertEqual(list(iter_chunks(["", ""], self.splitter)), [])
+
+    def test_streaming_matches_splitting_the_whole_document(self):
+        pages = numbered_pages(12)
+        streamed = [text for text, _ in iter_chunks(pages, self.splitter, split_threshold=300)]
+        self.assertEqual(streamed, self.splitter.split_text("".join(pages)))
+
+    def test_pages_spanned_by_each_chunk(self):
+        pages = numbered_pages(6)
+        for text, spanned in iter_chunks(pages, self.splitter, split_threshold=300):
+            found = sorted({int(token[1:token.index("w")]) for token in text.split()})
+            self.assertEqual(spanned, list(range(found[0], found[-1] + 1)))
+
+    def test_short_document_is_one_chunk_on_page_one(self):
+        self.assertEqual(list(iter_chunks(["", "Short page."], self.splitter)), [("Short page.", [2])])
+
+    def test_iter_batches(self):
+        self.assertEqual(list(iter_batches(range(5), 2)), [[0, 1], [2, 3], [4]])
+        self.assertEqual(list(iter_batches([], 2)), [])
+
+
+class ExtractionTests(SimpleTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.directory = tempfile.mkdtemp()
+        cls.pdf_path = os.path.join(cls.directory, "fixture.pdf")
+        with open(cls.pdf_path, "wb") as f:
+            f.write(make_pdf(synthetic_pages(MIN_PARALLEL_PAGES + 4, lines_per_page=10)))
+        # What extraction looked like before it was split into ranges: one file, every page in turn
+        with pdfplumber.open(cls.pdf_path) as pd:
+            cls.baseline = [page.extract_text() or "" for page in pd.pages]
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.directory, ignore_errors=True)
+        super().tearDownClass()
+
+    def test_partition_pages(self):
+        self.assertEqual(partition_pages(0, 4), [])
+        self.assertEqual(partition_pages(10, 4), [(0, 8), (8, 10)])
+        ranges = partition_pages(1001, 4)
+        self.assertEqual(ranges[0], (0, 63))
+        self.assertEqual(ranges[-1][1], 1001)
+        self.assertTrue(all(a[1] == b[0] for a, b in zip(ranges, ranges[1:])))
+
+    def test_single_process_matches_the_baseline(self):
+        self.assertEqual(len(self.baseline), MIN_PARALLEL_PAGES + 4)
+        self.assertIn("Section 1.1:", self.baseline[0])
+        self.assertEqual(page_count(self.pdf_path), len(self.baseline))
+        self.assertEqual(extract_pages(self.pdf_path), self.baseline)
+
+    def test_worker_pool_matches_the_baseline(self):
+        self.assertEqual(extract_pages(self.pdf_path, workers=2), self.baseline)
+
+    def test_max_pages_reads_the_leading_pages(self):
+        self.assertEqual(extract_pages(self.pdf_path, max_pages=3), self.baseline[:3])
+        self.assertEqual(extract_pages(self.pdf_path, workers=2, max_pages=MIN_PARALLEL_PAGES + 1),
+                         self.baseline[:MIN_PARALLEL_PAGES + 1])
+
+    def test_build_vector_store_indexes_every_page(self):
+        stats = {}
+        with mock.patch("pdf_chat.ingest.CHUNK_SIZE", 500), mock.patch("pdf_chat.ingest.CHUNK_OVERLAP", 50):
+            store = build_vector_store(self.pdf_path, CountingEmbeddings(), workers=2, batch_size=4, stats=stats)
+        self.assertEqual(stats["pages"], len(self.baseline))
+        self.assertEqual(stats["characters"], sum(len(text) for text in self.baseline))
+        self.assertEqual(store.index.ntotal, stats["chunks"])
+        documents = [store.docstore.search(store.index_to_docstore_id[i]) for i in range(stats["chunks"])]
+        self.assertEqual([d.metadata["chunk_index"] for d in documents], list(range(stats["chunks"])))
+        self.assertEqual(documents[0].metadata["pages"][0], 1)
+        self.assertEqual(documents[-1].metadata["pages"][-1], len(self.baseline))
+
+    def test_pdf_without_text_raises(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "blank.pdf")
+            with open(path, "wb") as f:
+                f.write(make_pdf([[]]))
+            with self.assertRaises(PDFTextError):
+                build_vector_store(path, CountingEmbeddings())
+
+
+class PackContextTests(SimpleTestCase):
+    def doc(self, text, index, document_id=1):
+        return Document(page_content=text, metadata={"document_id": document_id, "chunk_index": index})
+
+    def test_empty_documents(self):
+        packed, stats = pack_context("question", [])
+        self.assertEqual(packed, [])
+        self.assertEqual(stats["context_tokens"], 0)
+        self.assertEqual(pack_context("question", [], vectors=np.empty((0, 2)), query_vector=[1, 0])[0], [])
+
+    def test_mmr(self):
+        self.assertEqual(mmr([1, 0], [], 3), [])
+        vectors = [[1, 0], [0.99, 0.01], [0, 1]]
+        self.assertEqual(mmr([1, -0.2], vectors, 3, lambda_mult=1.0), [0, 1, 2])
+        # Diversity first: the near duplicate of the top hit drops behind the orthogonal vector
+        self.assertEqual(mmr([1, -0.2], vectors, 2, lambda_mult=0.3), [0, 2])
+        self.assertEqual(len(mmr([1, 0], vectors, 10)), 3)
+
+    def test_max_chunks_and_document_order(self):
+        documents = [self.doc(f"Chunk {i}.", i) for i in (3, 1, 2, 0)]
+        packed, stats = pack_context("question", documents, max_chunks=3)
+        self.assertEqual([d.page_content for d in packed], ["Chunk 1.", "Chunk 2.", "Chunk 3."])
+        self.assertEqual(stats["chunks"], 3)
+        self.assertEqual(stats["candidates"], 4)
+
+    def test_duplicate_chunks_are_sent_once(self):
+        documents = [self.doc("Same text.", 0), self.doc("Same text.", 4, document_id=2), self.doc("Other.", 1)]
+        packed, _ = pack_context("question", documents)
+        self.assertEqual([d.page_content for d in packed], ["Same text.", "Other."])
+
+    def test_overlap_between_neighbours_is_stripped(self):
+        overlap = "shared overlap sentence, long enough to cover the whole probe at the start of a chunk."
+        first = "Opening sentence. " + overlap
+        second = overlap + " Closing sentence."
+        packed, stats = pack_context("question", [self.doc(second, 1), self.doc(first, 0)])
+        self.assertEqual([d.page_content for d in packed], [first, "Closing sentence."])
+        self.assertGreater(stats["tokens_saved"], 0)
+
+    def test_overlap_is_kept_between_chunks_that_are_not_neighbours(self):
+        text = "shared overlap sentence, long enough to cover the whole probe at the start of a chunk."
+        packed, _ = pack_context("question", [self.doc("A. " + text, 0), self.doc(text + " B.", 2)])
+        self.assertEqual(packed[1].page_content, text + " B.")
+
+    def test_over_budget_chunks_keep_the_relevant_sentences(self):
+        filler = " ".join(f"Filler sentence number {i} about nothing." for i in range(40))
+        documents = [self.doc(filler + " The warranty lasts five years. " + filler, 0)]
+        packed, stats = pack_context("How long is the warranty?", documents, budget_tokens=40)
+        self.assertIn("The warranty lasts five years.", packed[0].page_content)
+        self.assertIn(ELLIPSIS, packed[0].page_content)
+        self.assertLessEqual(stats["context_tokens"], 40)
+
+    def test_nothing_fits_a_zero_budget(self):
+        packed, stats = pack_context("question", [self.doc("Some text.", 0)], budget_tokens=0)
+        self.assertEqual(packed, [])
+        self.assertEqual(stats["context_tokens"], 0)
+
+
+class IngestionJobTests(TransactionTestCase):
+    def make_document(self, **fields):
+        fields.setdefault("file_hash", f"{len(PDFDocument.objects.all()):064d}")
+        return PDFDocument.objects.create(session_id="s", file_name="a.pdf", file_size=1, **fields)
+
+    def test_claim_records_the_attempt_and_heartbeat(self):
+        self.make_document()
+        document = claim_next()
+        self.assertEqual(document.status, PDFDocument.STATUS_PROCESSING)
+        self.assertEqual(document.attempts, 1)
+        self.assertEqual(document.heartbeat_at, document.started_at)
+        self.assertIsNone(claim_next())
+
+    def test_only_jobs_without_a_recent_heartbeat_are_stale(self):
+        old = timezone.now() - timedelta(seconds=1000)
+        alive = self.make_document(status=PDFDocument.STATUS_PROCESSING, attempts=1, started_at=old,
+                                   heartbeat_at=timezone.now())
+        dead = self.make_document(status=PDFDocument.STATUS_PROCESSING, attempts=1, started_at=old, heartbeat_at=old)
+        exhausted = self.make_document(status=PDFDocument.STATUS_PROCESSING, attempts=3, started_at=old)
+        requeue_stale(900, 3)
+        statuses = {d.pk: d.status for d in PDFDocument.objects.all()}
+        self.assertEqual(statuses[alive.pk], PDFDocument.STATUS_PROCESSING)
+        self.assertEqual(statuses[dead.pk], PDFDocument.STATUS_QUEUED)
+        self.assertEqual(statuses[exhausted.pk], PDFDocument.STATUS_FAILED)
+
+    def test_long_jobs_keep_beating(self):
+        self.make_document()
+        document = claim_next()
+
+        def slow_handler(doc):
+            time.sleep(0.3)
+            return {"page_count": 7}
+
+        pool = IngestionWorkerPool(slow_handler, job_timeout=0.2)
+        pool.process(document)
+        document.refresh_from_db()
+        self.assertEqual(document.status, PDFDocument.STATUS_READY)
+        self.assertEqual(document.page_count, 7)
+        self.assertGreater(document.heartbeat_at, document.started_at)
+
+    def test_superseded_attempt_does_not_finish_the_job(self):
+        self.make_document()
+        first = claim_next()
+
+        def handler(doc):
+            # Meanwhile the job was presumed dead, requeued and claimed again
+            enqueue(doc)
+            claim_next()
+            return {"page_count": 7}
+
+        pool = IngestionWorkerPool(handler)
+        pool.process(first)
+        first.refresh_from_db()
+        self.assertEqual(first.status, PDFDocument.STATUS_PROCESSING)
+        self.assertEqual(first.attempts, 2)
+        self.assertEqual(first.page_count, 0)
+
+    def test_failures_are_recorded_on_the_current_attempt(self):
+        self.make_document()
+        document = claim_next()
+
+        def handler(doc):
+            raise ValueError("broken PDF")
+
+        IngestionWorkerPool(handler).process(document)
+        document.refresh_from_db()
+        self.assertEqual(document.status, PDFDocument.STATUS_FAILED)
+        self.assertEqual(document.error_message, "broken PDF")
+
+    def test_maintenance_runs_after_jobs_or_on_its_interval(self):
+        calls = []
+        pool = IngestionWorkerPool(lambda doc: {}, maintenance=lambda: calls.append(1), maintenance_interval=3600)
+        pool.maintain()
+        self.assertEqual(calls, [])
+        pool.maintain(force=True)
+        self.assertEqual(calls, [1])
+        pool._maintained_at -= 3600
+        pool.maintain()
+        pool.maintain()
+        self.assertEqual(calls, [1, 1])
+
+
+class AsyncCachedAnswerTests(SimpleTestCase):
+    def test_concurrent_identical_questions_share_retrieval_and_generation(self):
+        cache = AnswerCache(1024 * 1024)
+        retrievals = []
+        generations = []
+
+        def get_context():
+            retrievals.append(1)
+            time.sleep(0.01)
+            return ["chunk"], [1.0, 0.0]
+
+        async def generate(docs, prompt, api_key):
+            generations.append(docs)
+            await asyncio.sleep(0.01)
+            return "answer"
+
+        async def ask():
+            return await asyncio.gather(*(
+                pdf_views._acached_answer("hash", "What is RAG?", "key", get_context) for _ in range(4)
+            ))
+
+        with mock.patch("pdf_chat.views.get_answer_cache", return_value=cache), \
+                mock.patch("pdf_chat.views._agenerate_answer", side_effect=generate):
+            self.assertEqual(asyncio.run(ask()), ["answer"] * 4)
+        self.assertEqual(retrievals, [1])
+        self.assertEqual(generations, [["chunk"]])
+        self.assertEqual(cache.coalesced, 3)
+
+
+def random_store(count, dim=16, seed=0):
+    vectors = np.random.default_rng(seed).random((count, dim), dtype=np.float32)
+    texts = [f"chunk {i}" for i in range(count)]
+    return FAISS.from_embeddings(list(zip(texts, vectors.tolist())), embedding=CountingEmbeddings()), vectors
+
+
+class VectorStorageTests(SimpleTestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root, ignore_errors=True)
+
+    def saved(self, vector_store, storage, **kwargs):
+        path = os.path.join(self.root, f"{storage}-{len(os.listdir(self.root))}")
+        vector_store.save_local(path)
+        write_compressed(path, vector_store, storage, **kwargs)
+        return path
+
+    def test_compressed_storage_is_smaller_than_float32(self):
+        vector_store, _ = random_store(500)
+        float32 = self.saved(vector_store, STORAGE_FLOAT32)
+        int8 = self.saved(vector_store, STORAGE_INT8)
+        self.assertFalse(os.path.exists(os.path.join(int8, EXACT_VECTORS_FILE)))
+        self.assertLess(os.path.getsize(os.path.join(int8, INDEX_FILE)),
+                        os.path.getsize(os.path.join(float32, INDEX_FILE)) / 3)
+
+    def test_pq_falls_back_to_int8_for_small_indexes(self):
+        vectors = np.random.default_rng(0).random((100, 16), dtype=np.float32)
+        index = compress_index(vectors, STORAGE_PQ)
+        self.assertIsInstance(index, faiss.IndexScalarQuantizer)
+        self.assertEqual(index.ntotal, 100)
+
+    def test_mapped_index_without_exact_vectors_searches_the_codes(self):
+        vector_store, vectors = random_store(200)
+        loaded = load_mapped(self.saved(vector_store, STORAGE_INT8), CountingEmbeddings(), rescore=True)
+        self.assertIsInstance(loaded.index, MappedIndex)
+        self.assertIsNone(loaded.index.exact_vectors)
+        self.assertEqual(loaded.index.ntotal, 200)
+        _, labels = loaded.index.search(vectors[:1], 1)
+        self.assertEqual(labels[0][0], 0)
+        np.testing.assert_allclose(loaded.index.reconstruct(3), vectors[3], atol=0.01)
+        self.assertEqual(len(loaded.docstore._dict), 200)
+
+    def test_exact_vectors_are_memory_mapped_and_rescore_exactly(self):
+        vector_store, vectors = random_store(300)
+        path = self.saved(vector_store, STORAGE_INT8, keep_exact=True)
+        loaded = load_mapped(path, CountingEmbeddings(), rescore=True, rescore_factor=8)
+        self.assertIsInstance(loaded.index.exact_vectors, np.memmap)
+
+        queries = np.random.default_rng(1).random((3, 16), dtype=np.float32)
+        distances, labels = loaded.index.search(queries, 5)
+        exact_distances, exact_labels = vector_store.index.search(queries, 5)
+        np.testing.assert_array_equal(labels, exact_labels)
+        np.testing.assert_allclose(distances, exact_distances, rtol=1e-4)
+        np.testing.assert_array_equal(loaded.index.reconstruct_batch([4, 2]), vectors[[4, 2]])
+        np.testing.assert_array_equal(loaded.index.reconstruct_n(0, 3), vectors[:3])
+
+    def test_rescoring_can_be_turned_off_at_load(self):
+        vector_store, _ = random_store(50)
+        path = self.saved(vector_store, STORAGE_FLOAT16, keep_exact=True)
+        self.assertIsNone(load_mapped(path, CountingEmbeddings(), rescore=False).index.exact_vectors)
+
+    def test_rescoring_inner_product_ranks_by_highest_score(self):
+        vectors = np.array([[1, 0], [0.6, 0.8], [0, 1]], dtype=np.float32)
+        index = faiss.IndexFlatIP(2)
+        index.add(vectors)
+        mapped = MappedIndex(index, exact_vectors=vectors, rescore_factor=3)
+        distances, labels = mapped.search(np.array([[0.1, 1]], dtype=np.float32), 2)
+        self.assertEqual(labels.tolist(), [[2, 1]])
+        np.testing.assert_allclose(distances, [[1.0, 0.86]], rtol=1e-5)
+
+    def test_fewer_vectors_than_k_pad_with_minus_one(self):
+        vectors = np.eye(2, dtype=np.float32)
+        index = faiss.IndexFlatL2(2)
+        index.add(vectors)
+        _, labels = MappedIndex(index, exact_vectors=vectors).search(vectors[:1], 4)
+        self.assertEqual(labels.tolist(), [[0, 1, -1, -1]])
+
+
+class IndexCacheTests(SimpleTestCase):
+    def test_entries_fit_the_byte_budget(self):
+        cache = IndexCache(100)
+        cache.put("a", 1, "A", nbytes=40)
+        cache.put("b", 1, "B", nbytes=40)
+        self.assertEqual((len(cache), cache.size_bytes()), (2, 80))
+        cache.put("too big", 1, "X", nbytes=101)
+        self.assertIsNone(cache.get("too big", 1))
+        cache.put("a", 2, "A2", nbytes=50)
+        self.assertEqual((len(cache), cache.size_bytes()), (2, 90))
+
+    def test_least_recently_used_entries_are_evicted(self):
+        cache = IndexCache(100)
+        cache.put("a", 1, "A", nbytes=40)
+        cache.put("b", 1, "B", nbytes=40)
+        self.assertEqual(cache.get("a", 1), "A")
+        cache.put("c", 1, "C", nbytes=40)
+        self.assertIsNone(cache.get("b", 1))
+        self.assertEqual((cache.get("a", 1), cache.get("c", 1)), ("A", "C"))
+        self.assertEqual((cache.hits, cache.misses), (3, 1))
+
+    def test_stale_versions_and_invalidated_keys_miss(self):
+        cache = IndexCache(100)
+        cache.put("a", 1, "A", nbytes=40)
+        self.assertIsNone(cache.get("a", 2))
+        self.assertEqual(len(cache), 0)
+        cache.put("a", 2, "A", nbytes=40)
+        cache.invalidate("a")
+        cache.invalidate("never-cached")
+        self.assertIsNone(cache.get("a", 2))
+        self.assertEqual(cache.size_bytes(), 0)
+
+    def test_estimate_counts_codes_and_texts(self):
+        store = make_store(CHUNKS)
+        self.assertGreater(estimate_index_bytes(store), len(CHUNKS) * 26 * 4)
+
+    def test_store_deletes_and_rewrites_invalidate_cached_indexes(self):
+        with tempfile.TemporaryDirectory() as root:
+            cache = IndexCache(1024 * 1024)
+            store = IndexStore(root, 1024 * 1024 * 1024, cache=cache)
+            store.save("doc", make_store(CHUNKS), BM25Index.build(CHUNKS))
+            first = store.load("doc", CountingEmbeddings())
+            store.load_lexical("doc")
+            self.assertEqual(len(cache), 2)
+            store.delete("doc")
+            self.assertEqual(len(cache), 0)
+            self.assertIsNone(store.load("doc", CountingEmbeddings()))
+
+            store.save("doc", make_store(CHUNKS))
+            self.assertIsNot(store.load("doc", CountingEmbeddings()), first)
+            version = index_version(store.path_for("doc"))
+            # Another worker replaces the index on disk: the cached copy is stale
+            shutil.rmtree(store.path_for("doc"))
+            IndexStore(root, 1024 * 1024 * 1024).save("doc", make_store(CHUNKS[:2]))
+            self.assertNotEqual(index_version(store.path_for("doc")), version)
+            self.assertEqual(store.load("doc", CountingEmbeddings()).index.ntotal, 2)
+
+
+class IndexStoreTests(SimpleTestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root, ignore_errors=True)
+
+    def store(self, quota_bytes=1024 * 1024 * 1024, **kwargs):
+        return IndexStore(self.root, quota_bytes, **kwargs)
+
+    def test_save_upload_hashes_what_it_writes(self):
+        path = os.path.join(self.root, "upload.pdf")
+        digest = save_upload(SimpleUploadedFile("a.pdf", b"%PDF-1.4 content"), path)
+        self.assertEqual(digest, hashlib.sha256(b"%PDF-1.4 content").hexdigest())
+        with open(path, "rb") as f:
+            self.assertEqual(f.read(), b"%PDF-1.4 content")
+
+    def test_round_trip(self):
+        for mmap in (True, False):
+            store = self.store(mmap=mmap, cache=IndexCache(1024 * 1024))
+            store.save("doc", make_store(CHUNKS), BM25Index.build(CHUNKS))
+            loaded = store.load("doc", CountingEmbeddings())
+            self.assertEqual(loaded.index.ntotal, len(CHUNKS))
+            self.assertEqual(store.load_lexical("doc").search("AX-200", 1)[0][0], 1)
+            self.assertIs(store.load("doc", CountingEmbeddings()), loaded)
+            store.delete("doc")
+            self.assertIsNone(store.load("doc", CountingEmbeddings()))
+
+    def test_unreadable_indexes_are_dropped_for_a_rebuild(self):
+        store = self.store()
+        for name in (DOCSTORE_FILE, INDEX_FILE):
+            store.save("doc", make_store(CHUNKS))
+            with open(os.path.join(store.path_for("doc"), name), "wb") as f:
+                f.write(b"truncated")
+            self.assertIsNone(store.load("doc", CountingEmbeddings()))
+            self.assertFalse(store.exists("doc"))
+
+    def test_garbage_collection_evicts_least_recently_used(self):
+        store = self.store(cache=IndexCache(1024 * 1024))
+        for i, name in enumerate(("old", "used", "new")):
+            store.save(name, make_store(CHUNKS))
+            os.utime(store.path_for(name), (1000 + i, 1000 + i))
+        store.load("used", CountingEmbeddings())
+        size = store.size_bytes() // 3
+        store.quota_bytes = size * 2 + size // 2
+        self.assertEqual(store.collect_garbage(), ["old"])
+        self.assertEqual(sorted(store._scan()), ["new", "used"])
+        self.assertLessEqual(store.size_bytes(), store.quota_bytes)
+
+    def test_saving_past_the_quota_keeps_the_new_index(self):
+        store = self.store(quota_bytes=1)
+        store.save("first", make_store(CHUNKS))
+        store.save("second", make_store(CHUNKS))
+        self.assertFalse(store.exists("first"))
+        self.assertTrue(store.exists("second"))
+
+    def test_uploads_get_their_own_file_in_the_upload_dir(self):
+        paths = []
+
+        def save(pdf, path):
+            paths.append(path)
+            self.assertTrue(os.path.exists(os.path.dirname(path)))
+            with open(path, "wb") as f:
+                f.write(b"%PDF")
+            return "hash"
+
+        index_store = mock.Mock()
+        index_store.load.return_value = "vectors"
+        index_store.load_lexical.return_value = "bm25"
+        upload_dir = os.path.join(self.root, "uploads")
+        with mock.patch.dict(os.environ, {"PDF_UPLOAD_DIR": upload_dir}), \
+                mock.patch("pdf_chat.views.save_upload", side_effect=save), \
+                mock.patch("pdf_chat.views._get_index_store", return_value=index_store), \
+                mock.patch("pdf_chat.views._get_embeddings"):
+            for _ in range(2):
+                self.assertEqual(pdf_views._index_upload(SimpleUploadedFile("a.pdf", b"%PDF"), "key"),
+                                 ("hash", "vectors", "bm25"))
+        self.assertNotEqual(paths[0], paths[1])
+        self.assertEqual({os.path.dirname(path) for path in paths}, {upload_dir})
+        self.assertEqual(os.listdir(upload_dir), [])
+
+
+@mock.patch.dict(os.environ, {"GEMINI_API_KEY": "key"})
+class PDFBatchViewTests(TransactionTestCase):
+    def setUp(self):
+        self.document = PDFDocument.objects.create(session_id="s", file_name="a.pdf", file_size=1, file_hash="doc",
+                                                   status=PDFDocument.STATUS_READY)
+        index_store = mock.Mock()
+        index_store.load.return_value = make_store(CHUNKS)
+        index_store.load_lexical.return_value = BM25Index.build(CHUNKS)
+        for target, value in (("_get_index_store", index_store), ("_get_embeddings", None),
+                              ("configure_genai", None)):
+            patcher = mock.patch(f"pdf_chat.views.{target}", return_value=value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def answer(self, scope, question, api_key, get_context):
+        if question == "fail":
+            raise RuntimeError("upstream down")
+        docs, _ = get_context()
+        return f"{scope}: {question} ({len(docs)} chunks)"
+
+    def post(self, **data):
+        return self.client.post("/pdf/batch/", data, content_type="application/json")
+
+    def test_questions_are_answered_and_recorded(self):
+        with mock.patch("pdf_chat.views._cached_answer", side_effect=self.answer), \
+                mock.patch("pdf_chat.views._question_context", return_value=(["c1", "c2"], None)):
+            response = self.post(document_id=self.document.pk, questions=["warranty?", "fail", "payment?"])
+        self.assertEqual(response.status_code, 200)
+        body = response.json()
+        self.assertEqual(body["document_id"], self.document.pk)
+        self.assertEqual(body["results"], [
+            {"index": 0, "question": "warranty?", "generated_text": "doc: warranty? (2 chunks)"},
+            {"index": 1, "question": "fail", "error": "upstream down"},
+            {"index": 2, "question": "payment?", "generated_text": "doc: payment? (2 chunks)"},
+        ])
+        # Recorded from the batch threads
+        queries = PDFQuery.objects.order_by("query_text")
+        self.assertEqual([(q.query_text, q.relevant_chunks_count) for q in queries],
+                         [("payment?", 2), ("warranty?", 2)])
+
+    def test_streamed_results(self):
+        with mock.patch("pdf_chat.views._cached_answer", return_value="answer"):
+            response = self.post(document_id=self.document.pk, questions=["a", "b"], stream=True)
+            body = b"".join(response.streaming_content).decode()
+        self.assertEqual(body.count("event: result"), 2)
+        self.assertIn(f'event: done\ndata: {{"count": 2, "errors": 0, "document_id": {self.document.pk}}}', body)
+
+    def test_invalid_batches(self):
+        self.assertEqual(self.post(document_id=self.document.pk, questions=[]).status_code, 400)
+        self.assertEqual(self.post(questions=["a"]).status_code, 400)
+        self.assertEqual(self.post(document_id=self.document.pk + 1, questions=["a"]).status_code, 404)
@@ -3,4 +3,12 @@ from pdf_chat import views
 
 urlpatterns = [
     path('pdf/', views.pdf_chat, name='Chat with PDF'),
+    path('pdf/async/', views.pdf_chat_async, name='pdf_chat_async'),
+    path('pdf/batch/', views.pdf_batch, name='pdf_batch'),
+    path('pdf/upload/', views.pdf_upload, name='pdf_upload'),
+    path('pdf/status/<int:document_id>/', views.pdf_status, name='pdf_status'),
+    path('pdf/query/', views.pdf_query, name='pdf_query'),
+    path('pdf/query/async/', views.pdf_query_async, name='pdf_query_async'),
+    path('pdf/library/query/', views.pdf_library_query, name='pdf_library_query'),
+    path('pdf/delete/<int:document_id>/', views.pdf_delete, name='pdf_delete'),
 ]
@@ -0,0 +1,162 @@
+import os
+import pickle
+
+import faiss
+import numpy as np
+from langchain_community.vectorstores import FAISS
+
+STORAGE_FLOAT32 = "float32"
+STORAGE_FLOAT16 = "float16"
+STORAGE_INT8 = "int8"
+STORAGE_PQ = "pq"
+STORAGE_TYPES = (STORAGE_FLOAT32, STORAGE_FLOAT16, STORAGE_INT8, STORAGE_PQ)
+
+INDEX_FILE = "index.faiss"
+DOCSTORE_FILE = "index.pkl"
+EXACT_VECTORS_FILE = "vectors.f32.npy"
+
+# Product quantization trains 256 centroids per sub-vector; below this many
+# vectors the codebooks are poor and int8 is used instead
+PQ_MIN_VECTORS = 256 * 39
+
+# Read flat-code indexes (flat, scalar quantized, PQ) straight from a read-only
+# mapping of the file, so every process shares one page-cache copy
+_MMAP_FLAGS = getattr(faiss, "IO_FLAG_MMAP_IFC", faiss.IO_FLAG_MMAP) | faiss.IO_FLAG_READ_ONLY
+
+
+def _pq_subquantizers(dim, pq_m):
+    if pq_m and dim % pq_m == 0:
+        return pq_m
+    # Default to 8 dimensions per one-byte code, the largest divisor of dim at or below that
+    for m in range(max(1, dim // 8), 0, -1):
+        if dim % m == 0:
+            return m
+    return 1
+
+
+def compress_index(vectors, storage, pq_m=0, metric=faiss.METRIC_L2):
+    """
+    Build a flat-code FAISS index holding ``vectors`` in the requested precision
+    """
+    dim = vectors.shape[1]
+    if storage == STORAGE_PQ and len(vectors) < PQ_MIN_VECTORS:
+        storage = STORAGE_INT8
+
+    if storage == STORAGE_FLOAT16:
+        index = faiss.IndexScalarQuantizer(dim, faiss.ScalarQuantizer.QT_fp16, metric)
+    elif storage == STORAGE_INT8:
+        index = faiss.IndexScalarQuantizer(dim, faiss.ScalarQuantizer.QT_8bit, metric)
+    elif storage == STORAGE_PQ:
+        index = faiss.IndexPQ(dim, _pq_subquantizers(dim, pq_m), 8, metric)
+    else:
+        index = faiss.IndexFlat(dim, metric)
+    if not index.is_trained:
+        index.train(vectors)
+    index.add(vectors)
+    return index
+
+
+def write_compressed(path, vector_store, storage, pq_m=0, keep_exact=False):
+    """
+    Replace the float32 index that ``save_local`` wrote in ``path`` with a
+    compressed one. ``keep_exact`` also keeps the float32 vectors aside for
+    exact re-scoring: the index then takes more disk than float32 alone, but
+    ``load_mapped`` maps them so only re-scored rows are read into memory.
+    """
+    if storage == STORAGE_FLOAT32:
+        return
+    index = vector_store.index
+    vectors = index.reconstruct_n(0, index.ntotal)
+    compressed = compress_index(vectors, storage, pq_m=pq_m, metric=index.metric_type)
+    faiss.write_index(compressed, os.path.join(path, INDEX_FILE))
+    if keep_exact:
+        np.save(os.path.join(path, EXACT_VECTORS_FILE), vectors)
+
+
+class MappedIndex:
+    """
+    Read-only, memory-mapped stand-in for the FAISS index of a langchain vector store.
+
+    Searches run against the (possibly compressed) mapped codes. When the float32
+    vectors are available, ``rescore_factor`` times more candidates are fetched
+    and re-ranked by their exact distance, read from a memory-mapped array so only
+    the candidate rows are ever paged in.
+    """
+
+    is_mmapped = True
+
+    def __init__(self, index, exact_vectors=None, rescore_factor=4):
+        self.index = index
+        self.exact_vectors = exact_vectors
+        self.rescore_factor = rescore_factor
+
+    @property
+    def ntotal(self):
+        return self.index.ntotal
+
+    @property
+    def d(self):
+        return self.index.d
+
+    @property
+    def metric_type(self):
+        return self.index.metric_type
+
+    def search(self, x, k, params=None):
+        x = np.ascontiguousarray(x, dtype=np.float32)
+        if self.exact_vectors is None or self.rescore_factor <= 1:
+            return self.index.search(x, k, params=params)
+
+        inner_product = self.metric_type == faiss.METRIC_INNER_PRODUCT
+        _, candidates = self.index.search(x, min(self.ntotal, k * self.rescore_factor), params=params)
+        distances = np.full((len(x), k), -np.inf if inner_product else np.inf, dtype=np.float32)
+        labels = np.full((len(x), k), -1, dtype=np.int64)
+        for row, ids in enumerate(candidates):
+            # Sorted ids read the mapped rows in file order
+            ids = np.sort(ids[ids >= 0])
+            if not len(ids):
+                continue
+            vectors = np.asarray(self.exact_vectors[ids])
+            if inner_product:
+                scores = vectors @ x[row]
+                order = np.argsort(-scores)[:k]
+            else:
+                scores = ((vectors - x[row]) ** 2).sum(axis=1)
+                order = np.argsort(scores)[:k]
+            labels[row, :len(order)] = ids[order]
+            distances[row, :len(order)] = scores[order]
+        return distances, labels
+
+    def reconstruct(self, i):
+        if self.exact_vectors is not None:
+            return np.asarray(self.exact_vectors[i])
+        return self.index.reconstruct(i)
+
+    def reconstruct_batch(self, ids):
+        if self.exact_vectors is not None:
+            return np.asarray(self.exact_vectors[np.asarray(ids)])
+        return self.index.reconstruct_batch(ids)
+
+    def reconstruct_n(self, start, n):
+        if self.exact_vectors is not None:
+            return np.asarray(self.exact_vectors[start:start + n])
+        return self.index.reconstruct_n(start, n)
+
+
+def load_mapped(path, embeddings, rescore=True, rescore_factor=4):
+    """
+    Load a stored vector store with its index memory-mapped instead of read into the heap
+    """
+    index = faiss.read_index(os.path.join(path, INDEX_FILE), _MMAP_FLAGS)
+    exact_vectors = None
+    exact_path = os.path.join(path, EXACT_VECTORS_FILE)
+    if rescore and os.path.exists(exact_path):
+        exact_vectors = np.load(exact_path, mmap_mode="r")
+    with open(os.path.join(path, DOCSTORE_FILE), "rb") as f:
+        docstore, index_to_docstore_id = pickle.load(f)
+    return FAISS(
+        embedding_function=embeddings,
+        index=MappedIndex(index, exact_vectors=exact_vectors, rescore_factor=rescore_factor),
+        docstore=docstore,
+        index_to_docstore_id=index_to_docstore_id,
+    )
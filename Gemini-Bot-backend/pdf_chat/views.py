@@ -1,15 +1,41 @@
-from langchain_text_splitters import RecursiveCharacterTextSplitter
 from langchain_google_genai import GoogleGenerativeAIEmbeddings, ChatGoogleGenerativeAI
-from langchain_community.vectorstores import FAISS
 from langchain_classic.chains.question_answering import load_qa_chain
 from langchain_core.prompts import PromptTemplate
 from decouple import config
+from django.http import JsonResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
+import functools
 import google.generativeai as genai
+import hashlib
 import os
+import time
 from rest_framework.decorators import api_view
 from rest_framework.response import Response
-import pdfplumber
-import shutil
+import threading
+import traceback
+import uuid
+
+from langchain_core.documents import Document
+
+from APIs.answer_cache import get_answer_cache
+from APIs.async_utils import aiter_values, get_executor, request_data, run_blocking
+from APIs.batch import check_items, ordered, parse_items, run_batch
+from APIs.gemini import configure_genai, langchain_client_options
+from APIs.metrics import atimed_chunks, count_context, count_tokens, observe_stage, span, timed_chunks, upstream_call
+from APIs.streaming import async_sse_response, batch_sse_response, sse_response, wants_stream
+from APIs.tokens import estimate_tokens
+from pdf_chat.bm25 import BM25Index
+from pdf_chat.context import pack_context
+from pdf_chat.corpus_index import CorpusIndex
+from pdf_chat.embedding_cache import CachedEmbeddings, EmbeddingCache
+from pdf_chat.embedding_scheduler import EmbeddingScheduler, HTTPUpstream, LangchainUpstream, ScheduledEmbeddings
+from pdf_chat.index_cache import IndexCache
+from pdf_chat.index_store import IndexStore, save_upload
+from pdf_chat.ingest import PDFTextError, build_vector_store
+from pdf_chat.jobs import IngestionWorkerPool, enqueue
+from pdf_chat.models import PDFChunk, PDFDocument, PDFQuery, PDFUpload
+from pdf_chat.retrieval import chunk_vectors, retrieve_with_vector
 
 API_KEY = config("GEMINI_API_KEY", default=None)
 # API_KEY = os.environ["GEMINI_API_KEY"]
@@ -22,6 +48,569 @@ def _get_api_key():
 def _get_pdf_chat_model_name():
     return config("GEMINI_TEXT_MODEL", default="models/gemini-2.5-flash")
 
+
+EMBEDDING_MODEL = "models/text-embedding-004"
+
+# Prompt template to ask questions to PDF
+PROMPT_TEMPLATE = '''
+                  Answer question as detailed as possible from the provided context, make sure to provide all the details.
+                  If the answer is not in provided context, just say "your question's answer is not available in the PDF provided", do not provide the wrong answer\n\n
+                  Context: \n{context}?\n
+                  Question: \n{question}\n
+
+                  Answer:
+                  '''
+# Cached answers are only reused while the prompt they were generated with is unchanged
+PROMPT_VERSION = hashlib.sha256(PROMPT_TEMPLATE.encode("utf-8")).hexdigest()[:12]
+LIBRARY_SCOPE_PREFIX = "library:"
+
+_index_store = None
+_corpus_index = None
+_corpus_index_lock = threading.Lock()
+_embedding_cache = None
+_embedding_scheduler = None
+_embedding_scheduler_lock = threading.Lock()
+_worker_pool = None
+_worker_pool_lock = threading.Lock()
+_chat_models = {}
+_chat_models_lock = threading.Lock()
+
+
+def _get_chat_model(api_key):
+    """
+    One ChatGoogleGenerativeAI per model and key, so every request reuses its
+    pooled HTTP connections (sync and async) instead of opening new ones
+    """
+    key = (_get_pdf_chat_model_name(), api_key)
+    with _chat_models_lock:
+        if key not in _chat_models:
+            _chat_models[key] = ChatGoogleGenerativeAI(model=key[0], temperature=0.5, google_api_key=api_key,
+                                                       **langchain_client_options())
+        return _chat_models[key]
+
+
+def _get_index_store():
+    global _index_store
+    if _index_store is None:
+        root = config("PDF_INDEX_DIR", default="pdf_chat/embeddings/")
+        quota_mb = config("PDF_INDEX_QUOTA_MB", default=1024, cast=int)
+        # Hot indexes stay loaded so follow-up questions skip FAISS.load_local
+        cache_mb = config("PDF_INDEX_CACHE_MB", default=256, cast=int)
+        _index_store = IndexStore(
+            root,
+            quota_mb * 1024 * 1024,
+            cache=IndexCache(cache_mb * 1024 * 1024),
+            storage=config("PDF_INDEX_STORAGE", default="float32"),
+            mmap=config("PDF_INDEX_MMAP", default=True, cast=bool),
+            rescore=config("PDF_INDEX_RESCORE", default=False, cast=bool),
+            rescore_factor=config("PDF_INDEX_RESCORE_FACTOR", default=4, cast=int),
+            pq_m=config("PDF_INDEX_PQ_M", default=0, cast=int),
+        )
+    return _index_store
+
+
+def get_corpus_index():
+    """
+    The shared index over every ingested document, or None when disabled
+    """
+    global _corpus_index
+    if not config("PDF_CORPUS_ENABLED", default=True, cast=bool):
+        return None
+    with _corpus_index_lock:
+        if _corpus_index is None:
+            _corpus_index = CorpusIndex(
+                config("PDF_CORPUS_DIR", default="pdf_chat/corpus/"),
+                index_type=config("PDF_CORPUS_INDEX_TYPE", default="flat"),
+                nlist=config("PDF_CORPUS_IVF_NLIST", default=1024, cast=int),
+                nprobe=config("PDF_CORPUS_IVF_NPROBE", default=16, cast=int),
+                hnsw_m=config("PDF_CORPUS_HNSW_M", default=32, cast=int),
+                ef_search=config("PDF_CORPUS_HNSW_EF_SEARCH", default=64, cast=int),
+                compact_ratio=config("PDF_CORPUS_COMPACT_RATIO", default=0.2, cast=float),
+            )
+        return _corpus_index
+
+
+def _get_embedding_cache():
+    global _embedding_cache
+    if _embedding_cache is None:
+        path = config("PDF_EMBEDDING_CACHE_PATH", default="pdf_chat/embedding_cache.sqlite3")
+        max_mb = config("PDF_EMBEDDING_CACHE_MAX_MB", default=512, cast=int)
+        _embedding_cache = EmbeddingCache(path, max_mb * 1024 * 1024)
+    return _embedding_cache
+
+
+def _get_embedding_scheduler(api_key):
+    global _embedding_scheduler
+    with _embedding_scheduler_lock:
+        if _embedding_scheduler is None:
+            upstream_url = config("PDF_EMBEDDING_UPSTREAM_URL", default="")
+            if upstream_url:
+                upstream = HTTPUpstream(upstream_url, EMBEDDING_MODEL, api_key=api_key)
+            else:
+                upstream = LangchainUpstream(
+                    GoogleGenerativeAIEmbeddings(google_api_key=api_key, model=EMBEDDING_MODEL,
+                                                 **langchain_client_options())
+                )
+            _embedding_scheduler = EmbeddingScheduler(
+                upstream,
+                max_batch=config("PDF_EMBEDDING_MAX_BATCH", default=100, cast=int),
+                max_wait=config("PDF_EMBEDDING_MAX_WAIT_MS", default=50, cast=int) / 1000,
+                requests_per_minute=config("PDF_EMBEDDING_RPM", default=1500, cast=int),
+                tokens_per_minute=config("PDF_EMBEDDING_TPM", default=0, cast=int),
+                concurrency=config("PDF_EMBEDDING_CONCURRENCY", default=4, cast=int),
+                max_retries=config("PDF_EMBEDDING_MAX_RETRIES", default=5, cast=int),
+            )
+        return _embedding_scheduler
+
+
+def _get_embeddings(api_key):
+    # Use text-embedding-004 which is newer and might have better availability/limits
+    embeddings = GoogleGenerativeAIEmbeddings(google_api_key=api_key, model=EMBEDDING_MODEL,
+                                                 **langchain_client_options())
+    # Document batches from every in-flight ingestion are coalesced and rate limited together
+    scheduled = ScheduledEmbeddings(_get_embedding_scheduler(api_key), embeddings)
+    # Only chunks never seen before (by any session) are sent to the API
+    return CachedEmbeddings(scheduled, _get_embedding_cache(), EMBEDDING_MODEL)
+
+
+def _build_vector_store(pdf_path, embeddings, stats=None):
+    # Pages are streamed through splitting and embedding, large documents are
+    # extracted across a process pool
+    workers = config("PDF_EXTRACT_WORKERS", default=os.cpu_count() or 1, cast=int)
+    max_pages = config("PDF_MAX_PAGES", default=0, cast=int)
+    batch_size = config("PDF_EMBEDDING_BATCH_SIZE", default=64, cast=int)
+    return build_vector_store(pdf_path, embeddings, workers=workers, max_pages=max_pages,
+                              batch_size=batch_size, stats=stats)
+
+
+def _chunk_documents(vector_store):
+    # Chunks in FAISS id order, which is also their order in the document
+    for i in range(len(vector_store.index_to_docstore_id)):
+        yield vector_store.docstore.search(vector_store.index_to_docstore_id[i])
+
+
+def _build_and_save_index(file_hash, pdf_path, embeddings, stats=None):
+    if stats is None:
+        stats = {}
+    vector_store = _build_vector_store(pdf_path, embeddings, stats=stats)
+    for stage, seconds in stats["seconds"].items():
+        observe_stage("pdf", stage, seconds)
+    # The lexical index is built once here so queries never re-tokenize the document
+    with span("pdf", "bm25_build"):
+        lexical_index = BM25Index.build(doc.page_content for doc in _chunk_documents(vector_store))
+    with span("pdf", "save_index"):
+        _get_index_store().save(file_hash, vector_store, lexical_index=lexical_index)
+    return vector_store, lexical_index
+
+
+def _retrieve(vector_store, lexical_index, prompt):
+    # Fetch more chunks than the prompt takes so MMR has room to pick diverse ones
+    with span("pdf", "retrieve"):
+        return retrieve_with_vector(
+            vector_store,
+            prompt,
+            lexical_index=lexical_index,
+            mode=config("PDF_RETRIEVAL_MODE", default="hybrid"),
+            k=config("PDF_CONTEXT_CANDIDATES", default=8, cast=int),
+            candidates=config("PDF_BM25_CANDIDATES", default=50, cast=int),
+            decisive_ratio=config("PDF_LEXICAL_DECISIVE_RATIO", default=2.0, cast=float),
+        )
+
+
+def _pack_context(prompt, docs, vectors=None, query_vector=None, max_chunks=None):
+    if max_chunks is None:
+        max_chunks = config("PDF_CONTEXT_MAX_CHUNKS", default=4, cast=int)
+    with span("pdf", "pack_context"):
+        docs, stats = pack_context(
+            prompt,
+            docs,
+            vectors=vectors,
+            query_vector=query_vector,
+            budget_tokens=config("PDF_CONTEXT_TOKEN_BUDGET", default=3000, cast=int),
+            max_chunks=max_chunks,
+            lambda_mult=config("PDF_CONTEXT_MMR_LAMBDA", default=0.5, cast=float),
+        )
+    count_context("pdf", stats["context_tokens"], stats["tokens_saved"])
+    return docs
+
+
+def _question_context(vector_store, prompt, lexical_index=None):
+    """
+    Chunks to answer ``prompt`` from and the question vector retrieval computed
+    (None when BM25 alone settled it and the question was never embedded)
+    """
+    # Perform search between user prompt and pdf uploaded: BM25 candidates
+    # re-ranked by vector similarity, or BM25 alone for decisive exact-term lookups
+    docs, query_vector = _retrieve(vector_store, lexical_index, prompt)
+    vectors = chunk_vectors(vector_store, docs) if query_vector is not None else None
+    return _pack_context(prompt, docs, vectors=vectors, query_vector=query_vector), query_vector
+
+
+def _counted_context(vector_store, prompt, lexical_index, used):
+    """
+    ``_question_context``, noting in ``used`` how many chunks the answer is given
+    """
+    docs, query_vector = _question_context(vector_store, prompt, lexical_index)
+    used["chunks"] = len(docs)
+    return docs, query_vector
+
+
+def _record_query(document, prompt, started, used, answer):
+    # Answers from the exact tier of the answer cache ran no retrieval and were given no chunks
+    PDFQuery.objects.create(
+        pdf_document=document,
+        query_text=prompt or "",
+        response_text=answer,
+        response_time_ms=int((time.perf_counter() - started) * 1000),
+        relevant_chunks_count=used.get("chunks", 0),
+    )
+
+
+def _cached_answer(scope, prompt, api_key, get_context, generate=None):
+    """
+    Answer from the answer cache when the same question was already answered for
+    ``scope``, otherwise retrieve with ``get_context`` and ``generate`` the answer
+    from the chunks (``_generate_answer`` by default). The question is only
+    embedded on an exact miss, by retrieval, whose vector then also serves the
+    semantic lookup.
+    """
+    if generate is None:
+        generate = functools.partial(_generate_answer, prompt=prompt, api_key=api_key)
+    cache = get_answer_cache()
+    if cache is None:
+        return generate(get_context()[0])
+    return cache.get_or_compute(scope, prompt, _get_pdf_chat_model_name(), PROMPT_VERSION, generate,
+                                prepare=get_context)
+
+
+def _semantic_lookup(cache, scope, prompt, model_name, retrieved):
+    """
+    Semantic-tier lookup for a streamed answer, keeping the question vector in ``retrieved`` for the later ``put``
+    """
+    def similar(vector):
+        retrieved["vector"] = vector
+        return cache.get_similar(scope, prompt, model_name, PROMPT_VERSION, vector)
+    return similar
+
+
+def _stream_cached_answer(scope, prompt, api_key, get_context, extra=None, on_answer=None):
+    """
+    Streamed counterpart of ``_cached_answer``: a cached answer is sent in one
+    event, otherwise retrieval runs inside the stream and the generated answer is
+    cached once it is complete. ``on_answer`` gets the full answer either way.
+    """
+    cache = get_answer_cache()
+    if cache is None:
+        return sse_response(_stream_answer(get_context, prompt, api_key), on_complete=on_answer, extra=extra)
+    model_name = _get_pdf_chat_model_name()
+    answer = cache.get_exact(scope, prompt, model_name, PROMPT_VERSION)
+    if answer is not None:
+        if on_answer is not None:
+            on_answer(answer)
+        return sse_response([answer], extra=extra)
+
+    retrieved = {}
+
+    def on_complete(text):
+        cache.put(scope, prompt, model_name, PROMPT_VERSION, text, vector=retrieved.get("vector"))
+        if on_answer is not None:
+            on_answer(text)
+
+    similar = _semantic_lookup(cache, scope, prompt, model_name, retrieved)
+    return sse_response(_stream_answer(get_context, prompt, api_key, similar=similar), on_complete=on_complete,
+                        extra=extra)
+
+
+def _qa_chain(api_key):
+    prompting = PromptTemplate(template=PROMPT_TEMPLATE, input_variables=["context", "question"])
+    return load_qa_chain(_get_chat_model(api_key), chain_type="stuff", prompt=prompting)
+
+
+def _count_answer_tokens(docs, prompt, answer):
+    # The QA chain does not hand back token usage, so it is estimated
+    count_tokens("pdf", estimate_tokens(_stuff_prompt(docs, prompt)), estimate_tokens(answer))
+
+
+def _generate_answer(docs, prompt, api_key):
+    chain = _qa_chain(api_key)
+
+    # Storing model answer
+    with span("pdf", "generate"), upstream_call("generate", _get_pdf_chat_model_name()):
+        response = chain({"input_documents": docs, "question": prompt}, return_only_outputs=True)
+    _count_answer_tokens(docs, prompt, response['output_text'])
+    return response['output_text']
+
+
+async def _agenerate_answer(docs, prompt, api_key):
+    with span("pdf", "generate"), upstream_call("generate", _get_pdf_chat_model_name()):
+        response = await _qa_chain(api_key).ainvoke({"input_documents": docs, "question": prompt},
+                                                    return_only_outputs=True)
+    _count_answer_tokens(docs, prompt, response['output_text'])
+    return response['output_text']
+
+
+def _stuff_prompt(docs, prompt):
+    # The prompt the "stuff" chain builds: chunk texts joined by blank lines
+    context = "\n\n".join(doc.page_content for doc in docs)
+    return PROMPT_TEMPLATE.format(context=context, question=prompt)
+
+
+def _stream_answer(get_context, prompt, api_key, similar=None):
+    # ``similar`` may answer from the semantic cache tier once retrieval has the question vector
+    docs, query_vector = get_context()
+    if similar is not None:
+        answer = similar(query_vector)
+        if answer is not None:
+            yield answer
+            return
+    parts = []
+    with upstream_call("stream", _get_pdf_chat_model_name()):
+        for chunk in timed_chunks(_get_chat_model(api_key).stream(_stuff_prompt(docs, prompt)), "pdf"):
+            parts.append(chunk.text)
+            yield chunk.text
+    _count_answer_tokens(docs, prompt, "".join(parts))
+
+
+async def _astream_answer(get_context, prompt, api_key, similar=None):
+    docs, query_vector = await run_blocking(get_context)
+    if similar is not None:
+        answer = similar(query_vector)
+        if answer is not None:
+            yield answer
+            return
+    parts = []
+    with upstream_call("stream", _get_pdf_chat_model_name()):
+        async for chunk in atimed_chunks(_get_chat_model(api_key).astream(_stuff_prompt(docs, prompt)), "pdf"):
+            parts.append(chunk.text)
+            yield chunk.text
+    _count_answer_tokens(docs, prompt, "".join(parts))
+
+
+async def _acached_answer(scope, prompt, api_key, get_context):
+    """
+    Async counterpart of ``_cached_answer``; retrieval runs on the blocking executor and concurrent identical
+    questions share one retrieval and generation, with each other and with sync requests
+    """
+    async def prepare():
+        return await run_blocking(get_context)
+
+    async def generate(docs):
+        return await _agenerate_answer(docs, prompt, api_key)
+
+    cache = get_answer_cache()
+    if cache is None:
+        docs, _ = await prepare()
+        return await generate(docs)
+    return await cache.aget_or_compute(scope, prompt, _get_pdf_chat_model_name(), PROMPT_VERSION, generate,
+                                       prepare=prepare)
+
+
+async def _astream_cached_answer(scope, prompt, api_key, get_context, extra=None, on_answer=None):
+    """
+    ``_stream_cached_answer`` for async views; ``on_answer`` runs on the blocking executor
+    """
+    def answered(text):
+        if on_answer is not None:
+            get_executor().submit(on_answer, text)
+
+    cache = get_answer_cache()
+    if cache is None:
+        return async_sse_response(_astream_answer(get_context, prompt, api_key), on_complete=answered, extra=extra)
+    model_name = _get_pdf_chat_model_name()
+    answer = cache.get_exact(scope, prompt, model_name, PROMPT_VERSION)
+    if answer is not None:
+        answered(answer)
+        return async_sse_response(aiter_values([answer]), extra=extra)
+
+    retrieved = {}
+
+    def on_complete(text):
+        cache.put(scope, prompt, model_name, PROMPT_VERSION, text, vector=retrieved.get("vector"))
+        answered(text)
+
+    similar = _semantic_lookup(cache, scope, prompt, model_name, retrieved)
+    return async_sse_response(_astream_answer(get_context, prompt, api_key, similar=similar),
+                              on_complete=on_complete, extra=extra)
+
+
+def _forget_library_answers():
+    """
+    Drop cached library answers, some of which may have been built from chunks about to be tombstoned
+    """
+    # Other processes keep theirs, but a library scope hashes the documents it was
+    # searched over, so answers involving a deleted document are no longer looked up
+    answer_cache = get_answer_cache()
+    if answer_cache is not None:
+        answer_cache.invalidate_prefix(LIBRARY_SCOPE_PREFIX)
+
+
+def _index_chunks(document, vector_store):
+    """
+    Record the document's chunks as PDFChunk rows and add their vectors to the
+    corpus index, replacing whatever an earlier ingestion left behind
+    """
+    corpus_index = get_corpus_index()
+    old_chunks = PDFChunk.objects.filter(pdf_document=document)
+    if corpus_index is not None and old_chunks.exists():
+        _forget_library_answers()
+        corpus_index.delete(int(vector_id) for vector_id in
+                            old_chunks.exclude(embedding_vector_id=None).values_list('embedding_vector_id', flat=True))
+    old_chunks.delete()
+
+    ntotal = vector_store.index.ntotal
+    if corpus_index is not None:
+        vector_ids = corpus_index.add(vector_store.index.reconstruct_n(0, ntotal))
+    else:
+        vector_ids = list(range(ntotal))
+
+    PDFChunk.objects.bulk_create(
+        (
+            PDFChunk(
+                pdf_document=document,
+                chunk_index=i,
+                text_content=doc.page_content,
+                chunk_size=len(doc.page_content),
+                page_numbers=",".join(str(page) for page in doc.metadata.get("pages", [])),
+                embedding_vector_id=str(vector_id),
+            )
+            for i, (doc, vector_id) in enumerate(zip(_chunk_documents(vector_store), vector_ids))
+        ),
+        batch_size=500,
+    )
+
+
+def ingest_document(document):
+    """
+    Ingestion job handler: build and store the index for a queued PDFDocument.
+    Returns the document fields to update once it is ready.
+    """
+    api_key = _get_api_key()
+    if not api_key:
+        raise ValueError("GEMINI_API_KEY not configured")
+    configure_genai(api_key)
+
+    index_store = _get_index_store()
+    embeddings = _get_embeddings(api_key)
+    fields = {
+        "embedding_index_path": index_store.path_for(document.file_hash),
+        "source_path": None,
+    }
+    vector_store = index_store.load(document.file_hash, embeddings)
+    if vector_store is None:
+        stats = {}
+        vector_store, _ = _build_and_save_index(document.file_hash, document.source_path, embeddings, stats=stats)
+        fields.update(page_count=stats["pages"], text_content_length=stats["characters"])
+        _index_chunks(document, vector_store)
+    elif not PDFChunk.objects.filter(pdf_document=document).exists():
+        # Indexed earlier through /pdf/ without a PDFDocument
+        _index_chunks(document, vector_store)
+
+    if document.source_path and os.path.exists(document.source_path):
+        os.remove(document.source_path)
+    return fields
+
+
+def delete_corpus_vectors(document):
+    """
+    Tombstone the document's vectors in the corpus index
+    """
+    corpus_index = get_corpus_index()
+    if corpus_index is None:
+        return
+    _forget_library_answers()
+    vector_ids = PDFChunk.objects.filter(pdf_document=document).exclude(embedding_vector_id=None) \
+        .values_list('embedding_vector_id', flat=True)
+    corpus_index.delete(int(vector_id) for vector_id in vector_ids)
+
+
+def _maintain_corpus():
+    # Runs after ingestion jobs and every PDF_CORPUS_MAINTENANCE_SECONDS: fold tombstones back out of the corpus index
+    corpus_index = get_corpus_index()
+    if corpus_index is not None and corpus_index.needs_compaction():
+        corpus_index.compact()
+
+
+def get_worker_pool():
+    global _worker_pool
+    with _worker_pool_lock:
+        if _worker_pool is None:
+            _worker_pool = IngestionWorkerPool(
+                ingest_document,
+                workers=config("PDF_INGEST_WORKERS", default=2, cast=int),
+                poll_interval=config("PDF_INGEST_POLL_SECONDS", default=2.0, cast=float),
+                job_timeout=config("PDF_INGEST_JOB_TIMEOUT", default=900, cast=int),
+                maintenance=_maintain_corpus,
+                maintenance_interval=config("PDF_CORPUS_MAINTENANCE_SECONDS", default=60.0, cast=float),
+            )
+        return _worker_pool
+
+
+def start_worker_pool(notify=False):
+    """
+    Start this process's ingestion workers if they are not running yet; ``notify`` wakes them for a new job
+    """
+    # Web processes run the ingestion workers themselves unless a dedicated
+    # `manage.py process_pdf_jobs` process has been set up instead
+    if not config("PDF_INGEST_IN_PROCESS", default=True, cast=bool):
+        return
+    pool = get_worker_pool()
+    pool.ensure_started()
+    if notify:
+        pool.notify()
+
+
+def _record_upload(document, session_id):
+    # Adds the document to the session's library for corpus-wide search
+    if session_id:
+        PDFUpload.objects.get_or_create(pdf_document=document, session_id=session_id)
+
+
+def _document_status(document):
+    return {
+        "document_id": document.pk,
+        "file_hash": document.file_hash,
+        "status": document.status,
+        "error": document.error_message,
+    }
+
+
+
+def _upload_dir():
+    # Uploaded PDFs wait here until they are indexed
+    path = config("PDF_UPLOAD_DIR", default="pdf_chat/pdfs/")
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def _index_upload(pdf, api_key):
+    """
+    Index an uploaded PDF for the legacy /pdf/ endpoint, or load its stored index.
+    Returns (file hash, vector store, BM25 index).
+    """
+    # Save PDF to temp file for safe processing, hashing it on the way; a name of
+    # its own, so concurrent uploads (even from one session) never share a file
+    pdf_path = os.path.join(_upload_dir(), f"{uuid.uuid4().hex}.pdf")
+    with span("pdf", "save_upload"):
+        file_hash = save_upload(pdf, pdf_path)
+
+    # Create Vector Embedding of text
+    embeddings = _get_embeddings(api_key)
+
+    # Reuse the stored index when this document was already processed
+    index_store = _get_index_store()
+    try:
+        with span("pdf", "load_index"):
+            vector_store = index_store.load(file_hash, embeddings)
+            lexical_index = index_store.load_lexical(file_hash)
+        if vector_store is None:
+            vector_store, lexical_index = _build_and_save_index(file_hash, pdf_path, embeddings)
+    finally:
+        # Clean up PDF file
+        if os.path.exists(pdf_path):
+            os.remove(pdf_path)
+    return file_hash, vector_store, lexical_index
+
+
 @api_view(['POST'])
 def pdf_chat(request):
     if request.method == 'POST':
@@ -30,85 +619,410 @@ def pdf_chat(request):
             if not api_key:
                 return Response({"generated_text": "GEMINI_API_KEY not configured"}, status=500)
 
-            genai.configure(api_key=api_key)
-            session_id = request.data.get('session_id')
+            configure_genai(api_key)
             pdf = request.data.get('pdf')
             prompt = request.data.get('prompt')
 
             if not pdf:
                 return Response({"generated_text": "No PDF uploaded"}, status=400)
 
-            # Save PDF to temp file for safe processing
-            os.makedirs('pdf_chat/pdfs/', exist_ok=True)
-            pdf_path = f"pdf_chat/pdfs/{session_id}.pdf"
-            with open(pdf_path, 'wb') as f:
-                for chunk in pdf.chunks():
-                    f.write(chunk)
-
-            text = ""
-            # Parsing PDF and saving text
-            with pdfplumber.open(pdf_path) as pd:
-                for page_number in range(len(pd.pages)):
-                    page = pd.pages[page_number]
-                    if page:
-                        extracted = page.extract_text()
-                        if extracted:
-                            text += extracted
-            
-            # Clean up PDF file
-            if os.path.exists(pdf_path):
-                os.remove(pdf_path)
-
-            if not text:
-                return Response({"generated_text": "Could not extract text from the PDF."}, status=400)
-
-            # Splitting the text extracted from text got from PDF
-            text_splitter = RecursiveCharacterTextSplitter(chunk_size=10000, chunk_overlap=1000)
-            text_chunks = text_splitter.split_text(text)
-
-            if not text_chunks:
-                return Response({"generated_text": "PDF text is empty after splitting."}, status=400)
-
-            # Create Vector Embedding of text
-            # Use text-embedding-004 which is newer and might have better availability/limits
-            embeddings = GoogleGenerativeAIEmbeddings(google_api_key=api_key, model="models/text-embedding-004")
-            vector_store = FAISS.from_texts(text_chunks, embedding=embeddings)
-
-            # Store embeddings locally
-            os.makedirs('pdf_chat/embeddings/', exist_ok=True)
-            vector_store.save_local(f'pdf_chat/embeddings/{session_id}_index')
-
-            # Load saved embeddings
-            user_embeddings = FAISS.load_local(f'pdf_chat/embeddings/{session_id}_index', embeddings, allow_dangerous_deserialization=True)
-
-            # Perform similarity search between user prompt and pdf uploaded
-            docs = user_embeddings.similarity_search(prompt)
-
-            # Prompt template to ask questions to PDF
-            prompt_template = '''
-                              Answer question as detailed as possible from the provided context, make sure to provide all the details.
-                              If the answer is not in provided context, just say "your question's answer is not available in the PDF provided", do not provide the wrong answer\n\n
-                              Context: \n{context}?\n
-                              Question: \n{question}\n
-
-                              Answer:
-                              '''
-            
-            # Langchain model declaration
-            model = ChatGoogleGenerativeAI(model=_get_pdf_chat_model_name(), temperature=0.5, google_api_key=api_key)
-            prompting = PromptTemplate(template=prompt_template, input_variables=["context", "question"])
-            chain = load_qa_chain(model, chain_type="stuff", prompt=prompting)
-            
-            # Storing model answer
-            response = chain({"input_documents": docs, "question": prompt}, return_only_outputs=True)
-
-            # Delete embeddings after QA
-            shutil.rmtree(f'pdf_chat/embeddings/{session_id}_index', ignore_errors=True)
-
-            return Response({"generated_text": response['output_text']})
+            try:
+                file_hash, user_embeddings, lexical_index = _index_upload(pdf, api_key)
+            except PDFTextError as e:
+                return Response({"generated_text": str(e)}, status=400)
+
+            get_context = functools.partial(_question_context, user_embeddings, prompt, lexical_index)
+            if wants_stream(request):
+                return _stream_cached_answer(file_hash, prompt, api_key, get_context)
+            answer = _cached_answer(file_hash, prompt, api_key, get_context)
+            return Response({"generated_text": answer})
         
         except Exception as e:
             print(f"Error in pdf_chat: {e}")
-            import traceback
             traceback.print_exc()
             return Response({"generated_text": f"An error occurred: {str(e)}"}, status=200)
+
+
+@api_view(['POST'])
+def pdf_upload(request):
+    """
+    Accept a PDF and queue it for ingestion, returning its document id right away
+    """
+    try:
+        session_id = request.data.get('session_id')
+        pdf = request.data.get('pdf')
+
+        if not pdf:
+            return Response({"generated_text": "No PDF uploaded"}, status=400)
+
+        upload_dir = _upload_dir()
+        upload_path = os.path.join(upload_dir, f"{uuid.uuid4().hex}.part")
+        file_hash = save_upload(pdf, upload_path)
+
+        document = PDFDocument.objects.filter(file_hash=file_hash).first()
+        if document is not None and (
+            document.status in (PDFDocument.STATUS_QUEUED, PDFDocument.STATUS_PROCESSING)
+            or (document.status == PDFDocument.STATUS_READY and _get_index_store().exists(file_hash))
+        ):
+            # Already ingested or on its way, the new copy is not needed
+            os.remove(upload_path)
+            _record_upload(document, session_id)
+            return Response(_document_status(document), status=200 if document.status == PDFDocument.STATUS_READY else 202)
+
+        source_path = os.path.join(upload_dir, f"{file_hash}.pdf")
+        os.replace(upload_path, source_path)
+
+        if document is None:
+            document, created = PDFDocument.objects.get_or_create(
+                file_hash=file_hash,
+                defaults={
+                    "session_id": session_id or "",
+                    "file_name": os.path.basename(pdf.name),
+                    "original_filename": pdf.name,
+                    "file_size": pdf.size,
+                    "embedding_index_path": _get_index_store().path_for(file_hash),
+                    "source_path": source_path,
+                    "upload_ip": request.META.get("REMOTE_ADDR"),
+                },
+            )
+        else:
+            # Failed before or its index was evicted from disk: ingest it again
+            PDFDocument.objects.filter(pk=document.pk).update(source_path=source_path)
+            enqueue(document)
+
+        _record_upload(document, session_id)
+        start_worker_pool(notify=True)
+        return Response(_document_status(document), status=202)
+
+    except Exception as e:
+        print(f"Error in pdf_upload: {e}")
+        traceback.print_exc()
+        return Response({"generated_text": f"An error occurred: {str(e)}"}, status=500)
+
+
+@api_view(['GET'])
+def pdf_status(request, document_id):
+    document = PDFDocument.objects.filter(pk=document_id).first()
+    if document is None:
+        return Response({"generated_text": "Document not found"}, status=404)
+    if document.status in (PDFDocument.STATUS_QUEUED, PDFDocument.STATUS_PROCESSING):
+        # In case this process was started some way apps.ready() does not recognize
+        start_worker_pool()
+    return Response(_document_status(document))
+
+
+def _load_query_target(document_id, api_key):
+    """
+    Load a ready document and its indexes for a query. Returns (document, vector
+    store, BM25 index, error) where error is a (body, status) pair or None.
+    """
+    document = PDFDocument.objects.filter(pk=document_id).first() if document_id else None
+    if document is None:
+        return None, None, None, ({"generated_text": "Document not found"}, 404)
+    if document.status != PDFDocument.STATUS_READY:
+        start_worker_pool()
+        return None, None, None, ({"generated_text": "Document is not ready yet.", **_document_status(document)}, 409)
+
+    index_store = _get_index_store()
+    with span("pdf", "load_index"):
+        vector_store = index_store.load(document.file_hash, _get_embeddings(api_key))
+        lexical_index = index_store.load_lexical(document.file_hash) if vector_store is not None else None
+    if vector_store is None:
+        PDFDocument.objects.filter(pk=document.pk).update(
+            status=PDFDocument.STATUS_FAILED,
+            error_message="Index expired, please upload the PDF again.",
+        )
+        return None, None, None, ({"generated_text": "Index expired, please upload the PDF again."}, 410)
+    return document, vector_store, lexical_index, None
+
+
+@api_view(['POST'])
+def pdf_query(request):
+    """
+    Answer a question about an already ingested document: retrieval and generation only
+    """
+    started = time.perf_counter()
+    try:
+        api_key = _get_api_key()
+        if not api_key:
+            return Response({"generated_text": "GEMINI_API_KEY not configured"}, status=500)
+
+        configure_genai(api_key)
+        document_id = request.data.get('document_id')
+        prompt = request.data.get('prompt')
+
+        document, vector_store, lexical_index, error = _load_query_target(document_id, api_key)
+        if error is not None:
+            return Response(*error)
+
+        used = {}
+        get_context = functools.partial(_counted_context, vector_store, prompt, lexical_index, used)
+        record = functools.partial(_record_query, document, prompt, started, used)
+        if wants_stream(request):
+            return _stream_cached_answer(document.file_hash, prompt, api_key, get_context,
+                                         extra={"document_id": document.pk}, on_answer=record)
+        answer = _cached_answer(document.file_hash, prompt, api_key, get_context)
+        record(answer)
+        return Response({"generated_text": answer, "document_id": document.pk})
+
+    except Exception as e:
+        print(f"Error in pdf_query: {e}")
+        traceback.print_exc()
+        return Response({"generated_text": f"An error occurred: {str(e)}"}, status=200)
+
+
+def _embed_questions(vector_store, questions):
+    # One embedding request for the whole batch; retrieval then finds every
+    # question's vector in the query embedding cache
+    embed_queries = getattr(vector_store.embedding_function, "embed_queries", None)
+    if embed_queries is None:
+        return
+    try:
+        embed_queries(questions)
+    except Exception as e:
+        # Each question embeds itself during retrieval instead
+        print(f"Batch question embedding failed: {e}")
+
+
+@api_view(['POST'])
+def pdf_batch(request):
+    """
+    Answer a list of questions about one PDF, uploaded with the request or
+    already ingested (``document_id``). The document is indexed or loaded once,
+    the questions are embedded in one request and answered concurrently.
+    """
+    try:
+        api_key = _get_api_key()
+        if not api_key:
+            return Response({"generated_text": "GEMINI_API_KEY not configured"}, status=500)
+
+        configure_genai(api_key)
+        questions = parse_items(request.data, 'questions')
+        error = check_items(questions, 'questions')
+        if error is not None:
+            return Response({"generated_text": error}, status=400)
+
+        pdf = request.data.get('pdf')
+        document_id = request.data.get('document_id')
+        document = None
+        extra = {}
+        if pdf:
+            try:
+                scope, vector_store, lexical_index = _index_upload(pdf, api_key)
+            except PDFTextError as e:
+                return Response({"generated_text": str(e)}, status=400)
+        elif document_id:
+            document, vector_store, lexical_index, error = _load_query_target(document_id, api_key)
+            if error is not None:
+                return Response(*error)
+            scope = document.file_hash
+            extra["document_id"] = document.pk
+        else:
+            return Response({"generated_text": "No PDF uploaded"}, status=400)
+
+        _embed_questions(vector_store, questions)
+
+        def answer(question):
+            started = time.perf_counter()
+            used = {}
+            text = _cached_answer(scope, question, api_key,
+                                  functools.partial(_counted_context, vector_store, question, lexical_index, used))
+            if document is not None:
+                _record_query(document, question, started, used, text)
+            return text
+
+        results = run_batch(questions, answer, config("PDF_BATCH_CONCURRENCY", default=4, cast=int),
+                            key="question")
+        if wants_stream(request):
+            return batch_sse_response(results, extra=extra)
+        return Response({"results": ordered(results), **extra})
+
+    except Exception as e:
+        print(f"Error in pdf_batch: {e}")
+        traceback.print_exc()
+        return Response({"generated_text": f"An error occurred: {str(e)}"}, status=500)
+
+
+@csrf_exempt
+@require_POST
+async def pdf_chat_async(request):
+    """
+    ``pdf_chat`` for ASGI: PDF parsing, embedding and FAISS run on the blocking
+    executor, the answer is generated with the async Gemini client
+    """
+    try:
+        api_key = _get_api_key()
+        if not api_key:
+            return JsonResponse({"generated_text": "GEMINI_API_KEY not configured"}, status=500)
+
+        data = request_data(request)
+        pdf = data.get('pdf')
+        prompt = data.get('prompt')
+
+        if not pdf:
+            return JsonResponse({"generated_text": "No PDF uploaded"}, status=400)
+
+        try:
+            file_hash, vector_store, lexical_index = await run_blocking(_index_upload, pdf, api_key)
+        except PDFTextError as e:
+            return JsonResponse({"generated_text": str(e)}, status=400)
+
+        get_context = functools.partial(_question_context, vector_store, prompt, lexical_index)
+        if wants_stream(request, data):
+            return await _astream_cached_answer(file_hash, prompt, api_key, get_context)
+        answer = await _acached_answer(file_hash, prompt, api_key, get_context)
+        return JsonResponse({"generated_text": answer})
+
+    except Exception as e:
+        print(f"Error in pdf_chat_async: {e}")
+        traceback.print_exc()
+        return JsonResponse({"generated_text": f"An error occurred: {str(e)}"}, status=200)
+
+
+@csrf_exempt
+@require_POST
+async def pdf_query_async(request):
+    """
+    ``pdf_query`` for ASGI
+    """
+    started = time.perf_counter()
+    try:
+        api_key = _get_api_key()
+        if not api_key:
+            return JsonResponse({"generated_text": "GEMINI_API_KEY not configured"}, status=500)
+
+        data = request_data(request)
+        prompt = data.get('prompt')
+
+        document, vector_store, lexical_index, error = await run_blocking(
+            _load_query_target, data.get('document_id'), api_key
+        )
+        if error is not None:
+            return JsonResponse(error[0], status=error[1])
+
+        used = {}
+        get_context = functools.partial(_counted_context, vector_store, prompt, lexical_index, used)
+        record = functools.partial(_record_query, document, prompt, started, used)
+        if wants_stream(request, data):
+            return await _astream_cached_answer(document.file_hash, prompt, api_key, get_context,
+                                                extra={"document_id": document.pk}, on_answer=record)
+        answer = await _acached_answer(document.file_hash, prompt, api_key, get_context)
+        await run_blocking(record, answer)
+        return JsonResponse({"generated_text": answer, "document_id": document.pk})
+
+    except Exception as e:
+        print(f"Error in pdf_query_async: {e}")
+        traceback.print_exc()
+        return JsonResponse({"generated_text": f"An error occurred: {str(e)}"}, status=200)
+
+
+def _parse_ids(value):
+    if value is None:
+        return []
+    if isinstance(value, str):
+        value = value.split(",")
+    return [int(v) for v in value if str(v).strip()]
+
+
+@api_view(['POST'])
+def pdf_library_query(request):
+    """
+    Answer a question from the whole document library of a session, or from a
+    chosen set of documents, using the shared corpus index
+    """
+    try:
+        api_key = _get_api_key()
+        if not api_key:
+            return Response({"generated_text": "GEMINI_API_KEY not configured"}, status=500)
+
+        corpus_index = get_corpus_index()
+        if corpus_index is None:
+            return Response({"generated_text": "Library search is disabled."}, status=404)
+
+        configure_genai(api_key)
+        session_id = request.data.get('session_id')
+        prompt = request.data.get('prompt')
+        try:
+            document_ids = _parse_ids(request.data.get('document_ids'))
+        except ValueError:
+            return Response({"generated_text": "document_ids must be integers"}, status=400)
+
+        documents = PDFDocument.objects.filter(status=PDFDocument.STATUS_READY)
+        if session_id:
+            documents = documents.filter(uploads__session_id=session_id)
+        if document_ids:
+            documents = documents.filter(pk__in=document_ids)
+        if not session_id and not document_ids:
+            return Response({"generated_text": "session_id or document_ids is required"}, status=400)
+
+        chunks = PDFChunk.objects.filter(pdf_document__in=documents).exclude(embedding_vector_id=None)
+        allowed_ids = [int(vector_id) for vector_id in chunks.values_list('embedding_vector_id', flat=True)]
+        if not allowed_ids:
+            return Response({"generated_text": "No ingested documents to search."}, status=404)
+
+        # Library answers depend on exactly which documents were searched
+        file_hashes = sorted(set(chunks.values_list('pdf_document__file_hash', flat=True)))
+        scope = LIBRARY_SCOPE_PREFIX + hashlib.sha256(",".join(file_hashes).encode("utf-8")).hexdigest()
+
+        def library_context():
+            with span("pdf", "embed_question"):
+                query_vector = _get_embeddings(api_key).embed_query(prompt)
+            with span("pdf", "retrieve"):
+                hits = corpus_index.search(query_vector, k=config("PDF_CONTEXT_CANDIDATES", default=8, cast=int),
+                                           allowed_ids=allowed_ids)
+
+            # Map FAISS ids back to their chunks through PDFChunk.embedding_vector_id
+            by_vector_id = {
+                chunk.embedding_vector_id: chunk
+                for chunk in chunks.filter(embedding_vector_id__in=[str(vector_id) for vector_id, _ in hits])
+                .select_related('pdf_document')
+            }
+            docs = []
+            for vector_id, _ in hits:
+                chunk = by_vector_id.get(str(vector_id))
+                if chunk is None:
+                    continue
+                docs.append(Document(
+                    page_content=chunk.text_content,
+                    metadata={
+                        "document_id": chunk.pdf_document_id,
+                        "file_name": chunk.pdf_document.file_name,
+                        "chunk_index": chunk.chunk_index,
+                        "pages": chunk.page_numbers,
+                    },
+                ))
+            vectors = corpus_index.reconstruct(vector_id for vector_id, _ in hits
+                                               if str(vector_id) in by_vector_id)
+            docs = _pack_context(prompt, docs, vectors=vectors, query_vector=query_vector,
+                                 max_chunks=config("PDF_LIBRARY_TOP_K", default=4, cast=int))
+            return docs, query_vector
+
+        def answer_from_library(docs):
+            return {
+                "generated_text": _generate_answer(docs, prompt, api_key),
+                "sources": [doc.metadata for doc in docs],
+            }
+
+        return Response(_cached_answer(scope, prompt, api_key, library_context, answer_from_library))
+
+    except Exception as e:
+        print(f"Error in pdf_library_query: {e}")
+        traceback.print_exc()
+        return Response({"generated_text": f"An error occurred: {str(e)}"}, status=200)
+
+
+@api_view(['POST'])
+def pdf_delete(request, document_id):
+    """
+    Delete a document: its vectors are tombstoned in the corpus index and its stored index removed
+    """
+    document = PDFDocument.objects.filter(pk=document_id).first()
+    if document is None:
+        return Response({"generated_text": "Document not found"}, status=404)
+    # Corpus vectors are tombstoned by the pre_delete signal
+    document.delete()
+    _get_index_store().delete(document.file_hash)
+    answer_cache = get_answer_cache()
+    if answer_cache is not None:
+        answer_cache.invalidate_scope(document.file_hash)
+    return Response({"document_id": document_id, "deleted": True})
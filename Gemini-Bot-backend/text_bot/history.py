@@ -0,0 +1,185 @@
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+import google.generativeai as genai
+
+from APIs.tokens import estimate_content_tokens, estimate_tokens
+
+# The running summary is kept as the first exchange of the stored history
+SUMMARY_PREFIX = "Summary of the conversation so far:\n"
+SUMMARY_ACK = "Understood, I will continue from there."
+
+SUMMARY_PROMPT = """Summarize the conversation below for an assistant that will continue it.
+Keep names, numbers, decisions, preferences and open questions; drop small talk.
+Use at most {words} words.
+
+{previous}Conversation:
+{transcript}
+"""
+
+_summarizer = None
+_summarizer_lock = threading.Lock()
+_pending = set()
+# Serializes read-modify-write of stored histories between replies and summaries
+_store_lock = threading.Lock()
+
+
+def _text(content):
+    # User turns stored before system instructions carry [system prompt, message]
+    return content.parts[-1].text if content.parts else ""
+
+
+def is_summary(history):
+    return len(history) >= 2 and history[0].role == "user" and bool(history[0].parts) \
+        and history[0].parts[0].text.startswith(SUMMARY_PREFIX)
+
+
+def summary_exchange(summary):
+    return [
+        genai.protos.Content(role="user", parts=[genai.protos.Part(text=SUMMARY_PREFIX + summary)]),
+        genai.protos.Content(role="model", parts=[genai.protos.Part(text=SUMMARY_ACK)]),
+    ]
+
+
+def _turns(history):
+    """
+    Split a history into its summary exchange (possibly empty) and user/model turns
+    """
+    head = list(history[:2]) if is_summary(history) else []
+    rest = list(history[len(head):])
+    return head, [rest[i:i + 2] for i in range(0, len(rest), 2)]
+
+
+def _tokens(contents):
+    return sum(estimate_content_tokens(content) for content in contents)
+
+
+class HistoryPolicy:
+    """
+    What part of a stored conversation is sent with the next message.
+
+    The prompt gets the running summary plus the most recent turns verbatim:
+    at least ``keep_turns`` of them, at most ``keep_turns + summary_batch``
+    while older turns wait to be folded into the summary. Oldest turns, and
+    then the summary itself, are cut until the estimated size is within
+    ``max_tokens``. Once ``summary_batch`` turns have fallen outside the
+    window they are summarized in the background, so a reply never waits on it.
+    """
+
+    def __init__(self, keep_turns=6, max_tokens=8000, summary_batch=4, summary_words=250, summarize=True):
+        self.keep_turns = keep_turns
+        self.max_tokens = max_tokens
+        self.summary_batch = summary_batch
+        self.summary_words = summary_words
+        self.summarize_enabled = summarize
+
+    def window(self, history, reserve_tokens=0):
+        """
+        Messages to start the chat with, leaving ``reserve_tokens`` for the new message
+        """
+        head, turns = _turns(history)
+        turns = turns[-(self.keep_turns + self.summary_batch):]
+        budget = self.max_tokens - reserve_tokens
+
+        kept = []
+        used = _tokens(head)
+        for turn in reversed(turns):
+            cost = _tokens(turn)
+            if used + cost > budget:
+                break
+            kept.insert(0, turn)
+            used += cost
+
+        if head and used > budget:
+            head = self._shrink_summary(head, budget - _tokens(head[1:]))
+        return head + [content for turn in kept for content in turn]
+
+    def _shrink_summary(self, head, budget):
+        text = _text(head[0])[len(SUMMARY_PREFIX):]
+        keep = max(0, (budget - estimate_tokens(SUMMARY_PREFIX) - 8) * 4)
+        if keep <= 0:
+            return []
+        # Keep the end of the summary, where the most recent context is
+        return summary_exchange(text[-keep:]) if keep < len(text) else head
+
+    def needs_summary(self, history):
+        if not self.summarize_enabled:
+            return False
+        _, turns = _turns(history)
+        return len(turns) >= self.keep_turns + self.summary_batch
+
+    def summarize(self, model, history):
+        """
+        Fold every turn but the last ``keep_turns`` into the summary.
+        Returns the number of stored messages replaced and the messages replacing them.
+        """
+        head, turns = _turns(history)
+        folded = turns[:len(turns) - self.keep_turns]
+        if not folded:
+            return 0, head
+        previous = ""
+        if head:
+            previous = f"Summary so far:\n{_text(head[0])[len(SUMMARY_PREFIX):]}\n\n"
+        transcript = "\n".join(
+            f"{'User' if content.role == 'user' else 'Assistant'}: {_text(content)}"
+            for turn in folded for content in turn
+        )
+        prompt = SUMMARY_PROMPT.format(words=self.summary_words, previous=previous, transcript=transcript)
+        summary = model.generate_content(prompt).text.strip()
+        return len(head) + 2 * len(folded), summary_exchange(summary)
+
+
+def append_exchange(store, session_id, history, exchange):
+    """
+    Append a new exchange to the stored history of a session and return what was stored.
+
+    ``history`` is the copy the reply was generated from. The exchange goes after
+    the copy in the store instead when there is one, so a summary written by the
+    background summarizer while the reply was generated is kept.
+    """
+    with _store_lock:
+        current = store.get(session_id)
+        history = (current or history) + list(exchange)
+        store.set(session_id, history)
+    return history
+
+
+def _get_summarizer():
+    global _summarizer
+    with _summarizer_lock:
+        if _summarizer is None:
+            _summarizer = ThreadPoolExecutor(max_workers=2, thread_name_prefix="summary")
+        return _summarizer
+
+
+def _summarize_session(store, session_id, model, policy, history):
+    try:
+        replaced, summary = policy.summarize(model, history)
+        if not replaced:
+            return
+        with _store_lock:
+            current = store.get(session_id)
+            # A turn may have been committed meanwhile: only rewrite the part that was summarized
+            if current[:replaced] != history[:replaced]:
+                return
+            store.set(session_id, summary + current[replaced:])
+    except Exception as e:
+        print(f"Error while summarizing session {session_id}: {e}")
+        traceback.print_exc()
+    finally:
+        with _summarizer_lock:
+            _pending.discard(session_id)
+
+
+def schedule_summary(store, session_id, model, policy, history):
+    """
+    Summarize the older turns of a session in the background when enough have piled up
+    """
+    if not policy.needs_summary(history):
+        return
+    with _summarizer_lock:
+        if session_id in _pending:
+            return
+        _pending.add(session_id)
+    _get_summarizer().submit(_summarize_session, store, session_id, model, policy, history)
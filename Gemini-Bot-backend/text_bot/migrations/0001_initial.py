@@ -0,0 +1,71 @@
+# Generated by Django 5.2.18 on 2026-10-18 20:27
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TextDocument',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('session_id', models.CharField(db_index=True, max_length=255, unique=True)),
+                ('file_name', models.CharField(max_length=500)),
+                ('file_size', models.IntegerField()),
+                ('file_hash', models.CharField(max_length=64, unique=True)),
+                ('content_length', models.IntegerField()),
+                ('line_count', models.IntegerField(default=0)),
+                ('word_count', models.IntegerField(default=0)),
+                ('mime_type', models.CharField(default='text/plain', max_length=50)),
+                ('encoding', models.CharField(default='utf-8', max_length=20)),
+                ('created_at', models.DateTimeField(auto_now_add=True, db_index=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('original_filename', models.CharField(blank=True, max_length=500, null=True)),
+                ('upload_ip', models.GenericIPAddressField(blank=True, null=True)),
+                ('description', models.TextField(blank=True, null=True)),
+            ],
+            options={
+                'ordering': ['-created_at'],
+                'indexes': [models.Index(fields=['-created_at'], name='text_bot_te_created_108558_idx'), models.Index(fields=['session_id'], name='text_bot_te_session_047da1_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='TextQuery',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('query_text', models.TextField()),
+                ('response_text', models.TextField()),
+                ('response_time_ms', models.IntegerField(blank=True, null=True)),
+                ('relevant_chunks_count', models.IntegerField()),
+                ('created_at', models.DateTimeField(auto_now_add=True, db_index=True)),
+                ('text_document', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='queries', to='text_bot.textdocument')),
+            ],
+            options={
+                'ordering': ['-created_at'],
+            },
+        ),
+        migrations.CreateModel(
+            name='TextChunk',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('chunk_index', models.IntegerField()),
+                ('text_content', models.TextField()),
+                ('chunk_size', models.IntegerField()),
+                ('line_range', models.CharField(help_text="e.g., '1-50'", max_length=100)),
+                ('embedding_vector_id', models.CharField(blank=True, max_length=255, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('text_document', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='chunks', to='text_bot.textdocument')),
+            ],
+            options={
+                'ordering': ['text_document', 'chunk_index'],
+                'indexes': [models.Index(fields=['text_document', 'chunk_index'], name='text_bot_te_text_do_36dc47_idx')],
+            },
+        ),
+    ]
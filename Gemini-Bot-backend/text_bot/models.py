@@ -57,9 +57,10 @@ class TextChunk(models.Model):
 
 class TextQuery(models.Model):
     """
-    Model to store queries made against text documents for analytics
+    Model to store chat queries, and queries made against text documents, for analytics
     """
-    text_document = models.ForeignKey(TextDocument, on_delete=models.CASCADE, related_name='queries')
+    text_document = models.ForeignKey(TextDocument, on_delete=models.CASCADE, related_name='queries',
+                                      null=True, blank=True)  # None for plain chat
     query_text = models.TextField()
     response_text = models.TextField()
     response_time_ms = models.IntegerField(null=True, blank=True)
@@ -70,4 +71,6 @@ class TextQuery(models.Model):
         ordering = ['-created_at']
     
     def __str__(self):
+        if self.text_document is None:
+            return "Chat query"
         return f"Query on {self.text_document.file_name}"
@@ -0,0 +1,212 @@
+import sqlite3
+import threading
+import time
+import zlib
+from collections import OrderedDict
+
+import google.generativeai as genai
+
+from text_bot.history import is_summary
+
+BACKEND_MEMORY = "memory"
+BACKEND_SQLITE = "sqlite"
+
+# Histories at least this large are stored zlib-compressed
+COMPRESS_MIN_BYTES = 512
+_RAW = b"\x00"
+_ZLIB = b"\x01"
+
+# Puts between two eviction passes of the SQLite store
+_EVICT_EVERY = 64
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    session_id TEXT PRIMARY KEY,
+    history BLOB NOT NULL,
+    nbytes INTEGER NOT NULL,
+    last_used REAL NOT NULL
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS sessions_last_used ON sessions (last_used);
+"""
+
+
+def dumps_history(history):
+    """
+    Serialize a list of Content messages (``chat.history``) as one protobuf
+    message, compressed when that pays off
+    """
+    data = genai.protos.GenerateContentRequest.serialize(genai.protos.GenerateContentRequest(contents=history))
+    if len(data) >= COMPRESS_MIN_BYTES:
+        return _ZLIB + zlib.compress(data, 1)
+    return _RAW + data
+
+
+def loads_history(blob):
+    data = blob[1:]
+    if blob[:1] == _ZLIB:
+        data = zlib.decompress(data)
+    return list(genai.protos.GenerateContentRequest.deserialize(data).contents)
+
+
+def fit_history(history, max_bytes):
+    """
+    Serialize ``history``, dropping the oldest user/model turns until it fits in ``max_bytes``
+    """
+    history = list(history)
+    # The running summary, if any, outlives the turns after it
+    head = history[:2] if is_summary(history) else []
+    turns = history[len(head):]
+    blob = dumps_history(history)
+    while len(blob) > max_bytes and len(turns) > 2:
+        # Drop whole exchanges so the history still starts with a user turn
+        turns = turns[2:]
+        blob = dumps_history(head + turns)
+    return blob
+
+
+class MemorySessionStore:
+    """
+    Chat histories of this worker process, held serialized.
+
+    Sessions idle for longer than ``idle_ttl`` seconds expire, each history is
+    capped at ``max_session_bytes`` (oldest turns are dropped first) and the
+    least recently used sessions are evicted once the store holds more than
+    ``max_bytes``.
+    """
+
+    def __init__(self, max_bytes, idle_ttl=86400, max_session_bytes=256 * 1024):
+        self.max_bytes = max_bytes
+        self.idle_ttl = idle_ttl
+        self.max_session_bytes = max_session_bytes
+        self._sessions = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, session_id):
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is None:
+                return []
+            blob, last_used = entry
+            if time.time() - last_used > self.idle_ttl:
+                self._remove(session_id)
+                return []
+            self._sessions[session_id] = (blob, time.time())
+            self._sessions.move_to_end(session_id)
+        return loads_history(blob)
+
+    def set(self, session_id, history):
+        blob = fit_history(history, self.max_session_bytes)
+        with self._lock:
+            if session_id in self._sessions:
+                self._remove(session_id)
+            self._sessions[session_id] = (blob, time.time())
+            self._bytes += len(blob)
+            self._evict()
+
+    def delete(self, session_id):
+        with self._lock:
+            if session_id in self._sessions:
+                self._remove(session_id)
+
+    def _evict(self):
+        now = time.time()
+        while self._sessions:
+            session_id, (_, last_used) = next(iter(self._sessions.items()))
+            if self._bytes <= self.max_bytes and now - last_used <= self.idle_ttl:
+                break
+            self._remove(session_id)
+
+    def _remove(self, session_id):
+        blob, _ = self._sessions.pop(session_id)
+        self._bytes -= len(blob)
+
+    def size_bytes(self):
+        return self._bytes
+
+    def __len__(self):
+        return len(self._sessions)
+
+
+class SQLiteSessionStore:
+    """
+    Chat histories shared by every worker process on the host, in a SQLite
+    database in WAL mode, so a follow-up turn can land on any worker.
+
+    Same limits as MemorySessionStore; expired and least recently used sessions
+    are deleted every few writes.
+    """
+
+    def __init__(self, path, max_bytes, idle_ttl=86400, max_session_bytes=256 * 1024):
+        self.path = str(path)
+        self.max_bytes = max_bytes
+        self.idle_ttl = idle_ttl
+        self.max_session_bytes = max_session_bytes
+        self._local = threading.local()
+        self._puts = 0
+        self._lock = threading.Lock()
+        self._connection().executescript(_SCHEMA)
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, session_id):
+        conn = self._connection()
+        row = conn.execute(
+            "SELECT history, last_used FROM sessions WHERE session_id = ?", (str(session_id),)
+        ).fetchone()
+        if row is None:
+            return []
+        blob, last_used = row
+        now = time.time()
+        if now - last_used > self.idle_ttl:
+            conn.execute("DELETE FROM sessions WHERE session_id = ?", (str(session_id),))
+            return []
+        conn.execute("UPDATE sessions SET last_used = ? WHERE session_id = ?", (now, str(session_id)))
+        return loads_history(blob)
+
+    def set(self, session_id, history):
+        blob = fit_history(history, self.max_session_bytes)
+        self._connection().execute(
+            "INSERT OR REPLACE INTO sessions (session_id, history, nbytes, last_used) VALUES (?, ?, ?, ?)",
+            (str(session_id), blob, len(blob), time.time()),
+        )
+        with self._lock:
+            self._puts += 1
+            evict = self._puts % _EVICT_EVERY == 0
+        if evict:
+            self.evict()
+
+    def delete(self, session_id):
+        self._connection().execute("DELETE FROM sessions WHERE session_id = ?", (str(session_id),))
+
+    def size_bytes(self):
+        return self._connection().execute("SELECT COALESCE(SUM(nbytes), 0) FROM sessions").fetchone()[0]
+
+    def evict(self):
+        conn = self._connection()
+        conn.execute("DELETE FROM sessions WHERE last_used < ?", (time.time() - self.idle_ttl,))
+        excess = self.size_bytes() - self.max_bytes
+        if excess <= 0:
+            return
+        # Oldest sessions first, until enough bytes are freed
+        conn.execute(
+            """
+            DELETE FROM sessions WHERE session_id IN (
+                SELECT session_id FROM (
+                    SELECT session_id, nbytes, SUM(nbytes) OVER (ORDER BY last_used, session_id) AS freed
+                    FROM sessions
+                ) WHERE freed - nbytes < ?
+            )
+            """,
+            (excess,),
+        )
+
+    def __len__(self):
+        return self._connection().execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
@@ -1,3 +1,642 @@
-from django.test import TestCase
+import asyncio
+import os
+import tempfile
+import threading
+import time
+from unittest import mock
 
-# Create your tests here.
+import google.generativeai as genai
+from django.test import SimpleTestCase, TestCase, TransactionTestCase
+
+from APIs.answer_cache import AnswerCache, normalize_question
+from text_bot import views
+from text_bot.history import (
+    SUMMARY_PREFIX,
+    HistoryPolicy,
+    _summarize_session,
+    _tokens,
+    append_exchange,
+    is_summary,
+    schedule_summary,
+    summary_exchange,
+)
+from text_bot.models import TextQuery
+from text_bot.session_store import (
+    _EVICT_EVERY,
+    COMPRESS_MIN_BYTES,
+    MemorySessionStore,
+    SQLiteSessionStore,
+    dumps_history,
+    fit_history,
+    loads_history,
+)
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError("Timed out waiting for condition")
+        time.sleep(0.001)
+
+
+class AnswerCacheTests(SimpleTestCase):
+    def setUp(self):
+        self.cache = AnswerCache(1024 * 1024, ttl=60, semantic_threshold=0.9)
+
+    def test_normalize_question(self):
+        self.assertEqual(normalize_question("  What is   RAG?? "), "what is rag")
+        self.assertEqual(normalize_question(None), "")
+
+    def test_exact_hit_on_normalized_question(self):
+        self.cache.put("doc", "What is RAG?", "flash", "v1", "answer")
+        self.assertEqual(self.cache.get("doc", "  what is rag ", "flash", "v1"), "answer")
+        self.assertEqual(self.cache.get_exact("doc", "WHAT IS RAG!", "flash", "v1"), "answer")
+        self.assertEqual(self.cache.stats()["exact_hits"], 2)
+
+    def test_key_includes_scope_model_and_prompt_version(self):
+        self.cache.put("doc", "q", "flash", "v1", "answer")
+        self.assertIsNone(self.cache.get("other", "q", "flash", "v1"))
+        self.assertIsNone(self.cache.get("doc", "q", "pro", "v1"))
+        self.assertIsNone(self.cache.get("doc", "q", "flash", "v2"))
+        self.assertEqual(self.cache.stats()["misses"], 3)
+
+    def test_get_exact_does_not_count_a_miss(self):
+        self.assertIsNone(self.cache.get_exact("doc", "q", "flash", "v1"))
+        self.assertEqual(self.cache.stats()["misses"], 0)
+
+    def test_semantic_hit_at_the_threshold(self):
+        self.cache.put("doc", "What does the report conclude?", "flash", "v1", "answer", vector=[1.0, 0.0])
+        # cos = 0.9 exactly
+        self.assertEqual(self.cache.get_similar("doc", "What is the conclusion?", "flash", "v1", [0.9, 0.19 ** 0.5]),
+                         "answer")
+        self.assertEqual(self.cache.stats()["semantic_hits"], 1)
+
+    def test_semantic_miss_just_below_the_threshold(self):
+        self.cache.put("doc", "What does the report conclude?", "flash", "v1", "answer", vector=[1.0, 0.0])
+        self.assertIsNone(self.cache.get_similar("doc", "What is the conclusion?", "flash", "v1", [0.89, 0.2079 ** 0.5]))
+        self.assertEqual(self.cache.stats()["misses"], 1)
+
+    def test_semantic_match_needs_the_same_numbers(self):
+        self.cache.put("doc", "Revenue in 2022?", "flash", "v1", "answer", vector=[1.0, 0.0])
+        self.assertIsNone(self.cache.get_similar("doc", "Revenue in 2023?", "flash", "v1", [1.0, 0.0]))
+        self.assertEqual(self.cache.get_similar("doc", "What was revenue in 2022", "flash", "v1", [1.0, 0.0]), "answer")
+
+    def test_semantic_tier_stays_within_the_scope(self):
+        self.cache.put("doc", "q", "flash", "v1", "answer", vector=[1.0, 0.0])
+        self.assertIsNone(self.cache.get_similar("other", "question", "flash", "v1", [1.0, 0.0]))
+        self.assertIsNone(self.cache.get_similar("doc", "question", "flash", "v1", None))
+
+    def test_entries_expire_after_ttl(self):
+        with mock.patch("APIs.answer_cache.time.monotonic", return_value=1000.0):
+            self.cache.put("doc", "q", "flash", "v1", "answer", vector=[1.0, 0.0])
+        with mock.patch("APIs.answer_cache.time.monotonic", return_value=1059.0):
+            self.assertEqual(self.cache.get("doc", "q", "flash", "v1"), "answer")
+        with mock.patch("APIs.answer_cache.time.monotonic", return_value=1060.0):
+            self.assertIsNone(self.cache.get_similar("doc", "question", "flash", "v1", [1.0, 0.0]))
+            self.assertIsNone(self.cache.get("doc", "q", "flash", "v1"))
+        self.assertEqual(len(self.cache), 0)
+        self.assertEqual(self.cache.stats()["bytes"], 0)
+
+    def test_least_recently_used_entries_are_evicted(self):
+        probe = AnswerCache(1024 * 1024)
+        probe.put("doc", "q", "flash", "v1", "x" * 100)
+        cache = AnswerCache(probe.stats()["bytes"] * 2 + 10)
+        cache.put("doc", "q1", "flash", "v1", "x" * 100)
+        cache.put("doc", "q2", "flash", "v1", "x" * 100)
+        cache.get("doc", "q1", "flash", "v1")
+        cache.put("doc", "q3", "flash", "v1", "x" * 100)
+        self.assertEqual(len(cache), 2)
+        self.assertIsNone(cache.get_exact("doc", "q2", "flash", "v1"))
+        self.assertIsNotNone(cache.get_exact("doc", "q1", "flash", "v1"))
+        self.assertLessEqual(cache.stats()["bytes"], cache.max_bytes)
+
+    def test_value_larger_than_the_cache_is_not_stored(self):
+        cache = AnswerCache(100)
+        cache.put("doc", "q", "flash", "v1", "x" * 1000)
+        self.assertEqual(len(cache), 0)
+
+    def test_invalidate_scope_and_prefix(self):
+        self.cache.put("doc", "q", "flash", "v1", "a")
+        self.cache.put("library:1,2", "q", "flash", "v1", "b")
+        self.cache.put("library:3", "q", "flash", "v1", "c")
+        self.cache.invalidate_scope("doc")
+        self.assertIsNone(self.cache.get_exact("doc", "q", "flash", "v1"))
+        self.assertEqual(len(self.cache), 2)
+        self.cache.invalidate_prefix("library:")
+        self.assertEqual(len(self.cache), 0)
+
+    def test_concurrent_identical_misses_compute_once(self):
+        release = threading.Event()
+        calls = []
+
+        def compute():
+            calls.append(1)
+            release.wait(5)
+            return "answer"
+
+        results = []
+        threads = [
+            threading.Thread(target=lambda: results.append(
+                self.cache.get_or_compute("doc", "What is RAG?", "flash", "v1", compute)))
+            for _ in range(5)
+        ]
+        for thread in threads:
+            thread.start()
+        wait_for(lambda: self.cache.coalesced == 4)
+        release.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(calls, [1])
+        self.assertEqual(results, ["answer"] * 5)
+        self.assertEqual(self.cache.stats()["misses"], 1)
+        self.assertEqual(self.cache.get_or_compute("doc", "what is rag", "flash", "v1", compute), "answer")
+        self.assertEqual(calls, [1])
+
+    def test_followers_see_the_leaders_error(self):
+        release = threading.Event()
+
+        def compute():
+            release.wait(5)
+            raise RuntimeError("upstream down")
+
+        errors = []
+
+        def ask():
+            try:
+                self.cache.get_or_compute("doc", "q", "flash", "v1", compute)
+            except RuntimeError as e:
+                errors.append(str(e))
+
+        threads = [threading.Thread(target=ask) for _ in range(3)]
+        for thread in threads:
+            thread.start()
+        wait_for(lambda: self.cache.coalesced == 2)
+        release.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, ["upstream down"] * 3)
+        self.assertEqual(len(self.cache), 0)
+        # The failed call is not remembered
+        self.assertEqual(self.cache.get_or_compute("doc", "q", "flash", "v1", lambda: "answer"), "answer")
+
+    def test_concurrent_async_misses_compute_once(self):
+        calls = []
+
+        async def prepare():
+            await asyncio.sleep(0.01)
+            return "chunks", [1.0, 0.0]
+
+        async def compute(state):
+            calls.append(state)
+            await asyncio.sleep(0.01)
+            return "answer"
+
+        async def ask():
+            return await asyncio.gather(*(
+                self.cache.aget_or_compute("doc", "What is RAG?", "flash", "v1", compute, prepare=prepare)
+                for _ in range(5)
+            ))
+
+        self.assertEqual(asyncio.run(ask()), ["answer"] * 5)
+        self.assertEqual(calls, ["chunks"])
+        self.assertEqual(self.cache.coalesced, 4)
+        self.assertEqual(self.cache.get_similar("doc", "Explain RAG", "flash", "v1", [1.0, 0.0]), "answer")
+
+    def test_async_callers_wait_for_a_sync_leader(self):
+        release = threading.Event()
+
+        def compute():
+            release.wait(5)
+            return "answer"
+
+        leader = threading.Thread(target=self.cache.get_or_compute, args=("doc", "q", "flash", "v1", compute))
+        leader.start()
+        wait_for(lambda: self.cache._calls)
+
+        async def prepare():
+            raise AssertionError("the follower should not retrieve")
+
+        async def ask():
+            follower = asyncio.ensure_future(
+                self.cache.aget_or_compute("doc", "q", "flash", "v1", None, prepare=prepare))
+            await asyncio.sleep(0.01)
+            release.set()
+            return await follower
+
+        self.assertEqual(asyncio.run(ask()), "answer")
+        leader.join()
+
+    def test_cancelled_async_leader_releases_its_followers(self):
+        async def prepare():
+            return None, None
+
+        async def compute(state):
+            await asyncio.sleep(10)
+
+        async def ask():
+            leader = asyncio.ensure_future(
+                self.cache.aget_or_compute("doc", "q", "flash", "v1", compute, prepare=prepare))
+            await asyncio.sleep(0.01)
+            follower = asyncio.ensure_future(
+                self.cache.aget_or_compute("doc", "q", "flash", "v1", compute, prepare=prepare))
+            await asyncio.sleep(0.01)
+            leader.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await follower
+
+        asyncio.run(ask())
+        self.assertEqual(self.cache._calls, {})
+
+    def test_none_results_are_not_cached(self):
+        self.assertIsNone(self.cache.get_or_compute("doc", "q", "flash", "v1", lambda: None))
+        self.assertEqual(len(self.cache), 0)
+
+    def test_prepare_is_skipped_on_an_exact_hit(self):
+        self.cache.put("doc", "q", "flash", "v1", "answer")
+        prepare = mock.Mock()
+        compute = mock.Mock()
+        self.assertEqual(self.cache.get_or_compute("doc", "Q?", "flash", "v1", compute, prepare=prepare), "answer")
+        prepare.assert_not_called()
+        compute.assert_not_called()
+
+    def test_prepare_vector_reaches_the_semantic_tier(self):
+        self.cache.put("doc", "What does the report conclude?", "flash", "v1", "answer", vector=[1.0, 0.0])
+        compute = mock.Mock()
+        value = self.cache.get_or_compute("doc", "What is the conclusion?", "flash", "v1", compute,
+                                          prepare=lambda: (["chunk"], [1.0, 0.01]))
+        self.assertEqual(value, "answer")
+        compute.assert_not_called()
+        self.assertEqual(self.cache.stats()["semantic_hits"], 1)
+
+    def test_prepare_state_is_passed_to_compute_and_the_vector_is_stored(self):
+        compute = mock.Mock(return_value="answer")
+        value = self.cache.get_or_compute("doc", "q", "flash", "v1", compute, prepare=lambda: (["chunk"], [0.0, 1.0]))
+        self.assertEqual(value, "answer")
+        compute.assert_called_once_with(["chunk"])
+        self.assertEqual(self.cache.stats()["misses"], 1)
+        self.assertEqual(self.cache.get_similar("doc", "question", "flash", "v1", [0.0, 2.0]), "answer")
+
+    def test_prepare_without_a_vector(self):
+        compute = mock.Mock(return_value="answer")
+        self.assertEqual(self.cache.get_or_compute("doc", "q", "flash", "v1", compute, prepare=lambda: ([], None)),
+                         "answer")
+        compute.assert_called_once_with([])
+        self.assertEqual(self.cache.get_exact("doc", "q", "flash", "v1"), "answer")
+        self.assertIsNone(self.cache.get_similar("doc", "question", "flash", "v1", [1.0, 0.0]))
+
+
+def exchange(question, answer):
+    return [
+        genai.protos.Content(role="user", parts=[genai.protos.Part(text=question)]),
+        genai.protos.Content(role="model", parts=[genai.protos.Part(text=answer)]),
+    ]
+
+
+def texts(history):
+    return [(content.role, content.parts[-1].text) for content in history]
+
+
+class HistoryEncodingTests(SimpleTestCase):
+    def test_small_histories_are_stored_raw(self):
+        history = exchange("hi", "hello")
+        blob = dumps_history(history)
+        self.assertEqual(blob[:1], b"\x00")
+        self.assertEqual(texts(loads_history(blob)), texts(history))
+
+    def test_large_histories_are_compressed(self):
+        history = exchange("q " * 1000, "a " * 1000)
+        blob = dumps_history(history)
+        self.assertEqual(blob[:1], b"\x01")
+        self.assertLess(len(blob), COMPRESS_MIN_BYTES)
+        self.assertEqual(texts(loads_history(blob)), texts(history))
+
+    def test_empty_history(self):
+        self.assertEqual(loads_history(dumps_history([])), [])
+
+    def test_fit_history_drops_the_oldest_exchanges(self):
+        history = exchange("one " * 50, "1") + exchange("two " * 50, "2") + exchange("three", "3")
+        fitted = loads_history(fit_history(history, len(dumps_history(history[2:]))))
+        self.assertEqual(texts(fitted), texts(history[2:]))
+
+    def test_fit_history_keeps_the_summary_and_last_exchange(self):
+        history = summary_exchange("earlier talk") + exchange("one " * 50, "1") + exchange("two " * 50, "2")
+        fitted = loads_history(fit_history(history, 10))
+        self.assertEqual(texts(fitted), texts(history[:2] + history[-2:]))
+
+
+def conversation(count, size=1):
+    history = []
+    for i in range(count):
+        history += exchange(f"q{i}" * size, f"a{i}" * size)
+    return history
+
+
+class SummaryModel:
+    def __init__(self, summary="the summary"):
+        self.summary = summary
+        self.prompts = []
+
+    def generate_content(self, prompt):
+        self.prompts.append(prompt)
+        return mock.Mock(text=f" {self.summary} ")
+
+
+class HistoryPolicyTests(SimpleTestCase):
+    def test_window_keeps_the_recent_turns(self):
+        policy = HistoryPolicy(keep_turns=2, summary_batch=1, max_tokens=10000)
+        history = summary_exchange("earlier") + conversation(5)
+        self.assertEqual(texts(policy.window(history)), texts(history[:2] + history[-6:]))
+        self.assertEqual(policy.window([]), [])
+
+    def test_window_drops_the_oldest_turns_to_fit(self):
+        policy = HistoryPolicy(keep_turns=4, max_tokens=450)
+        history = conversation(3, size=200)
+        self.assertEqual(texts(policy.window(history)), texts(history[-4:]))
+        self.assertEqual(texts(policy.window(history, reserve_tokens=100)), texts(history[-2:]))
+
+    def test_window_shrinks_an_oversized_summary_to_its_end(self):
+        policy = HistoryPolicy(max_tokens=200)
+        history = summary_exchange("a" * 3000 + " latest") + conversation(1)
+        window = policy.window(history)
+        self.assertTrue(is_summary(window))
+        self.assertTrue(window[0].parts[0].text.startswith(SUMMARY_PREFIX))
+        self.assertTrue(window[0].parts[0].text.endswith(" latest"))
+        self.assertLessEqual(_tokens(window), 200)
+        self.assertEqual(HistoryPolicy(max_tokens=10).window(history), [])
+
+    def test_needs_summary_once_a_batch_has_left_the_window(self):
+        policy = HistoryPolicy(keep_turns=2, summary_batch=2)
+        self.assertFalse(policy.needs_summary(conversation(3)))
+        self.assertTrue(policy.needs_summary(summary_exchange("earlier") + conversation(4)))
+        self.assertFalse(HistoryPolicy(keep_turns=2, summary_batch=2, summarize=False)
+                         .needs_summary(conversation(4)))
+
+    def test_summarize_folds_all_but_the_kept_turns(self):
+        policy = HistoryPolicy(keep_turns=2)
+        model = SummaryModel()
+        history = summary_exchange("earlier") + conversation(5)
+        replaced, summary = policy.summarize(model, history)
+        self.assertEqual(replaced, 8)
+        self.assertEqual(texts(summary), texts(summary_exchange("the summary")))
+        prompt = model.prompts[0]
+        self.assertIn("Summary so far:\nearlier", prompt)
+        self.assertIn("User: q2\nAssistant: a2", prompt)
+        self.assertNotIn("q3", prompt)
+        self.assertEqual(policy.summarize(model, conversation(2)), (0, []))
+
+    def test_summaries_are_written_in_the_background(self):
+        store = MemorySessionStore(1024 * 1024)
+        policy = HistoryPolicy(keep_turns=2, summary_batch=2)
+        history = conversation(4)
+        store.set("s1", history)
+        schedule_summary(store, "s1", SummaryModel(), policy, conversation(3))
+        schedule_summary(store, "s1", SummaryModel(), policy, history)
+        wait_for(lambda: is_summary(store.get("s1")))
+        self.assertEqual(texts(store.get("s1")), texts(summary_exchange("the summary") + history[-4:]))
+
+    def test_replies_keep_a_summary_written_while_they_were_generated(self):
+        store = MemorySessionStore(1024 * 1024)
+        policy = HistoryPolicy(keep_turns=2, summary_batch=2)
+        loaded = conversation(4)
+        store.set("s1", loaded)
+        _summarize_session(store, "s1", SummaryModel(), policy, loaded)
+        stored = append_exchange(store, "s1", loaded, exchange("new", "reply"))
+        expected = summary_exchange("the summary") + loaded[-4:] + exchange("new", "reply")
+        self.assertEqual(texts(stored), texts(expected))
+        self.assertEqual(texts(store.get("s1")), texts(expected))
+
+    def test_summaries_keep_a_reply_committed_while_they_were_written(self):
+        store = MemorySessionStore(1024 * 1024)
+        policy = HistoryPolicy(keep_turns=2, summary_batch=2)
+        loaded = conversation(4)
+        store.set("s1", loaded)
+        append_exchange(store, "s1", loaded, exchange("new", "reply"))
+        _summarize_session(store, "s1", SummaryModel(), policy, loaded)
+        self.assertEqual(texts(store.get("s1")),
+                         texts(summary_exchange("the summary") + loaded[-4:] + exchange("new", "reply")))
+
+    def test_commit_appends_to_the_stored_history(self):
+        store = MemorySessionStore(1024 * 1024)
+        loaded = conversation(3)
+        store.set("s1", summary_exchange("the summary") + loaded[-2:])
+        window = loaded[-2:]
+        with mock.patch.object(views, "_get_session_store", return_value=store), \
+                mock.patch.object(views, "_get_gemini_model"), \
+                mock.patch.object(views, "schedule_summary") as schedule:
+            views._commit_history("s1", loaded, window, window + exchange("new", "reply"))
+        expected = summary_exchange("the summary") + loaded[-2:] + exchange("new", "reply")
+        self.assertEqual(texts(store.get("s1")), texts(expected))
+        self.assertEqual(texts(schedule.call_args[0][4]), texts(expected))
+
+
+class SessionStoreTests:
+    """
+    Behaviour both backends share; subclasses provide ``make_store``
+    """
+
+    def setUp(self):
+        self.now = 1000.0
+        patcher = mock.patch("text_bot.session_store.time.time", side_effect=lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.history = exchange("x" * 100, "y" * 100)
+        self.nbytes = len(dumps_history(self.history))
+
+    def test_unknown_session_is_empty(self):
+        self.assertEqual(self.make_store().get("missing"), [])
+
+    def test_round_trip(self):
+        store = self.make_store()
+        store.set("s1", self.history)
+        self.assertEqual(texts(store.get("s1")), texts(self.history))
+        self.assertEqual(len(store), 1)
+        self.assertEqual(store.size_bytes(), self.nbytes)
+
+    def test_set_replaces_the_history(self):
+        store = self.make_store()
+        store.set("s1", self.history)
+        store.set("s1", self.history + exchange("more", "sure"))
+        self.assertEqual(len(store.get("s1")), 4)
+        self.assertEqual(len(store), 1)
+
+    def test_delete(self):
+        store = self.make_store()
+        store.set("s1", self.history)
+        store.delete("s1")
+        store.delete("never-stored")
+        self.assertEqual(store.get("s1"), [])
+        self.assertEqual(store.size_bytes(), 0)
+
+    def test_history_is_capped_per_session(self):
+        store = self.make_store(max_session_bytes=self.nbytes)
+        store.set("s1", exchange("old " * 50, "1") + self.history)
+        self.assertEqual(texts(store.get("s1")), texts(self.history))
+
+    def test_idle_sessions_expire(self):
+        store = self.make_store(idle_ttl=60)
+        store.set("s1", self.history)
+        self.now += 60
+        self.assertEqual(len(store.get("s1")), 2)
+        self.now += 61
+        self.assertEqual(store.get("s1"), [])
+        self.assertEqual(len(store), 0)
+
+    def test_least_recently_used_sessions_are_evicted(self):
+        store = self.make_store(max_bytes=self.nbytes * 2)
+        store.set("s1", self.history)
+        self.now += 1
+        store.set("s2", self.history)
+        self.now += 1
+        store.get("s1")
+        self.now += 1
+        store.set("s3", self.history)
+        self.evict(store)
+        self.assertEqual(store.get("s2"), [])
+        self.assertEqual(len(store.get("s1")), 2)
+        self.assertEqual(len(store.get("s3")), 2)
+        self.assertLessEqual(store.size_bytes(), store.max_bytes)
+
+    def evict(self, store):
+        pass
+
+
+class MemorySessionStoreTests(SessionStoreTests, SimpleTestCase):
+    def make_store(self, max_bytes=1024 * 1024, **kwargs):
+        return MemorySessionStore(max_bytes, **kwargs)
+
+
+class SQLiteSessionStoreTests(SessionStoreTests, SimpleTestCase):
+    def setUp(self):
+        super().setUp()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, "sessions.sqlite3")
+
+    def make_store(self, max_bytes=1024 * 1024, **kwargs):
+        store = SQLiteSessionStore(self.path, max_bytes, **kwargs)
+        self.addCleanup(lambda: store._local.conn.close())
+        return store
+
+    def evict(self, store):
+        store.evict()
+
+    def test_eviction_runs_every_few_writes(self):
+        store = self.make_store(max_bytes=self.nbytes)
+        for i in range(_EVICT_EVERY - 1):
+            self.now += 1
+            store.set(f"s{i}", self.history)
+        self.assertEqual(len(store), _EVICT_EVERY - 1)
+        self.now += 1
+        store.set("last", self.history)
+        self.assertEqual(len(store), 1)
+        self.assertEqual(len(store.get("last")), 2)
+
+    def test_sessions_are_shared_between_stores(self):
+        writer, reader = self.make_store(), self.make_store()
+        writer.set("s1", self.history)
+        self.assertEqual(texts(reader.get("s1")), texts(self.history))
+        reader.delete("s1")
+        self.assertEqual(writer.get("s1"), [])
+
+    def test_concurrent_writers(self):
+        store = self.make_store()
+        errors = []
+
+        def write(n):
+            try:
+                for i in range(20):
+                    store.set(f"t{n}-{i}", self.history)
+                store._local.conn.close()
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=write, args=(n,)) for n in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        self.assertEqual(len(store), 80)
+
+
+@mock.patch.dict(os.environ, {"CHAT_ANSWER_CACHE_SEMANTIC": "True", "GEMINI_TEXT_MODEL": "models/test"})
+class FirstTurnCacheTests(SimpleTestCase):
+    def setUp(self):
+        self.cache = AnswerCache(1024 * 1024, semantic_threshold=0.9)
+        patcher = mock.patch("text_bot.views.genai.embed_content", return_value={"embedding": [1.0, 0.0]})
+        self.embed = patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = mock.patch("text_bot.views._set_first_turn_history")
+        self.set_history = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.scope = views._first_turn_scope("Be brief.")
+
+    def test_exact_hit_is_not_embedded(self):
+        self.cache.put(self.scope, "Hello there", "models/test", views.CHAT_PROMPT_VERSION, "Hi")
+        self.assertEqual(views._lookup_first_turn(self.cache, self.scope, "hello there?"), ("Hi", None))
+        self.embed.assert_not_called()
+
+    def test_miss_is_embedded_once_for_the_semantic_tier(self):
+        self.cache.put(self.scope, "Hello there", "models/test", views.CHAT_PROMPT_VERSION, "Hi", vector=[1.0, 0.0])
+        self.assertEqual(views._lookup_first_turn(self.cache, self.scope, "Hi there"), ("Hi", [1.0, 0.0]))
+        self.embed.assert_called_once()
+
+    def test_semantic_tier_off_skips_the_embedding(self):
+        with mock.patch.dict(os.environ, {"CHAT_ANSWER_CACHE_SEMANTIC": "False"}):
+            self.assertEqual(views._lookup_first_turn(self.cache, self.scope, "Hi there"), (None, None))
+        self.embed.assert_not_called()
+
+    def test_cached_first_turn_embeds_only_on_a_miss(self):
+        with mock.patch("text_bot.views._send_message", return_value="Hi") as send:
+            self.assertEqual(views._cached_first_turn(None, "s1", "Be brief.", "Hello there", self.cache), "Hi")
+            self.assertEqual(views._cached_first_turn(None, "s2", "Be brief.", "hello there", self.cache), "Hi")
+        send.assert_called_once()
+        self.embed.assert_called_once()
+        self.set_history.assert_called_once_with("s2", "hello there", "Hi")
+
+
+class ChatQueryRecordTests(TestCase):
+    def test_answer_time_is_recorded(self):
+        views._answered(time.perf_counter() - 0.25, "Hello there")("Hi")
+        query = TextQuery.objects.get()
+        self.assertIsNone(query.text_document)
+        self.assertEqual((query.query_text, query.response_text), ("Hello there", "Hi"))
+        self.assertGreaterEqual(query.response_time_ms, 250)
+        self.assertEqual(query.relevant_chunks_count, 0)
+        self.assertEqual(str(query), "Chat query")
+
+
+class UpperModel:
+    def generate_content(self, prompt):
+        if prompt == "fail":
+            raise RuntimeError("upstream down")
+        return mock.Mock(text=prompt.upper(), usage_metadata=None)
+
+
+@mock.patch("text_bot.views.get_answer_cache", return_value=None)
+@mock.patch("text_bot.views._get_gemini_model", return_value=UpperModel())
+class ChatBatchViewTests(TransactionTestCase):
+    def post(self, **data):
+        return self.client.post("/chat/batch/", data, content_type="application/json")
+
+    def test_prompts_are_answered_and_recorded(self, *mocks):
+        response = self.post(prompts=["one", "fail", "two"], system_prompt="Be brief.")
+        self.assertEqual(response.json()["results"], [
+            {"index": 0, "prompt": "one", "generated_text": "ONE"},
+            {"index": 1, "prompt": "fail", "error": "upstream down"},
+            {"index": 2, "prompt": "two", "generated_text": "TWO"},
+        ])
+        # Recorded from the batch threads
+        self.assertEqual(sorted(TextQuery.objects.values_list("response_text", flat=True)), ["ONE", "TWO"])
+
+    def test_streamed_results(self, *mocks):
+        response = self.post(prompts=["one", "two"], stream="true")
+        body = b"".join(response.streaming_content).decode()
+        self.assertEqual(body.count("event: result"), 2)
+        self.assertIn('event: done\ndata: {"count": 2, "errors": 0}', body)
+
+    def test_invalid_batches(self, *mocks):
+        self.assertEqual(self.post(prompts=[]).json(), {"generated_text": "No prompts given"})
+        with mock.patch.dict(os.environ, {"BATCH_MAX_ITEMS": "1"}):
+            self.assertEqual(self.post(prompts=["a", "b"]).status_code, 400)
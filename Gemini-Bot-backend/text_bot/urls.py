@@ -3,4 +3,6 @@ from text_bot import views
 
 urlpatterns = [
     path('chat/', views.generate_text, name='generate_text'),
+    path('chat/async/', views.generate_text_async, name='generate_text_async'),
+    path('chat/batch/', views.generate_text_batch, name='generate_text_batch'),
 ]
@@ -1,12 +1,30 @@
 from django.core.files.uploadedfile import InMemoryUploadedFile
 from django.contrib.sessions.backends.db import SessionStore
+from django.http import JsonResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
 from rest_framework.decorators import api_view
 import google.generativeai as genai
 from rest_framework.response import Response
 from decouple import config
 from azure.identity import DefaultAzureCredential
 from azure.keyvault.secrets import SecretClient
+import hashlib
 import os
+import threading
+import time
+from collections import OrderedDict
+
+from APIs.answer_cache import get_answer_cache
+from APIs.async_utils import aiter_values, get_executor, request_data, run_blocking
+from APIs.batch import check_items, ordered, parse_items, run_batch
+from APIs.gemini import configure_genai
+from APIs.metrics import atimed_chunks, count_tokens, count_usage, observe_stage, span, timed_chunks, upstream_call
+from APIs.streaming import async_sse_response, batch_sse_response, sse_response, wants_stream
+from APIs.tokens import estimate_tokens
+from text_bot.history import HistoryPolicy, append_exchange, schedule_summary
+from text_bot.models import TextQuery
+from text_bot.session_store import BACKEND_MEMORY, BACKEND_SQLITE, MemorySessionStore, SQLiteSessionStore
 
 # keyVaultName = os.environ["GEMINIKEY"]
 # vault_url = f"https://{keyVaultName}.vault.azure.net"
@@ -17,7 +35,13 @@ import os
 API_KEY = config("GEMINI_API_KEY", default=None)
 # API_KEY = os.environ["GEMINI_API_KEY"]
 
-_gemini_model = None
+_gemini_models = OrderedDict()
+_gemini_models_lock = threading.Lock()
+_genai_configured = False
+
+# Bump when the way prompts are sent changes, so cached answers are not reused
+CHAT_PROMPT_VERSION = 2
+EMBEDDING_MODEL = "models/text-embedding-004"
 
 
 def _get_api_key():
@@ -28,43 +52,391 @@ def _get_text_model_name():
     return config("GEMINI_TEXT_MODEL", default="models/gemini-flash-latest")
 
 
-def _get_gemini_model():
-    global _gemini_model
-    if _gemini_model is None:
-        api_key = _get_api_key()
-        if not api_key:
-            raise ValueError("GEMINI_API_KEY not configured")
-        genai.configure(api_key=api_key)
-        _gemini_model = genai.GenerativeModel(_get_text_model_name())
-    return _gemini_model
+def _get_gemini_model(system_prompt=''):
+    """
+    Model with ``system_prompt`` as its system instruction, from a bounded LRU pool
+    keyed by model name and prompt hash
+    """
+    global _genai_configured
+    api_key = _get_api_key()
+    if not api_key:
+        raise ValueError("GEMINI_API_KEY not configured")
+    model_name = _get_text_model_name()
+    key = (model_name, hashlib.sha256(system_prompt.encode("utf-8")).hexdigest())
+    with _gemini_models_lock:
+        model = _gemini_models.get(key)
+        if model is not None:
+            _gemini_models.move_to_end(key)
+            return model
+        if not _genai_configured:
+            configure_genai(api_key)
+            _genai_configured = True
+        model = genai.GenerativeModel(model_name, system_instruction=system_prompt or None)
+        _gemini_models[key] = model
+        while len(_gemini_models) > config("CHAT_MODEL_POOL_SIZE", default=64, cast=int):
+            _gemini_models.popitem(last=False)
+        return model
 
-hist_dict = {}
+_session_store = None
+_session_store_lock = threading.Lock()
+_history_policy = None
 dialogue_dict = {}
 
+
+def _get_session_store():
+    """
+    Where chat histories live: shared by every worker on the host (sqlite) or per process (memory)
+    """
+    global _session_store
+    with _session_store_lock:
+        if _session_store is None:
+            backend = config("CHAT_SESSION_BACKEND", default=BACKEND_SQLITE)
+            max_bytes = config("CHAT_SESSION_STORE_MB", default=256, cast=int) * 1024 * 1024
+            idle_ttl = config("CHAT_SESSION_TTL_SECONDS", default=86400, cast=int)
+            max_session_bytes = config("CHAT_SESSION_MAX_KB", default=256, cast=int) * 1024
+            if backend == BACKEND_MEMORY:
+                _session_store = MemorySessionStore(max_bytes, idle_ttl=idle_ttl,
+                                                    max_session_bytes=max_session_bytes)
+            elif backend == BACKEND_SQLITE:
+                _session_store = SQLiteSessionStore(
+                    config("CHAT_SESSION_PATH", default="text_bot/sessions.sqlite3"),
+                    max_bytes,
+                    idle_ttl=idle_ttl,
+                    max_session_bytes=max_session_bytes,
+                )
+            else:
+                raise ValueError(f"Unknown CHAT_SESSION_BACKEND: {backend}")
+        return _session_store
+
+
+def _get_history_policy():
+    global _history_policy
+    if _history_policy is None:
+        _history_policy = HistoryPolicy(
+            keep_turns=config("CHAT_HISTORY_KEEP_TURNS", default=6, cast=int),
+            max_tokens=config("CHAT_HISTORY_MAX_TOKENS", default=8000, cast=int),
+            summary_batch=config("CHAT_HISTORY_SUMMARY_BATCH", default=4, cast=int),
+            summarize=config("CHAT_HISTORY_SUMMARIZE", default=True, cast=bool),
+        )
+    return _history_policy
+
+
+def _history_window(history, system_prompt, prompt):
+    """
+    The part of the stored history sent along with the new message
+    """
+    reserve = estimate_tokens(system_prompt) + estimate_tokens(prompt or '')
+    return _get_history_policy().window(history, reserve_tokens=reserve)
+
+
+def _load_history(session_id):
+    with span("chat", "load_history"):
+        return _get_session_store().get(session_id)
+
+
+def _commit_history(session_id, history, window, chat_history):
+    # The chat only saw the window: append its new exchange to the full stored history
+    store = _get_session_store()
+    with span("chat", "save_history"):
+        history = append_exchange(store, session_id, history, chat_history[len(window):])
+    # Summaries are written by the plain model, not in the persona of the system prompt
+    schedule_summary(store, session_id, _get_gemini_model(), _get_history_policy(), history)
+
+
+def _count_tokens(usage, prompt, text):
+    # Estimated when the response carries no usage metadata
+    if not count_usage("chat", usage):
+        count_tokens("chat", estimate_tokens(prompt or ''), estimate_tokens(text))
+
+
+def _record_query(prompt, answer, elapsed):
+    try:
+        TextQuery.objects.create(
+            query_text=prompt or "",
+            response_text=answer,
+            response_time_ms=int(elapsed * 1000),
+            # Chat answers are not grounded in retrieved chunks
+            relevant_chunks_count=0,
+        )
+    except Exception as e:
+        print(f"Could not record chat query: {e}")
+
+
+def _answered(started, prompt, in_background=False):
+    """
+    Callback recording how long a chat request took, from its start until the whole answer was produced (cached or
+    not), as the ``response`` stage and as a TextQuery row. ``in_background`` writes the row on the blocking
+    executor, for callers on the event loop.
+    """
+    def answered(text):
+        elapsed = time.perf_counter() - started
+        observe_stage("chat", "response", elapsed)
+        if in_background:
+            get_executor().submit(_record_query, prompt, text, elapsed)
+        else:
+            _record_query(prompt, text, elapsed)
+    return answered
+
+
+def _send_message(gemini_model, session_id, history, system_prompt, prompt):
+    window = _history_window(history, system_prompt, prompt)
+    chat = gemini_model.start_chat(history=window)
+    with span("chat", "generate"), upstream_call("generate", _get_text_model_name()):
+        response = chat.send_message(prompt, stream=True)
+        response.resolve()
+    _count_tokens(response.usage_metadata, prompt, response.text)
+
+    _commit_history(session_id, history, window, chat.history)
+    return response.text
+
+
+def _stream_message(gemini_model, session_id, history, system_prompt, prompt):
+    window = _history_window(history, system_prompt, prompt)
+    chat = gemini_model.start_chat(history=window)
+    started = time.perf_counter()
+    parts = []
+    usage = None
+    with upstream_call("stream", _get_text_model_name()):
+        for chunk in timed_chunks(chat.send_message(prompt, stream=True), "chat", started=started):
+            usage = chunk.usage_metadata
+            parts.append(chunk.text)
+            yield chunk.text
+    _count_tokens(usage, prompt, "".join(parts))
+
+    # History is only committed once the whole reply has been received
+    _commit_history(session_id, history, window, chat.history)
+
+
+def _first_turn_scope(system_prompt):
+    """
+    Answer cache scope of the first message of a session
+    """
+    return "chat:" + hashlib.sha256(system_prompt.encode("utf-8")).hexdigest()
+
+
+def _embed_question(cache, prompt):
+    """
+    Question embedding for the semantic cache tier, or None when that tier is off
+    """
+    if cache.semantic_threshold <= 0 or not config("CHAT_ANSWER_CACHE_SEMANTIC", default=False, cast=bool):
+        return None
+    with span("chat", "embed_question"), upstream_call("embed", EMBEDDING_MODEL):
+        return genai.embed_content(model=EMBEDDING_MODEL, content=prompt, task_type="retrieval_query")["embedding"]
+
+
+def _lookup_first_turn(cache, scope, prompt):
+    """
+    Cached answer to the first message of a session and the question embedding
+    to store a new answer under; the question is only embedded when the exact
+    tier misses
+    """
+    model_name = _get_text_model_name()
+    answer = cache.get_exact(scope, prompt, model_name, CHAT_PROMPT_VERSION)
+    if answer is not None:
+        return answer, None
+    vector = _embed_question(cache, prompt)
+    return cache.get_similar(scope, prompt, model_name, CHAT_PROMPT_VERSION, vector), vector
+
+
+def _set_first_turn_history(session_id, prompt, answer):
+    # Give a session answered from the cache the history it would have had
+    _get_session_store().set(session_id, [
+        genai.protos.Content(role="user", parts=[genai.protos.Part(text=prompt)]),
+        genai.protos.Content(role="model", parts=[genai.protos.Part(text=answer)]),
+    ])
+
+
+def _cached_first_turn(gemini_model, session_id, system_prompt, prompt, cache):
+    """
+    Answer the first message of a session through the answer cache, keyed by the system prompt
+    """
+    computed = []
+
+    def compute(state):
+        computed.append(True)
+        return _send_message(gemini_model, session_id, [], system_prompt, prompt)
+
+    answer = cache.get_or_compute(_first_turn_scope(system_prompt), prompt, _get_text_model_name(),
+                                  CHAT_PROMPT_VERSION, compute,
+                                  prepare=lambda: (None, _embed_question(cache, prompt)))
+    if not computed:
+        _set_first_turn_history(session_id, prompt, answer)
+    return answer
+
+
+def _stream_first_turn(gemini_model, session_id, system_prompt, prompt, cache, on_answer):
+    """
+    Streamed counterpart of ``_cached_first_turn``: a cached answer is sent in one
+    event, otherwise the reply is streamed and cached once it is complete.
+    ``on_answer`` gets the full answer either way.
+    """
+    scope = _first_turn_scope(system_prompt)
+    model_name = _get_text_model_name()
+    answer, vector = _lookup_first_turn(cache, scope, prompt)
+    if answer is not None:
+        _set_first_turn_history(session_id, prompt, answer)
+        on_answer(answer)
+        return sse_response([answer])
+
+    def on_complete(text):
+        cache.put(scope, prompt, model_name, CHAT_PROMPT_VERSION, text, vector=vector)
+        on_answer(text)
+
+    return sse_response(_stream_message(gemini_model, session_id, [], system_prompt, prompt),
+                        on_complete=on_complete)
+
+
 @api_view(['POST'])
 def generate_text(request):
     if request.method == 'POST':
+        started = time.perf_counter()
         try:
-            gemini_model = _get_gemini_model()
             session_id = request.data.get('session_id')
             system_prompt = request.data.get('system_prompt', '')
             prompt = request.data.get('prompt')
+            answered = _answered(started, prompt)
+            gemini_model = _get_gemini_model(system_prompt)
+
+            history = _load_history(session_id)
+
+            # Only single-turn requests are cached, later turns depend on the conversation
+            answer_cache = get_answer_cache() if not history else None
+
+            if wants_stream(request):
+                if answer_cache is not None:
+                    return _stream_first_turn(gemini_model, session_id, system_prompt, prompt, answer_cache,
+                                              answered)
+                return sse_response(_stream_message(gemini_model, session_id, history, system_prompt, prompt),
+                                    on_complete=answered)
 
-            if session_id not in hist_dict:
-                hist_dict[session_id] = []
-            
-            chat = gemini_model.start_chat(history=hist_dict[session_id])
-            response = chat.send_message([system_prompt,
-                                          prompt],
-                                          stream=True)
-            response.resolve()
-
-            hist_dict[session_id] = chat.history
-            
-            return Response({"generated_text": response.text})
+            if answer_cache is not None:
+                text = _cached_first_turn(gemini_model, session_id, system_prompt, prompt, answer_cache)
+            else:
+                text = _send_message(gemini_model, session_id, history, system_prompt, prompt)
+            answered(text)
+
+            return Response({"generated_text": text})
         except ValueError as e:
             print(e)
             return Response({"generated_text": str(e)}, status=500)
         except Exception as e:
             print(e)
             return Response({"generated_text": "Something went wrong. Please try again later."})
+
+
+def _batch_prompt(gemini_model, system_prompt, prompt):
+    """
+    Answer one prompt of a batch on its own, like the first message of a new session
+    """
+    answered = _answered(time.perf_counter(), prompt)
+
+    def compute(state=None):
+        with span("chat", "generate"), upstream_call("generate", _get_text_model_name()):
+            response = gemini_model.generate_content(prompt)
+        _count_tokens(response.usage_metadata, prompt, response.text)
+        return response.text
+
+    cache = get_answer_cache()
+    if cache is None:
+        text = compute()
+    else:
+        text = cache.get_or_compute(_first_turn_scope(system_prompt), prompt, _get_text_model_name(),
+                                    CHAT_PROMPT_VERSION, compute,
+                                    prepare=lambda: (None, _embed_question(cache, prompt)))
+    answered(text)
+    return text
+
+
+@api_view(['POST'])
+def generate_text_batch(request):
+    """
+    Answer a list of independent prompts sharing one system prompt, concurrently.
+    Nothing is added to any session history.
+    """
+    try:
+        system_prompt = request.data.get('system_prompt', '')
+        prompts = parse_items(request.data, 'prompts')
+        error = check_items(prompts, 'prompts')
+        if error is not None:
+            return Response({"generated_text": error}, status=400)
+        gemini_model = _get_gemini_model(system_prompt)
+
+        results = run_batch(prompts, lambda prompt: _batch_prompt(gemini_model, system_prompt, prompt),
+                            config("CHAT_BATCH_CONCURRENCY", default=4, cast=int), key="prompt")
+        if wants_stream(request):
+            return batch_sse_response(results)
+        return Response({"results": ordered(results)})
+    except ValueError as e:
+        print(e)
+        return Response({"generated_text": str(e)}, status=500)
+    except Exception as e:
+        print(e)
+        return Response({"generated_text": "Something went wrong. Please try again later."})
+
+
+async def _stream_message_async(gemini_model, session_id, history, system_prompt, prompt):
+    window = _history_window(history, system_prompt, prompt)
+    chat = gemini_model.start_chat(history=window)
+    started = time.perf_counter()
+    parts = []
+    usage = None
+    with upstream_call("stream", _get_text_model_name()):
+        response = await chat.send_message_async(prompt, stream=True)
+        async for chunk in atimed_chunks(response, "chat", started=started):
+            usage = chunk.usage_metadata
+            parts.append(chunk.text)
+            yield chunk.text
+    _count_tokens(usage, prompt, "".join(parts))
+
+    # History is only committed once the whole reply has been received
+    await run_blocking(_commit_history, session_id, history, window, chat.history)
+
+
+@csrf_exempt
+@require_POST
+async def generate_text_async(request):
+    """
+    ``generate_text`` for ASGI: the Gemini call is awaited instead of holding a worker thread
+    """
+    started = time.perf_counter()
+    try:
+        data = request_data(request)
+        session_id = data.get('session_id')
+        system_prompt = data.get('system_prompt', '')
+        prompt = data.get('prompt')
+        answered = _answered(started, prompt, in_background=True)
+        gemini_model = _get_gemini_model(system_prompt)
+
+        history = await run_blocking(_load_history, session_id)
+
+        # Only single-turn requests are cached, later turns depend on the conversation
+        answer_cache = get_answer_cache() if not history else None
+        on_complete = answered
+        if answer_cache is not None:
+            scope = _first_turn_scope(system_prompt)
+            model_name = _get_text_model_name()
+            answer, vector = await run_blocking(_lookup_first_turn, answer_cache, scope, prompt)
+            if answer is not None:
+                await run_blocking(_set_first_turn_history, session_id, prompt, answer)
+                answered(answer)
+                if wants_stream(request, data):
+                    return async_sse_response(aiter_values([answer]))
+                return JsonResponse({"generated_text": answer})
+
+            def on_complete(text):
+                answer_cache.put(scope, prompt, model_name, CHAT_PROMPT_VERSION, text, vector=vector)
+                answered(text)
+
+        chunks = _stream_message_async(gemini_model, session_id, history, system_prompt, prompt)
+        if wants_stream(request, data):
+            return async_sse_response(chunks, on_complete=on_complete)
+
+        text = "".join([chunk async for chunk in chunks])
+        on_complete(text)
+        return JsonResponse({"generated_text": text})
+    except ValueError as e:
+        print(e)
+        return JsonResponse({"generated_text": str(e)}, status=500)
+    except Exception as e:
+        print(e)
+        return JsonResponse({"generated_text": "Something went wrong. Please try again later."})
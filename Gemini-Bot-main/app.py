@@ -1,9 +1,15 @@
 import streamlit as st
 from PIL import Image
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import uuid
+import hashlib
 from decouple import config
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import io
+import json
+import time
 
 API_URL = config("API_URL", default=None)
 
@@ -15,6 +21,50 @@ system_prompt = st.sidebar.text_area("System Prompt:", value="You are a helpful
 if 'session_id' not in st.session_state:
     st.session_state.session_id = str(uuid.uuid4())
 
+# Questions asked at once on the image and PDF pages
+MAX_CONCURRENT_QUESTIONS = config("MAX_CONCURRENT_QUESTIONS", default=4, cast=int)
+# Seconds to wait for an uploaded PDF to be indexed
+PDF_INDEX_TIMEOUT = config("PDF_INDEX_TIMEOUT", default=600, cast=float)
+
+@st.cache_resource
+def get_http():
+    """
+    Keep-alive HTTP session shared by every rerun and user of this app
+    """
+    session = requests.Session()
+    # Only connection failures are retried: a POST that reached the backend is never sent twice
+    retries = Retry(total=2, connect=2, read=0, status=0, backoff_factor=0.3)
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=32, max_retries=retries)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+def stream_text(url, data, files=None):
+    """
+    POST a request with streaming on and yield the answer text as it arrives
+    """
+    data = {**data, 'stream': 'true'}
+    with get_http().post(url, data=data, files=files, stream=True) as response:
+        response.raise_for_status()
+        if not response.headers.get('Content-Type', '').startswith('text/event-stream'):
+            # Errors raised before the answer started come back as plain JSON
+            yield response.json()['generated_text']
+            return
+        response.encoding = 'utf-8'
+        event = None
+        # chunk_size=None hands over data as soon as the server flushes it
+        for line in response.iter_lines(chunk_size=None, decode_unicode=True):
+            if line.startswith('event:'):
+                event = line[len('event:'):].strip()
+            elif line.startswith('data:'):
+                payload = json.loads(line[len('data:'):])
+                if event == 'error':
+                    raise RuntimeError(payload['generated_text'])
+                if event is None:
+                    yield payload['text']
+            elif not line:
+                event = None
+
 def chatbot(session_id):
     if "messages" not in st.session_state:
         st.session_state.messages = []
@@ -42,64 +92,140 @@ def chatbot(session_id):
         
         st.session_state.messages.append({"role": "user", "content": prompt})
 
-        with st.spinner("Thinking..."):
-            data = {'session_id': st.session_state.session_id, 'system_prompt': system_prompt, 'prompt': prompt}
-            response = requests.post(f"{API_URL}/chat/", data=data)
-            result = response.json()
-            result = result['generated_text']
-
+        data = {'session_id': st.session_state.session_id, 'system_prompt': system_prompt, 'prompt': prompt}
         with st.chat_message("assistant"):
-            st.markdown(result)
+            try:
+                # Tokens are rendered as they arrive
+                result = st.write_stream(stream_text(f"{API_URL}/chat/", data))
+            except (requests.RequestException, RuntimeError) as e:
+                result = "Something went wrong. Please try again later."
+                st.error(f"{result} {e}")
 
         st.session_state.messages.append({"role": "assistant", "content": result})
 
+def post_text(url, data):
+    response = get_http().post(url, data=data)
+    response.raise_for_status()
+    return response.json()['generated_text']
+
+def ask_questions(url, data, questions):
+    """
+    Ask one question with a streamed answer, or several at once, each answer shown as soon as it is ready
+    """
+    if len(questions) == 1:
+        st.write_stream(stream_text(url, {**data, 'prompt': questions[0]}))
+        return
+    placeholders = []
+    for question in questions:
+        st.markdown(f"**{question}**")
+        placeholders.append(st.empty())
+    with ThreadPoolExecutor(max_workers=MAX_CONCURRENT_QUESTIONS) as executor:
+        futures = {executor.submit(post_text, url, {**data, 'prompt': question}): i
+                   for i, question in enumerate(questions)}
+        # Streamlit calls stay on this thread, workers only do the HTTP requests
+        for future in as_completed(futures):
+            placeholder = placeholders[futures[future]]
+            try:
+                placeholder.markdown(future.result())
+            except requests.RequestException as e:
+                placeholder.error(str(e))
+
+def read_questions(label, key):
+    text = st.text_area(label=f"{label} (one question per line)", key=key)
+    return [line.strip() for line in (text or '').splitlines() if line.strip()]
+
+def upload_once(kind, file_bytes, upload):
+    """
+    Run ``upload`` once per session and file content, returning the id the backend gave it
+    """
+    ids = st.session_state.setdefault(f'{kind}_ids', {})
+    file_hash = hashlib.sha256(file_bytes).hexdigest()
+    if file_hash not in ids:
+        ids[file_hash] = upload()
+    return file_hash, ids[file_hash]
+
+def forget_upload(kind, file_hash):
+    # The backend no longer has it: upload again on the next question
+    st.session_state.get(f'{kind}_ids', {}).pop(file_hash, None)
+
+def show_http_error(e):
+    st.error(f"Failed to send the data. Status code: {e.response.status_code}")
+    try:
+        st.error(e.response.json())
+    except:
+        st.error(e.response.text)
+
+def upload_image(session_id, name, image_bytes):
+    response = get_http().post(f"{API_URL}/image/upload/", data={'session_id': session_id},
+                               files={'image': (name, image_bytes)})
+    response.raise_for_status()
+    return response.json()['image_id']
+
+def upload_pdf(session_id, name, pdf_bytes):
+    response = get_http().post(f"{API_URL}/pdf/upload/", data={'session_id': session_id},
+                               files={'pdf': (name, pdf_bytes, 'application/pdf')})
+    response.raise_for_status()
+    status = response.json()
+    deadline = time.monotonic() + PDF_INDEX_TIMEOUT
+    delay = 0.5
+    with st.spinner("Indexing the PDF..."):
+        while status['status'] in ('queued', 'processing'):
+            if time.monotonic() >= deadline:
+                raise RuntimeError(f"The PDF is still {status['status']} after {PDF_INDEX_TIMEOUT:.0f} seconds. "
+                                   "Please try again later.")
+            time.sleep(min(delay, max(0.0, deadline - time.monotonic())))
+            # Short documents are ready within a second or two, long ones are polled less often
+            delay = min(delay * 2, 5)
+            response = get_http().get(f"{API_URL}/pdf/status/{status['document_id']}/")
+            response.raise_for_status()
+            status = response.json()
+    if status['status'] != 'ready':
+        raise RuntimeError(status.get('error') or "The PDF could not be processed.")
+    return status['document_id']
+
 def imagebot(session_id):
     uploaded_file = st.file_uploader("Please upload an image", type=["jpg", "jpeg", "png", "webp"])
 
     if uploaded_file is not None:
         image = Image.open(uploaded_file)
         st.image(image, caption='Your uploaded image', width=200)
-        prompt = st.text_input(label="Ask about uploaded image...", key=session_id)
-        if prompt is not None and st.button("Ask"):
-            with st.spinner("Thinking..."):
-                data = {'session_id': session_id,
-                        'system_prompt': system_prompt,
-                        'prompt': prompt,
-                        }
-                # Reset file pointer
-                uploaded_file.seek(0)
-                files = {'image': uploaded_file.read()}
-                response = requests.post(f"{API_URL}/image/", data=data, files=files)
-
-            if response.status_code == 200:
-                result = response.json()
-                result = result['generated_text']
-                st.markdown(result)
-            else:
-                st.error(f"Failed to send the data. Status code: {response.status_code}")
-                try:
-                    st.error(response.json())
-                except:
-                    st.error(response.text)
+        questions = read_questions("Ask about uploaded image...", key=session_id)
+        if questions and st.button("Ask"):
+            # Reset file pointer
+            uploaded_file.seek(0)
+            image_bytes = uploaded_file.read()
+            file_hash = None
+            try:
+                file_hash, image_id = upload_once(
+                    'image', image_bytes, lambda: upload_image(session_id, uploaded_file.name, image_bytes))
+                data = {'image_id': image_id, 'system_prompt': system_prompt}
+                ask_questions(f"{API_URL}/image/query/", data, questions)
+            except requests.HTTPError as e:
+                if e.response.status_code in (404, 410) and file_hash:
+                    forget_upload('image', file_hash)
+                show_http_error(e)
+            except (requests.RequestException, RuntimeError) as e:
+                st.error(str(e))
 
 def pdfchat(session_id):
     uploaded_pdf = st.file_uploader("Please upload a PDF", type=["pdf"])
     if uploaded_pdf is not None:
-        pdf_bytes = uploaded_pdf.read()
-        st.success("PDF Uploaded Succesfully!")
-        prompt = st.text_input(label="Ask about uploaded PDF...", key=session_id)
-        if prompt is not None and st.button("Ask"):
-            with st.spinner("Thinking..."):
-                files = {"pdf": (uploaded_pdf.name, pdf_bytes, "application/pdf")}
-                data = {"session_id": session_id, "prompt": prompt}
-                response = requests.post(f"{API_URL}/pdf/", data=data, files=files)
-
-            if response.status_code == 200:
-                result = response.json()
-                result = result['generated_text']
-                st.markdown(result)
-            else:
-                st.error("Failed to send the data.")
+        pdf_bytes = uploaded_pdf.getvalue()
+        file_hash = None
+        try:
+            # Uploaded and indexed once, while the user types their questions
+            file_hash, document_id = upload_once(
+                'document', pdf_bytes, lambda: upload_pdf(session_id, uploaded_pdf.name, pdf_bytes))
+            st.success("PDF Uploaded Succesfully!")
+            questions = read_questions("Ask about uploaded PDF...", key=session_id)
+            if questions and st.button("Ask"):
+                ask_questions(f"{API_URL}/pdf/query/", {'document_id': document_id}, questions)
+        except requests.HTTPError as e:
+            if e.response.status_code in (404, 409, 410) and file_hash:
+                forget_upload('document', file_hash)
+            show_http_error(e)
+        except (requests.RequestException, RuntimeError) as e:
+            st.error(str(e))
 
 
 